@@ -0,0 +1,151 @@
+"""Admission control for the database-bound routes.
+
+Each such route belongs to a lane, such as writes, cheap reads or bulk reads.
+A lane admits up to limit requests at a time and queues up to max_queue more
+in arrival order. A queued request that is not admitted within the lane's
+deadline gets a 503. So does one arriving to a full queue, or to a queue that
+would take longer than the deadline to drain at the lane's recent service
+time. Each 503 carries Retry-After. Lanes have their own slots, so writes
+never queue behind a burst of reads. Routes in no lane, such as /health and
+/metrics, are never held back.
+"""
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from starlette.responses import JSONResponse
+
+from metrics import ADMISSION_QUEUED, ADMISSION_SHED, ADMISSION_WAIT_SECONDS, ADMITTED, RouteTemplates
+
+# Weight of the latest request in a lane's moving average of service time
+SERVICE_SMOOTHING = 0.2
+
+
+class Overloaded(Exception):
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Lane:
+    """A concurrency limit with a bounded FIFO queue and a deadline for leaving it"""
+
+    def __init__(self, name: str, limit: int, max_queue: int, deadline: float):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.deadline = deadline
+        self.active = 0
+        # Seconds a request holds its slot, averaged; 0 until one has finished
+        self.service_seconds = 0.0
+        self.shed: Dict[str, int] = {}
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    def _drain_seconds(self, queued: int) -> float:
+        """Expected wait for a request behind queued others"""
+        return (queued + 1) / self.limit * self.service_seconds
+
+    async def acquire(self) -> None:
+        """Take a slot, waiting in the queue if need be; raises Overloaded instead of waiting in vain"""
+        if self.active < self.limit and not self._waiters:
+            self._admit(0.0)
+            return
+        queued = len(self._waiters)
+        if queued >= self.max_queue:
+            self._shed('queue_full', self._drain_seconds(queued))
+        if self._drain_seconds(queued) > self.deadline:
+            self._shed('deadline', self._drain_seconds(queued))
+        waiter = asyncio.get_event_loop().create_future()
+        self._waiters.append(waiter)
+        ADMISSION_QUEUED.inc(self.name)
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=self.deadline)
+        except asyncio.TimeoutError:
+            self._abandon(waiter)
+            self._shed('timeout', self._drain_seconds(len(self._waiters)))
+        except BaseException:
+            self._abandon(waiter)
+            raise
+        ADMISSION_QUEUED.dec(self.name)
+        ADMISSION_WAIT_SECONDS.observe(time.perf_counter() - start, self.name)
+
+    def _abandon(self, waiter: asyncio.Future) -> None:
+        ADMISSION_QUEUED.dec(self.name)
+        if waiter.done() and not waiter.cancelled():
+            # Handed a slot just as the wait ended; pass it on
+            self.release(0.0)
+        else:
+            waiter.cancel()
+            self._waiters.remove(waiter)
+
+    def _admit(self, waited: float) -> None:
+        self.active += 1
+        ADMITTED.inc(self.name)
+        ADMISSION_WAIT_SECONDS.observe(waited, self.name)
+
+    def release(self, held: float) -> None:
+        """Free a slot held for held seconds, handing it straight to the oldest waiter"""
+        if held:
+            self.service_seconds += SERVICE_SMOOTHING * (held - self.service_seconds)
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # The slot changes hands without active dropping, so no newcomer can take it first
+                waiter.set_result(None)
+                return
+        self.active -= 1
+        ADMITTED.dec(self.name)
+
+    def _shed(self, reason: str, wait: float) -> None:
+        self.shed[reason] = self.shed.get(reason, 0) + 1
+        ADMISSION_SHED.inc(self.name, reason)
+        raise Overloaded(reason, wait)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": self.active,
+            "queued": len(self._waiters),
+            "limit": self.limit,
+            "shed": dict(self.shed),
+            "service_seconds": round(self.service_seconds, 6),
+        }
+
+
+class AdmissionMiddleware:
+    """Pure ASGI middleware holding each request to a lane's slot for as long as it is served"""
+
+    def __init__(self, app, lanes: Dict[str, Lane], routes: Dict[Tuple[str, str], str]):
+        self.app = app
+        self.lanes = lanes
+        # (method, route template) -> lane name
+        self.routes = routes
+        self._route = RouteTemplates()
+
+    async def __call__(self, scope, receive, send):
+        lane: Optional[Lane] = None
+        if scope['type'] == 'http':
+            name = self.routes.get((scope['method'], self._route(scope)))
+            lane = self.lanes.get(name) if name is not None else None
+        if lane is None:
+            await self.app(scope, receive, send)
+            return
+        try:
+            await lane.acquire()
+        except Overloaded as e:
+            response = JSONResponse(
+                {"detail": f"Server overloaded ({lane.name} {e.reason.replace('_', ' ')}), retry later"},
+                status_code=503,
+                headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))},
+            )
+            await response(scope, receive, send)
+            return
+        start = time.perf_counter()
+        try:
+            # Streamed bodies are sent within this call, so the slot is held until the last chunk
+            await self.app(scope, receive, send)
+        finally:
+            lane.release(time.perf_counter() - start)
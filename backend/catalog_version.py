@@ -0,0 +1,65 @@
+"""Shared catalog version behind the ETags of /getall and /search.
+
+A one-row catalog_version table in MySQL holds a counter that /add,
+/remove, /add/batch and view flushes advance in the transaction making their
+change. Every worker process keeps the last value it saw, advancing it after
+its own writes and reloading it every refresh_interval seconds for the
+writes of the others, so a conditional request is answered without
+touching MySQL.
+"""
+import asyncio
+from typing import Optional
+
+from database import Database
+
+# LAST_INSERT_ID(expr) hands the new value back through the cursor's lastrowid
+_BUMP = "UPDATE catalog_version SET version = LAST_INSERT_ID(version + 1) WHERE id = 1"
+
+
+def bump_catalog_version(cursor) -> int:
+    """Advance the catalog version within the cursor's transaction and return the new value"""
+    cursor.execute(_BUMP)
+    return cursor.lastrowid
+
+
+class CatalogVersion:
+    """This worker's view of the catalog version, None until it is first loaded"""
+
+    def __init__(self, db: Database, refresh_interval: float = 0.5):
+        self.db = db
+        self.refresh_interval = refresh_interval
+        self.value: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """Start the periodic reload; must be called from the running event loop"""
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def advance(self, version: int) -> None:
+        """Record a version committed by this worker; the counter only grows, so older values are ignored"""
+        if self.value is None or version > self.value:
+            self.value = version
+
+    async def refresh(self) -> None:
+        row = await self.db.fetchone(
+            "SELECT version FROM catalog_version WHERE id = 1", dictionary=False, name="catalog_version"
+        )
+        if row is not None:
+            self.advance(row[0])
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                print(f"Error reloading catalog version: {e}")
+            await asyncio.sleep(self.refresh_interval)
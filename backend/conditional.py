@@ -0,0 +1,32 @@
+"""Strong ETags and If-None-Match handling for /getall and /search.
+
+A response's ETag is the catalog version it was read at plus a hash of what
+was asked for, so every worker process gives the same request the same tag
+and knows it before running a query. A conditional request whose tag is
+still current is answered with 304 without reading or encoding anything,
+sparing MySQL the query and the client, or the nginx cache, the transfer.
+"""
+import hashlib
+from typing import Any
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+
+def etag(version: int, *variant: Any) -> str:
+    """The strong ETag of a response variant, such as a path and its query, at a catalog version"""
+    return f'"{version}-{hashlib.blake2b(repr(variant).encode(), digest_size=8).hexdigest()}"'
+
+
+def matches(request: Request, tag: str) -> bool:
+    """Whether If-None-Match names tag; as RFC 9110 asks of GET, weak tags compare by their value"""
+    header = request.headers.get('if-none-match')
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    return any(candidate.strip().removeprefix('W/') == tag for candidate in header.split(','))
+
+
+def not_modified(tag: str, cache_control: str) -> Response:
+    return Response(status_code=304, headers={'ETag': tag, 'Cache-Control': cache_control})
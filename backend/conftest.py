@@ -0,0 +1 @@
+# Present so pytest puts this directory on sys.path and tests import the server modules by name
@@ -0,0 +1,282 @@
+"""Pooled, non-blocking MySQL access for main_server.
+
+mysql-connector is a blocking driver, so every statement runs on a dedicated
+thread pool that is exactly as large as the connection pool. Handlers await
+the helpers below and the event loop keeps serving other requests while MySQL
+works.
+"""
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Sequence, Tuple
+
+import mysql.connector
+from mysql.connector import Error, InterfaceError, OperationalError
+from fastapi import HTTPException
+
+from metrics import ACQUIRE_SECONDS, QUERY_SECONDS
+
+
+class Database:
+    """Bounded connection pool whose connections are only ever used from worker threads"""
+
+    def __init__(
+        self,
+        config: Dict[str, Any],
+        pool_size: int = 10,
+        acquire_timeout: float = 5.0,
+        query_timeout: float = 10.0,
+        ping_interval: float = 30.0,
+    ):
+        self.config = config
+        self.pool_size = pool_size
+        self.acquire_timeout = acquire_timeout
+        self.query_timeout = query_timeout
+        self.ping_interval = ping_interval
+        # LIFO so the hottest connections are reused and idle ones age out
+        self._idle: "queue.LifoQueue[Tuple[Any, float]]" = queue.LifoQueue()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        # Connections open, idle or in use, counted from worker threads
+        self._opened = 0
+        self._opened_lock = threading.Lock()
+
+    def start(self) -> None:
+        """Create the worker threads; must be called from the running event loop"""
+        self._executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix="db")
+        self._slots = asyncio.Semaphore(self.pool_size)
+
+    def close(self) -> None:
+        """Wait for in-flight statements and close every pooled connection"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self.discard_idle()
+
+    def discard_idle(self) -> None:
+        """Close every idle pooled connection, e.g. once the server behind them went away"""
+        while True:
+            try:
+                cnx, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(cnx)
+
+    def _connect(self):
+        try:
+            cnx = mysql.connector.connect(autocommit=True, **self.config)
+            cursor = cnx.cursor()
+            # Per-query limits: SELECTs are killed server side after max_execution_time,
+            # writes give up waiting on row locks after innodb_lock_wait_timeout
+            cursor.execute(
+                "SET SESSION max_execution_time = %s, innodb_lock_wait_timeout = %s",
+                (int(self.query_timeout * 1000), max(1, int(round(self.query_timeout)))),
+            )
+            cursor.close()
+        except Error as e:
+            raise HTTPException(status_code=500, detail=f"Database connection error: {str(e)}")
+        with self._opened_lock:
+            self._opened += 1
+        return cnx
+
+    def _discard(self, cnx) -> None:
+        with self._opened_lock:
+            self._opened -= 1
+        try:
+            cnx.close()
+        except Error:
+            pass
+
+    def _checkout(self):
+        try:
+            cnx, last_used = self._idle.get_nowait()
+        except queue.Empty:
+            # Never exceeds pool_size: at most pool_size worker threads hold a connection
+            return self._connect()
+        if time.monotonic() - last_used > self.ping_interval:
+            # Health check connections that sat idle long enough to be dropped by the server
+            try:
+                cnx.ping()
+            except Error:
+                self._discard(cnx)
+                return self._connect()
+        return cnx
+
+    def _checkin(self, cnx) -> None:
+        if self._opened > self.pool_size:
+            # Only when warm() raced requests that connected for themselves
+            self._discard(cnx)
+            return
+        self._idle.put((cnx, time.monotonic()))
+
+    def _open_idle(self) -> None:
+        if self._opened < self.pool_size:
+            self._checkin(self._connect())
+
+    def _call(self, fn: Callable, args: Sequence[Any], name: str, waited_since: float) -> Any:
+        cnx = self._checkout()
+        started = time.perf_counter()
+        ACQUIRE_SECONDS.observe(started - waited_since)
+        try:
+            with QUERY_SECONDS.time(name):
+                result = fn(cnx, *args)
+        except (InterfaceError, OperationalError):
+            # The connection itself is suspect, do not hand it to the next request
+            self._discard(cnx)
+            raise
+        except BaseException:
+            self._checkin(cnx)
+            raise
+        self._checkin(cnx)
+        return result
+
+    async def run(self, fn: Callable, *args: Any, name: Optional[str] = None) -> Any:
+        """Run fn(connection, *args) on a pooled connection without blocking the event loop
+
+        Timings are recorded under name, by default the name of fn.
+        """
+        if self._slots is None:
+            raise HTTPException(status_code=503, detail="Database is not ready")
+        waited_since = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.acquire_timeout)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=503, detail="Timed out waiting for a database connection")
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._executor, self._call, fn, args, name or fn.__name__.lstrip('_'), waited_since
+            )
+        finally:
+            self._slots.release()
+
+    async def warm(self) -> int:
+        """Open the pool's missing connections up front so the first requests do not pay for connecting"""
+        loop = asyncio.get_running_loop()
+        # Connected on the default executor and put straight into the idle queue, so requests
+        # served meanwhile keep every slot and pool thread
+        missing = self.pool_size - self._opened
+        await asyncio.gather(*(loop.run_in_executor(None, self._open_idle) for _ in range(missing)))
+        return self._idle.qsize()
+
+    async def fetchall(
+        self, sql: str, params: Sequence[Any] = (), dictionary: bool = True, name: str = "fetchall"
+    ) -> List[Any]:
+        return await self.run(_fetchall, sql, params, dictionary, name=name)
+
+    async def fetchone(
+        self, sql: str, params: Sequence[Any] = (), dictionary: bool = True, name: str = "fetchone"
+    ) -> Optional[Any]:
+        return await self.run(_fetchone, sql, params, dictionary, name=name)
+
+    async def execute(self, sql: str, params: Sequence[Any] = (), name: str = "execute") -> int:
+        """Run a single autocommitted write and return the affected row count"""
+        return await self.run(_execute, sql, params, name=name)
+
+    async def transaction(self, fn: Callable, *args: Any, name: Optional[str] = None) -> Any:
+        """Run fn(cursor, *args) in one transaction, committing on success and rolling back on error"""
+        return await self.run(_transaction, fn, args, name=name or fn.__name__.lstrip('_'))
+
+    async def stream(
+        self, sql: str, params: Sequence[Any] = (), batch_size: int = 1000, dictionary: bool = True,
+        name: str = "stream",
+    ) -> AsyncIterator[List[Any]]:
+        """Yield the rows of one unbuffered SELECT in batches of batch_size
+
+        Rows are read off the wire as they are consumed, so memory stays flat
+        for any result size. The pooled connection is held until the generator
+        finishes, and is closed rather than reused if it stops early.
+        """
+        if self._slots is None:
+            raise HTTPException(status_code=503, detail="Database is not ready")
+        waited_since = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.acquire_timeout)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=503, detail="Timed out waiting for a database connection")
+        loop = asyncio.get_running_loop()
+        cnx = cursor = None
+        started = None
+        finished = False
+        try:
+            cnx = await loop.run_in_executor(self._executor, self._checkout)
+            started = time.perf_counter()
+            ACQUIRE_SECONDS.observe(started - waited_since)
+            cursor = await loop.run_in_executor(self._executor, _open_stream, cnx, sql, params, dictionary)
+            while True:
+                rows = await loop.run_in_executor(self._executor, cursor.fetchmany, batch_size)
+                if not rows:
+                    break
+                yield rows
+            await loop.run_in_executor(self._executor, _close_stream, cnx, cursor, self.query_timeout)
+            finished = True
+        finally:
+            if started is not None:
+                QUERY_SECONDS.observe(time.perf_counter() - started, name)
+            if cnx is not None:
+                if finished:
+                    self._checkin(cnx)
+                else:
+                    # Unread rows are still on the wire, the connection cannot be reused
+                    self._discard(cnx)
+            self._slots.release()
+
+
+def _open_stream(cnx, sql: str, params: Sequence[Any], dictionary: bool):
+    cursor = cnx.cursor(dictionary=dictionary)
+    # A stream runs as long as the client keeps reading, not the per-query limit
+    cursor.execute("SET SESSION max_execution_time = 0")
+    cursor.execute(sql, params)
+    return cursor
+
+
+def _close_stream(cnx, cursor, query_timeout: float) -> None:
+    cursor.close()
+    restore = cnx.cursor()
+    try:
+        restore.execute("SET SESSION max_execution_time = %s", (int(query_timeout * 1000),))
+    finally:
+        restore.close()
+
+
+def _fetchall(cnx, sql: str, params: Sequence[Any], dictionary: bool) -> List[Any]:
+    cursor = cnx.cursor(dictionary=dictionary)
+    try:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+def _fetchone(cnx, sql: str, params: Sequence[Any], dictionary: bool) -> Optional[Any]:
+    cursor = cnx.cursor(dictionary=dictionary, buffered=True)
+    try:
+        cursor.execute(sql, params)
+        return cursor.fetchone()
+    finally:
+        cursor.close()
+
+
+def _execute(cnx, sql: str, params: Sequence[Any]) -> int:
+    cursor = cnx.cursor()
+    try:
+        cursor.execute(sql, params)
+        return cursor.rowcount
+    finally:
+        cursor.close()
+
+
+def _transaction(cnx, fn: Callable, args: Sequence[Any]) -> Any:
+    cnx.start_transaction()
+    cursor = cnx.cursor()
+    try:
+        result = fn(cursor, *args)
+        cnx.commit()
+        return result
+    except BaseException:
+        cnx.rollback()
+        raise
+    finally:
+        cursor.close()
@@ -0,0 +1,240 @@
+"""On-disk LRU cache of product images and their resized variants.
+
+An original is fetched from the object store once and kept as a file. Each
+width asked for is resized from that file on first use and kept beside it.
+Files are named by a hash of their image path and width, then a hash of their
+content that doubles as their ETag, so the cache is rebuilt from a directory
+listing after a restart. Once the files exceed max_bytes the least recently
+served are deleted. Concurrent misses for the same file share one fetch or
+resize. Files are only ever created by rename, so a reader holding one open
+keeps reading it whole even if it is evicted meanwhile.
+"""
+import hashlib
+import io
+import os
+import secrets
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from cache import SingleFlight
+from metrics import OBJECT_STORE_SECONDS
+from object_store import ObjectRef
+
+# Extension of each format cached files are kept in, and what it is served as
+MEDIA_TYPES = {
+    'jpg': 'image/jpeg',
+    'png': 'image/png',
+    'gif': 'image/gif',
+    'webp': 'image/webp',
+    'bin': 'application/octet-stream',
+}
+# Pillow format name -> extension, for the formats variants are written back in; others become PNG
+_VARIANT_FORMATS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif', 'WEBP': 'webp'}
+
+_CHUNK = 256 * 1024
+
+
+class ImageError(Exception):
+    pass
+
+
+class CachedImage(NamedTuple):
+    path: str
+    size: int
+    etag: str
+    media_type: str
+
+
+def _key(image_src: str, width: int) -> str:
+    """Name prefix of the cached file for image_src at width, 0 being the original"""
+    return hashlib.sha256(f"{image_src}\0{width}".encode('utf-8')).hexdigest()[:32]
+
+
+def _sniff(head: bytes) -> str:
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    return 'bin'
+
+
+def _entry(path: str, size: int) -> CachedImage:
+    # <key>-<content digest>.<extension>
+    stem, _, extension = os.path.basename(path).rpartition('.')
+    return CachedImage(path, size, f'"{stem.partition("-")[2]}"', MEDIA_TYPES[extension])
+
+
+class ImageCache:
+    """Originals and resized variants of object store images, kept within max_bytes on disk"""
+
+    def __init__(
+        self, fetch: Callable[[str, str, str], bool], directory: str, max_bytes: int, widths: Sequence[int],
+        quality: int = 85,
+    ):
+        # Blocking fetch(bucket, key, filename) -> False if there is no such object, e.g. ObjectStore.download
+        self.fetch = fetch
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.widths = tuple(sorted(widths))
+        self.quality = quality
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Key -> cached file, least recently served first
+        self._entries: "OrderedDict[str, CachedImage]" = OrderedDict()
+        self._fills = SingleFlight()
+
+    def load(self) -> None:
+        """Index the files left by an earlier run, oldest first; blocking, so run it on a worker thread"""
+        os.makedirs(self.directory, exist_ok=True)
+        found: List[Tuple[float, str, int]] = []
+        for file in os.scandir(self.directory):
+            if not file.is_file():
+                continue
+            stem, _, extension = file.name.rpartition('.')
+            if extension == 'tmp':
+                # Left by an interrupted write
+                os.unlink(file.path)
+                continue
+            if extension not in MEDIA_TYPES or '-' not in stem:
+                continue
+            stat = file.stat()
+            found.append((stat.st_mtime, file.path, stat.st_size))
+        # Newest first, each put in front of the ones already indexed, which were served since startup
+        for _, path, size in sorted(found, reverse=True):
+            key = os.path.basename(path).partition('-')[0]
+            if key in self._entries:
+                os.unlink(path)
+                continue
+            self._entries[key] = _entry(path, size)
+            self._entries.move_to_end(key, last=False)
+            self.bytes += size
+        self._evict()
+
+    async def get(self, image_src: str, ref: ObjectRef, width: int = 0) -> Optional[CachedImage]:
+        """The cached file for image_src at width (0 for the original), or None if the object does not exist"""
+        key = _key(image_src, width)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+        self.misses += 1
+        return await self._fills.do(key, lambda: self._fill(key, image_src, ref, width))
+
+    def forget(self, entry: CachedImage) -> None:
+        """Drop an entry whose file has gone, so the next get fetches it again"""
+        key = os.path.basename(entry.path).partition('-')[0]
+        if self._entries.get(key) == entry:
+            del self._entries[key]
+            self.bytes -= entry.size
+
+    async def _fill(self, key: str, image_src: str, ref: ObjectRef, width: int) -> Optional[CachedImage]:
+        if not width:
+            entry = await run_in_threadpool(self._download, key, ref)
+        else:
+            original = await self.get(image_src, ref)
+            if original is None:
+                return None
+            try:
+                entry = await run_in_threadpool(self._resize, key, original.path, width)
+            except FileNotFoundError:
+                # The original was evicted before it could be read; fetch it once more
+                self.forget(original)
+                original = await self.get(image_src, ref)
+                if original is None:
+                    return None
+                entry = await run_in_threadpool(self._resize, key, original.path, width)
+        if entry is not None:
+            self._entries[key] = entry
+            self.bytes += entry.size
+            self._evict()
+        return entry
+
+    def _temporary(self) -> str:
+        return os.path.join(self.directory, f"{secrets.token_hex(8)}.tmp")
+
+    def _store(self, temporary: str, key: str, digest: str, extension: str) -> CachedImage:
+        path = os.path.join(self.directory, f"{key}-{digest}.{extension}")
+        os.replace(temporary, path)
+        return _entry(path, os.path.getsize(path))
+
+    def _download(self, key: str, ref: ObjectRef) -> Optional[CachedImage]:
+        temporary = self._temporary()
+        try:
+            with OBJECT_STORE_SECONDS.time("download"):
+                fetched = self.fetch(*ref, temporary)
+            if not fetched:
+                return None
+            digest = hashlib.sha256()
+            with open(temporary, 'rb') as f:
+                head = f.read(_CHUNK)
+                chunk = head
+                while chunk:
+                    digest.update(chunk)
+                    chunk = f.read(_CHUNK)
+            return self._store(temporary, key, digest.hexdigest()[:20], _sniff(head))
+        finally:
+            if os.path.exists(temporary):
+                os.unlink(temporary)
+
+    def _resize(self, key: str, original: str, width: int) -> CachedImage:
+        # Imported on the first resize rather than at server startup
+        from PIL import Image, UnidentifiedImageError
+        try:
+            with Image.open(original) as image:
+                source_format = image.format
+                height = max(1, round(image.height * width / image.width))
+                if source_format == 'JPEG':
+                    # Decodes at the smallest DCT scale still at least this large, far cheaper than full size
+                    image.draft('RGB', (width, height))
+                # Bounded by width only, and never enlarged
+                image.thumbnail((width, image.height), Image.Resampling.LANCZOS, reducing_gap=3.0)
+                output_format = source_format if source_format in _VARIANT_FORMATS else 'PNG'
+                if output_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+                    image = image.convert('RGB')
+                options: Dict[str, Any] = {'quality': self.quality} if output_format in ('JPEG', 'WEBP') else {}
+                buffer = io.BytesIO()
+                image.save(buffer, output_format, **options)
+        except FileNotFoundError:
+            raise
+        except (UnidentifiedImageError, OSError, ValueError) as e:
+            raise ImageError(f"Cannot resize {original}: {e}")
+        data = buffer.getvalue()
+        temporary = self._temporary()
+        try:
+            with open(temporary, 'wb') as f:
+                f.write(data)
+            return self._store(temporary, key, hashlib.sha256(data).hexdigest()[:20], _VARIANT_FORMATS[output_format])
+        finally:
+            if os.path.exists(temporary):
+                os.unlink(temporary)
+
+    def _evict(self) -> None:
+        # The most recent entry always stays, even if it alone exceeds the budget
+        while self.bytes > self.max_bytes and len(self._entries) > 1:
+            _, entry = self._entries.popitem(last=False)
+            self.bytes -= entry.size
+            self.evictions += 1
+            try:
+                os.unlink(entry.path)
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "widths": list(self.widths),
+        }
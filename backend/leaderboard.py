@@ -0,0 +1,201 @@
+"""In-memory most-viewed leaderboard for /getall.
+
+The top `depth` products by view count are loaded from MySQL and kept sorted
+in memory, so the landing page is a slice of an already ordered list instead
+of a sort of the whole product x view join per request. Views, adds and
+removes update the list as they happen; a periodic reload corrects any drift.
+
+Products below the loaded depth are not tracked individually. At load time
+each of them had at most the view count of the last loaded row (the
+boundary), so the views they gained since are enough to tell when one of them
+might have climbed into the top `size`, and only then is an early reload
+scheduled.
+"""
+import asyncio
+import bisect
+from typing import Any, Dict, List, Optional, Tuple
+
+from database import Database
+from view_counter import ViewCounter
+
+# Sort key matching ORDER BY v.view_count DESC, p.product_id DESC, negated so
+# the list sorts ascending; products without a view row sort after every count
+Key = Tuple[int, int]
+
+
+def _key(product_id: int, view_count: Optional[int]) -> Key:
+    return (-(view_count if view_count is not None else -1), -product_id)
+
+
+class Leaderboard:
+    """Products with the most views, kept in view_count DESC, product_id DESC order"""
+
+    def __init__(
+        self,
+        db: Database,
+        views: ViewCounter,
+        size: int = 20,
+        depth: int = 200,
+        reconcile_interval: float = 60.0,
+    ):
+        self.db = db
+        self.views = views
+        self.size = size
+        self.depth = max(depth, size)
+        self.reconcile_interval = reconcile_interval
+        self._keys: List[Key] = []
+        self._rows: Dict[int, Dict[str, Any]] = {}
+        self._counts: Dict[int, Optional[int]] = {}
+        # Views gained since the last load by products that are not on the board
+        self._outside: Dict[int, int] = {}
+        self._boundary: Optional[int] = None
+        self._complete = False
+        self._loaded = False
+        # Bumped on every change to the board, so callers can cache what they derive from top()
+        self.version = 0
+        self._wake: Optional[asyncio.Event] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """Start the background reconciler; must be called from the running event loop"""
+        self._wake = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def top(self) -> List[Dict[str, Any]]:
+        """The current top `size` products, view_count defaulting to 0"""
+        if not self._loaded:
+            await self.reconcile()
+        return [
+            {**self._rows[-negated_id], 'view_count': max(-negated_count, 0)}
+            for negated_count, negated_id in self._keys[:self.size]
+        ]
+
+    def record_view(self, product_id: int, views: int = 1) -> None:
+        if product_id in self._counts:
+            count = self._counts[product_id]
+            self._move(product_id, _key(product_id, count), (count or 0) + views)
+            self.version += 1
+            return
+        gained = self._outside.get(product_id, 0) + views
+        self._outside[product_id] = gained
+        if not self._complete and self._boundary is not None and self._could_enter(self._boundary + gained):
+            self._refresh_soon()
+
+    def add(self, row: Dict[str, Any]) -> None:
+        """Place a newly added product, which has no view row yet"""
+        product_id = row['product_id']
+        if product_id in self._counts:
+            self.remove(product_id)
+        key = _key(product_id, None)
+        if not self._complete and (not self._keys or key > self._keys[-1]):
+            # Below everything tracked, and below the boundary too
+            return
+        self._rows[product_id] = {k: row[k] for k in ('product_id', 'name', 'description', 'image_src', 'price')}
+        self._counts[product_id] = None
+        bisect.insort(self._keys, key)
+        self._trim()
+        self.version += 1
+
+    def remove(self, product_id: int) -> None:
+        self._outside.pop(product_id, None)
+        if product_id not in self._counts:
+            return
+        count = self._counts.pop(product_id)
+        del self._rows[product_id]
+        del self._keys[bisect.bisect_left(self._keys, _key(product_id, count))]
+        self.version += 1
+        if len(self._keys) < self.size and not self._complete:
+            self._refresh_soon()
+
+    async def reconcile(self) -> None:
+        """Reload the board from MySQL plus the views the counter has not flushed yet"""
+        async with self._lock:
+            # Flushed first so the load already counts nearly every view recorded so far
+            await self.views.flush()
+            rows = await self.db.run(_load_top, self.depth)
+            self._load(rows)
+
+    def preload(self, rows: List[Dict[str, Any]]) -> None:
+        """Fill the board from a catalog snapshot's top depth rows, unless MySQL already has"""
+        if not self._loaded:
+            self._load(rows)
+
+    def _load(self, rows: List[Dict[str, Any]]) -> None:
+        pending = self.views.pending()
+        self._rows = {}
+        self._counts = {}
+        for row in rows:
+            product_id = row.pop('product_id')
+            count = row.pop('view_count')
+            if product_id in pending:
+                count = (count or 0) + pending.pop(product_id)
+            self._rows[product_id] = {'product_id': product_id, **row}
+            self._counts[product_id] = count
+        self._keys = sorted(_key(product_id, count) for product_id, count in self._counts.items())
+        self._complete = len(rows) < self.depth
+        self._boundary = None if self._complete else max(-self._keys[-1][0], 0)
+        # Whatever is still pending belongs to products below the boundary
+        # (or removed meanwhile) and counts toward their climb from it
+        self._outside = {} if self._complete else pending
+        self._loaded = True
+        self.version += 1
+
+    def _move(self, product_id: int, old: Key, count: int) -> None:
+        del self._keys[bisect.bisect_left(self._keys, old)]
+        self._counts[product_id] = count
+        bisect.insort(self._keys, _key(product_id, count))
+
+    def _trim(self) -> None:
+        while len(self._keys) > self.depth:
+            negated_count, negated_id = self._keys.pop()
+            del self._rows[-negated_id]
+            del self._counts[-negated_id]
+            self._complete = False
+            self._boundary = max(self._boundary or 0, -negated_count)
+
+    def _could_enter(self, views: int) -> bool:
+        if len(self._keys) < self.size:
+            return True
+        return views >= -self._keys[self.size - 1][0]
+
+    def _refresh_soon(self) -> None:
+        if self._wake is not None:
+            self._wake.set()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.reconcile_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.reconcile()
+            except Exception as e:
+                print(f"Error reconciling leaderboard: {e}")
+
+
+def _load_top(cnx, limit: int) -> List[Dict[str, Any]]:
+    cursor = cnx.cursor(dictionary=True)
+    try:
+        cursor.execute("""
+            SELECT p.product_id, p.name, p.description, p.image_src, p.price, v.view_count
+            FROM product p
+            LEFT JOIN view v ON p.product_id = v.product_id
+            ORDER BY v.view_count DESC, p.product_id DESC
+            LIMIT %s
+        """, (limit,))
+        return cursor.fetchall()
+    finally:
+        cursor.close()
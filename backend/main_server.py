@@ -1,9 +1,35 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-import mysql.connector
+import time
+
+# Import time of this module, reported by /ready; set before the heavier imports below
+IMPORT_STARTED = time.perf_counter()
+
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, ValidationError
 from mysql.connector import Error, IntegrityError, DataError, ProgrammingError
-from google.cloud import storage
-from typing import List, Optional
+from admission import AdmissionMiddleware, Lane
+from database import Database
+from replicas import ReplicaSet
+from view_counter import ViewCounter
+from view_rollups import ViewRollups, parse_window
+from leaderboard import Leaderboard
+from product_ids import ProductIds
+from purchase_log import PurchaseLog
+from cache import MISSING, SingleFlight, TTLCache
+from object_store import ObjectRef, object_store_from_env, parse_gcs_path
+from image_cache import ImageCache, ImageError
+import metrics
+from phonetic import soundex
+from pagination import decode_cursor, encode_cursor
+from catalog_version import CatalogVersion, bump_catalog_version
+from conditional import etag, matches, not_modified
+from serialization import PRODUCT_FIELDS, JSONBytes, ndjson, product_dicts, products_page
+from catalog_snapshot import SnapshotError, SnapshotReader
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+import asyncio
+import heapq
+import json
 import re
 import os
 import sys
@@ -27,17 +53,263 @@ DB_CONFIG = {
     'database': requireenv('MYSQL_DATABASE')
 }
 
+# Connection pool sizing and per-query limits (seconds)
+POOL_CONFIG = {
+    'pool_size': int(os.getenv('MYSQL_POOL_SIZE', '10')),
+    'acquire_timeout': float(os.getenv('MYSQL_POOL_TIMEOUT', '5')),
+    'query_timeout': float(os.getenv('MYSQL_QUERY_TIMEOUT', '10')),
+    'ping_interval': float(os.getenv('MYSQL_POOL_PING_INTERVAL', '30')),
+}
+
+# Read replicas for /search, /getall pages and /products/stream: comma-separated host[:port] list,
+# pool size per replica, seconds a client keeps reading from the primary after it writes, seconds
+# between health checks, and the replication lag (seconds) beyond which a replica is dropped (0 = unchecked)
+REPLICA_CONFIG = {
+    'hosts': [host.strip() for host in os.getenv('MYSQL_REPLICA_HOSTS', '').split(',') if host.strip()],
+    'pool_size': int(os.getenv('MYSQL_REPLICA_POOL_SIZE', str(POOL_CONFIG['pool_size']))),
+    'read_your_writes': float(os.getenv('READ_YOUR_WRITES_SECONDS', '5')),
+    'check_interval': float(os.getenv('REPLICA_CHECK_INTERVAL', '5')),
+    'max_lag': float(os.getenv('REPLICA_MAX_LAG', '0')),
+}
+
+# Admission control per lane: concurrent requests, further requests queued, and seconds a queued
+# request may wait before it gets a 503. Writes keep a share of the primary pool that reads cannot
+# take; bulk reads (streams and analytics scans) hold connections longest and get a few slots.
+_WRITE_LIMIT = int(os.getenv('ADMISSION_WRITE_LIMIT', str(max(1, POOL_CONFIG['pool_size'] // 2))))
+_READ_SLOTS = (
+    max(1, POOL_CONFIG['pool_size'] - _WRITE_LIMIT) + len(REPLICA_CONFIG['hosts']) * REPLICA_CONFIG['pool_size']
+)
+ADMISSION_CONFIG = {
+    'write': {
+        'limit': _WRITE_LIMIT,
+        'max_queue': int(os.getenv('ADMISSION_WRITE_QUEUE', '100')),
+        'deadline': float(os.getenv('ADMISSION_WRITE_DEADLINE', '2')),
+    },
+    'read': {
+        'limit': int(os.getenv('ADMISSION_READ_LIMIT', str(_READ_SLOTS))),
+        'max_queue': int(os.getenv('ADMISSION_READ_QUEUE', '200')),
+        'deadline': float(os.getenv('ADMISSION_READ_DEADLINE', '1')),
+    },
+    'bulk': {
+        'limit': int(os.getenv('ADMISSION_BULK_LIMIT', str(max(1, _READ_SLOTS // 4)))),
+        'max_queue': int(os.getenv('ADMISSION_BULK_QUEUE', '10')),
+        'deadline': float(os.getenv('ADMISSION_BULK_DEADLINE', '1')),
+    },
+    # Image misses wait on the object store rather than MySQL, so they get slots of their own
+    'image': {
+        'limit': int(os.getenv('ADMISSION_IMAGE_LIMIT', '32')),
+        'max_queue': int(os.getenv('ADMISSION_IMAGE_QUEUE', '256')),
+        'deadline': float(os.getenv('ADMISSION_IMAGE_DEADLINE', '2')),
+    },
+}
+
+# Lane of each database-bound route; the rest, /health and /ready among them, are never queued
+ADMISSION_ROUTES = {
+    ('POST', '/add'): 'write',
+    ('POST', '/add/batch'): 'write',
+    ('DELETE', '/remove/{product_id}'): 'write',
+    ('GET', '/search'): 'read',
+    ('GET', '/getall'): 'read',
+    ('GET', '/analytics/view/{product_id}'): 'read',
+    ('GET', '/products/stream'): 'bulk',
+    ('GET', '/analytics/trending'): 'bulk',
+    ('GET', '/analytics/views/{product_id}'): 'bulk',
+    ('GET', '/images/{product_id}'): 'image',
+}
+
+# Write-behind view counting: flush every interval seconds or once this many products are pending
+VIEW_CONFIG = {
+    'flush_interval': float(os.getenv('VIEW_FLUSH_INTERVAL', '1')),
+    'max_pending': int(os.getenv('VIEW_FLUSH_MAX_PENDING', '1000')),
+}
+
+# Time-bucketed views: seconds between rollups, and how long minute, hour and day buckets are kept
+try:
+    VIEW_ROLLUP_CONFIG = {
+        'interval': float(os.getenv('VIEW_ROLLUP_INTERVAL', '60')),
+        'retention': {
+            'minute': parse_window(os.getenv('VIEW_MINUTE_RETENTION', '6h')),
+            'hour': parse_window(os.getenv('VIEW_HOUR_RETENTION', '15d')),
+            'day': parse_window(os.getenv('VIEW_DAY_RETENTION', '400d')),
+        },
+    }
+except ValueError as e:
+    print(f"Error: {e}", file=sys.stderr)
+    sys.exit(1)
+
+# Live product IDs answering /analytics/view existence checks: seconds between reloads from MySQL
+PRODUCT_IDS_CONFIG = {
+    'resync_interval': float(os.getenv('PRODUCT_IDS_RESYNC_INTERVAL', '60')),
+}
+
+# Set by serve.py for each process it forks; a plain `python main_server.py` is the only worker
+WORKER_CONFIG = {
+    'index': int(os.getenv('WEB_WORKER_INDEX', '0')),
+    'workers': int(os.getenv('WEB_WORKERS', '1')),
+}
+
+# Purchase log: directory, pending-write and unloaded-purchase limits, and MySQL load batching
+PURCHASE_CONFIG = {
+    'directory': os.getenv('PURCHASE_LOG_DIR', 'data/purchases'),
+    'segment_bytes': int(os.getenv('PURCHASE_LOG_SEGMENT_BYTES', str(16 * 1024 * 1024))),
+    'max_queue': int(os.getenv('PURCHASE_MAX_QUEUE', '10000')),
+    'max_backlog': int(os.getenv('PURCHASE_MAX_BACKLOG', '1000000')),
+    'load_batch': int(os.getenv('PURCHASE_LOAD_BATCH', '1000')),
+    'load_interval': float(os.getenv('PURCHASE_LOAD_INTERVAL', '1')),
+}
+if 'WEB_WORKER_INDEX' in os.environ:
+    # One writer per log, so each worker keeps its own and recovers it when restarted
+    PURCHASE_CONFIG['directory'] = os.path.join(PURCHASE_CONFIG['directory'], f"worker-{WORKER_CONFIG['index']}")
+
+# Most-viewed products for /getall: rows kept in memory and seconds between reloads from MySQL
+LEADERBOARD_CONFIG = {
+    'depth': int(os.getenv('LEADERBOARD_DEPTH', '200')),
+    'reconcile_interval': float(os.getenv('LEADERBOARD_RECONCILE_INTERVAL', '60')),
+}
+
+# Bulk ingest through /add/batch: items per request and rows per INSERT/transaction
+BATCH_CONFIG = {
+    'max_items': int(os.getenv('ADD_BATCH_MAX_ITEMS', '10000')),
+    'chunk_size': int(os.getenv('ADD_BATCH_CHUNK_SIZE', '500')),
+}
+
+# Keyset pagination of /getall and /search, and rows per batch read by /products/stream
+PAGE_CONFIG = {
+    'max_limit': int(os.getenv('PAGE_MAX_LIMIT', '1000')),
+    'stream_batch_size': int(os.getenv('STREAM_BATCH_SIZE', '1000')),
+}
+
+# Catalog snapshot written by the initializer (SNAPSHOT_EXPORT), read at startup to warm product IDs,
+# the leaderboard and the memory engine's index before MySQL answers; unset warms from MySQL only
+SNAPSHOT_CONFIG = {
+    'path': os.getenv('CATALOG_SNAPSHOT') or None,
+}
+
+# Search engine for /search: 'sql' (indexed SOUNDEX in MySQL) or 'memory' (in-process trigram index)
+SEARCH_ENGINE = os.getenv('SEARCH_ENGINE', 'sql')
+if SEARCH_ENGINE not in ('sql', 'memory'):
+    print(f"Error: SEARCH_ENGINE must be 'sql' or 'memory', got {SEARCH_ENGINE}", file=sys.stderr)
+    sys.exit(1)
+
+# Cached /search results per phonetic key: entry count, memory budget (bytes) and lifetime (seconds)
+SEARCH_CACHE_CONFIG = {
+    'maxsize': int(os.getenv('SEARCH_CACHE_SIZE', '1000')),
+    'max_bytes': int(os.getenv('SEARCH_CACHE_MAX_BYTES', str(32 * 1024 * 1024))),
+    'ttl': float(os.getenv('SEARCH_CACHE_TTL', '30')),
+}
+
+# HTTP caching of /getall and /search: seconds a shared cache (nginx) may reuse a response before
+# revalidating it with its ETag, and seconds between reloads of the catalog version ETags derive from
+HTTP_CACHE_CONFIG = {
+    'max_age': int(os.getenv('HTTP_CACHE_MAX_AGE', '1')),
+    'version_interval': float(os.getenv('CATALOG_VERSION_INTERVAL', '0.5')),
+}
+
+# Object storage holding product images: 'gcs' or 'local' (gs://bucket/key as files under OBJECT_STORE_DIR)
+try:
+    object_store = object_store_from_env()
+except ValueError as e:
+    print(f"Error: {e}", file=sys.stderr)
+    sys.exit(1)
+
 # GCS configuration from environment variables
 GCS_CONFIG = {
-    'project': requireenv('GOOGLE_CLOUD_PROJECT'),
+    'project': requireenv('GOOGLE_CLOUD_PROJECT') if object_store.name == 'gcs' else None,
 }
 
-# Initialize GCS client
-storage_client = storage.Client()
+# Cached GCS existence checks; missing objects are remembered for less time (seconds)
+GCS_CACHE_CONFIG = {
+    'maxsize': int(os.getenv('GCS_EXISTS_CACHE_SIZE', '10000')),
+    'positive_ttl': float(os.getenv('GCS_EXISTS_TTL', '300')),
+    'negative_ttl': float(os.getenv('GCS_MISSING_TTL', '30')),
+}
+
+# Product images served by /images: local cache directory and disk budget (bytes), the widths
+# variants may be resized to, and the JPEG/WebP quality they are encoded at
+IMAGE_CACHE_CONFIG = {
+    'directory': os.getenv('IMAGE_CACHE_DIR', 'data/images'),
+    'max_bytes': int(os.getenv('IMAGE_CACHE_MAX_BYTES', str(512 * 1024 * 1024))),
+    'widths': [int(width) for width in os.getenv('IMAGE_WIDTHS', '160,320,640').split(',') if width.strip()],
+    'quality': int(os.getenv('IMAGE_QUALITY', '85')),
+}
+# Seconds clients may reuse an image, seconds a product's image_src is remembered, and the nginx
+# internal location the cache directory is aliased at; when set, nginx sends the files itself
+IMAGE_SERVE_CONFIG = {
+    'max_age': int(os.getenv('IMAGE_MAX_AGE', '86400')),
+    'src_ttl': float(os.getenv('IMAGE_SRC_TTL', '60')),
+    'accel_redirect': os.getenv('IMAGE_ACCEL_REDIRECT', ''),
+    'root': IMAGE_CACHE_CONFIG['directory'],
+}
+if 'WEB_WORKER_INDEX' in os.environ:
+    # Each worker evicts only what it tracks, so each keeps its own files
+    IMAGE_CACHE_CONFIG['directory'] = os.path.join(IMAGE_CACHE_CONFIG['directory'], f"worker-{WORKER_CONFIG['index']}")
 
 # Print configuration for debugging
 print("Database Configuration:", {k: v for k, v in DB_CONFIG.items() if k != 'password'})
+print("Worker Configuration:", WORKER_CONFIG)
+print("Pool Configuration:", POOL_CONFIG)
+print("Replica Configuration:", REPLICA_CONFIG)
+print("Admission Configuration:", ADMISSION_CONFIG)
+print("View Configuration:", VIEW_CONFIG)
+print("View Rollup Configuration:", VIEW_ROLLUP_CONFIG)
+print("Product IDs Configuration:", PRODUCT_IDS_CONFIG)
+print("Purchase Configuration:", PURCHASE_CONFIG)
+print("Leaderboard Configuration:", LEADERBOARD_CONFIG)
+print("Batch Configuration:", BATCH_CONFIG)
+print("Page Configuration:", PAGE_CONFIG)
+print("Snapshot Configuration:", SNAPSHOT_CONFIG)
+print("Search Engine:", SEARCH_ENGINE)
+print("Search Cache Configuration:", SEARCH_CACHE_CONFIG)
+print("HTTP Cache Configuration:", HTTP_CACHE_CONFIG)
+print("Object Store:", object_store.name)
 print("GCS Configuration:", GCS_CONFIG)
+print("GCS Cache Configuration:", GCS_CACHE_CONFIG)
+print("Image Cache Configuration:", IMAGE_CACHE_CONFIG)
+print("Image Serve Configuration:", IMAGE_SERVE_CONFIG)
+
+admission_lanes = {name: Lane(name, **config) for name, config in ADMISSION_CONFIG.items()}
+app.add_middleware(AdmissionMiddleware, lanes=admission_lanes, routes=ADMISSION_ROUTES)
+# Added last so it is outermost and records requests shed by admission control too
+app.add_middleware(metrics.MetricsMiddleware)
+
+db = Database(DB_CONFIG, **POOL_CONFIG)
+
+def _replica_pool(host: str) -> Database:
+    name, _, port = host.partition(':')
+    config = {**DB_CONFIG, 'host': name, 'port': int(port) if port else DB_CONFIG['port']}
+    return Database(config, **{**POOL_CONFIG, 'pool_size': REPLICA_CONFIG['pool_size']})
+
+# Reads that may be served by a replica go through here; everything else uses db, the primary
+reads = ReplicaSet(
+    db, {host: _replica_pool(host) for host in REPLICA_CONFIG['hosts']},
+    check_interval=REPLICA_CONFIG['check_interval'], max_lag=REPLICA_CONFIG['max_lag'],
+)
+catalog_version = CatalogVersion(db, refresh_interval=HTTP_CACHE_CONFIG['version_interval'])
+view_counter = ViewCounter(db, catalog_version, **VIEW_CONFIG)
+product_ids = ProductIds(db, **PRODUCT_IDS_CONFIG)
+view_rollups = ViewRollups(db, reads, **VIEW_ROLLUP_CONFIG)
+leaderboard = Leaderboard(db, view_counter, **LEADERBOARD_CONFIG)
+purchase_log = PurchaseLog(db=db, **PURCHASE_CONFIG)
+# The memory engine's index once loaded; until then /search uses SQL and index updates queue up
+search_index = None
+search_index_backlog: List[Tuple[str, Tuple[Any, ...]]] = []
+# True while a load from MySQL is pending, whose result the backlog is replayed over
+search_index_loading = SEARCH_ENGINE == 'memory'
+gcs_exists_cache = TTLCache(GCS_CACHE_CONFIG['maxsize'])
+gcs_lookups = SingleFlight()
+image_cache = ImageCache(object_store.download, **IMAGE_CACHE_CONFIG)
+# Product ID -> image_src, so a cached image is served without a query
+image_srcs = TTLCache(GCS_CACHE_CONFIG['maxsize'])
+search_cache = TTLCache(SEARCH_CACHE_CONFIG['maxsize'], SEARCH_CACHE_CONFIG['max_bytes'])
+search_lookups = SingleFlight()
+# Bumped on every invalidation so a lookup that raced a write does not cache its result
+search_cache_generation = 0
+# Phonetic keys written within the read-your-writes window; a replica may not have their
+# writes yet, so results for them are not cached until the window has passed
+recent_search_writes = TTLCache(SEARCH_CACHE_CONFIG['maxsize'])
+
+# Cookie holding the time until which a client that wrote reads from the primary
+PRIMARY_COOKIE = 'read_primary_until'
 
 # Pydantic models for request validation
 class ProductAdd(BaseModel):
@@ -51,32 +323,56 @@ class PurchaseRequest(BaseModel):
     user_id: int
     product_id: int
 
-def get_db_connection():
-    try:
-        return mysql.connector.connect(**DB_CONFIG)
-    except Error as e:
-        raise HTTPException(status_code=500, detail=f"Database connection error: {str(e)}")
+def _remember_gcs_path(image_src: str, exists: bool) -> None:
+    ttl = GCS_CACHE_CONFIG['positive_ttl'] if exists else GCS_CACHE_CONFIG['negative_ttl']
+    gcs_exists_cache.set(image_src, exists, ttl)
+
+async def _lookup_gcs_path(image_src: str, ref: ObjectRef) -> bool:
+    with metrics.OBJECT_STORE_SECONDS.time("exists"):
+        exists = await run_in_threadpool(object_store.exists, *ref)
+    _remember_gcs_path(image_src, exists)
+    return exists
 
-def validate_gcs_path(image_src: str) -> bool:
+async def validate_gcs_path(image_src: str) -> bool:
     try:
-        # Parse the GCS path
-        if not image_src.startswith('gs://'):
-            return False
-        
-        # Extract bucket and blob from path
-        path_parts = image_src[5:].split('/', 1)  # Remove 'gs://' and split into bucket and blob
-        if len(path_parts) != 2:
+        # Parse the GCS path into bucket and blob
+        ref = parse_gcs_path(image_src)
+        if ref is None:
             return False
         
-        bucket_name, blob_name = path_parts
-        
-        # Check if the blob exists in the bucket
-        bucket = storage_client.bucket(bucket_name)
-        blob = bucket.blob(blob_name)
-        return blob.exists()
-    except:
+        # Check if the blob exists in the bucket; concurrent misses share one lookup
+        exists = gcs_exists_cache.get(image_src)
+        if exists is MISSING:
+            exists = await gcs_lookups.do(image_src, lambda: _lookup_gcs_path(image_src, ref))
+        return exists
+    except Exception:
         return False
 
+async def validate_gcs_paths(image_srcs: List[str]) -> Dict[str, bool]:
+    """validate_gcs_path for many paths, resolving every uncached one in a single exists_many call"""
+    valid: Dict[str, bool] = {}
+    refs: Dict[ObjectRef, str] = {}
+    for image_src in set(image_srcs):
+        ref = parse_gcs_path(image_src)
+        exists = gcs_exists_cache.get(image_src) if ref is not None else False
+        if exists is MISSING:
+            refs[ref] = image_src
+        else:
+            valid[image_src] = exists
+    if refs:
+        try:
+            with metrics.OBJECT_STORE_SECONDS.time("exists_many"):
+                found = await run_in_threadpool(object_store.exists_many, list(refs))
+        except Exception:
+            found = {}
+        for ref, image_src in refs.items():
+            valid[image_src] = found.get(ref, False)
+            if ref in found:
+                _remember_gcs_path(image_src, found[ref])
+    return valid
+
+INVALID_PRICE_DETAIL = "Invalid price. Price must be positive, have at most 2 decimal places, and be less than 100 million"
+
 def validate_price(price: float) -> bool:
     """Validate that the price is within reasonable bounds and won't overflow DECIMAL(10,2)"""
     # Check if price is positive
@@ -93,8 +389,58 @@ def validate_price(price: float) -> bool:
     
     return True
 
+def invalidate_search(phonetic_key: Optional[str]) -> None:
+    """Drop the cached /search results a product with this phonetic key belongs to"""
+    global search_cache_generation
+    search_cache_generation += 1
+    if phonetic_key is not None:
+        search_cache.pop(phonetic_key)
+        if len(reads):
+            recent_search_writes.set(phonetic_key, True, REPLICA_CONFIG['read_your_writes'])
+
+def pin_to_primary(response: Response) -> None:
+    """Send this client's reads to the primary for the read-your-writes window"""
+    if not len(reads):
+        return
+    window = REPLICA_CONFIG['read_your_writes']
+    response.set_cookie(PRIMARY_COOKIE, f"{time.time() + window:.3f}", max_age=int(window) + 1, httponly=True)
+
+def pinned_to_primary(request: Request) -> bool:
+    try:
+        return float(request.cookies.get(PRIMARY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+def cache_control(pinned: bool) -> str:
+    # A client pinned to the primary must not be handed a shared copy that predates its write
+    return 'private, no-cache' if pinned else f"public, max-age={HTTP_CACHE_CONFIG['max_age']}"
+
+def catalog_etag(request: Request, pinned: bool, *variant: Any) -> Optional[str]:
+    """The ETag of this request's response at the current catalog version, taken before the response is built"""
+    # A client pinned to the primary may have written through a worker whose version this one has not seen
+    if pinned or catalog_version.value is None:
+        return None
+    return etag(catalog_version.value, request.url.path, sorted(request.query_params.multi_items()), *variant)
+
+def tagged_json(body: bytes, tag: Optional[str], pinned: bool) -> Response:
+    headers = {'Cache-Control': cache_control(pinned)}
+    if tag is not None:
+        headers['ETag'] = tag
+    return JSONBytes(body, headers=headers)
+
 def handle_database_error(e: Exception) -> None:
     """Handle database errors and raise appropriate HTTP exceptions"""
+    try:
+        _raise_database_error(e)
+    except HTTPException as http_error:
+        metrics.DATABASE_ERRORS.inc(f"{http_error.status_code // 100}xx")
+        raise
+
+def _raise_database_error(e: Exception) -> None:
+    if isinstance(e, HTTPException):
+        raise e
+    if isinstance(e, Error) and e.errno == 3024:
+        raise HTTPException(status_code=504, detail="Database query timed out")
     if isinstance(e, IntegrityError):
         if "Duplicate entry" in str(e):
             raise HTTPException(status_code=400, detail="Duplicate entry found")
@@ -109,163 +455,727 @@ def handle_database_error(e: Exception) -> None:
     else:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
+def update_search_index(operation: str, *args: Any) -> None:
+    """Apply a TrigramIndex update now, and again once a pending load has finished"""
+    if search_index is not None:
+        getattr(search_index, operation)(*args)
+    if search_index_loading:
+        search_index_backlog.append((operation, args))
+
+def _load_search_index(cnx):
+    # numpy is only imported when the memory engine is used, and off the event loop
+    from search_index import TrigramIndex
+    index = TrigramIndex()
+    index.load(cnx)
+    return index
+
+async def _warm_search_index() -> None:
+    global search_index, search_index_loading
+    # Flushed first, as the leaderboard does, so the load already counts nearly every view recorded so far
+    await view_counter.flush()
+    index = await db.run(_load_search_index, name="load_search_index")
+    # Replayed and swapped in without yielding, so no update falls in between. Views the
+    # backlog recorded were flushed into what was loaded, unless they are still pending.
+    for operation, args in search_index_backlog:
+        if operation != 'record_view':
+            getattr(index, operation)(*args)
+    for product_id, views in view_counter.pending().items():
+        index.record_view(product_id, views)
+    search_index_backlog.clear()
+    search_index = index
+    search_index_loading = False
+    print(f"Search index loaded - {len(search_index)} products")
+
+def _snapshot_top(snapshot: SnapshotReader, depth: int) -> List[Dict[str, Any]]:
+    """The snapshot's top depth products in leaderboard order, decoding only the row groups holding them"""
+    best: List[Tuple[int, int, int, int]] = []
+    for number, group in enumerate(snapshot.groups):
+        counts = snapshot.column(group, 'view_count')
+        ids = snapshot.column(group, 'product_id')
+        candidates = (
+            (-1 if count is None else count, product_id, number, position)
+            for position, (count, product_id) in enumerate(zip(counts, ids))
+        )
+        best = heapq.nlargest(depth, best + heapq.nlargest(depth, candidates))
+    rows = []
+    decoded: Dict[int, List[Tuple]] = {}
+    for _, _, number, position in best:
+        if number not in decoded:
+            decoded[number] = snapshot.group_rows(snapshot.groups[number])
+        rows.append(dict(zip(PRODUCT_FIELDS, decoded[number][position])))
+    return rows
+
+def _snapshot_search_index(snapshot: SnapshotReader):
+    from search_index import TrigramIndex
+    index = TrigramIndex()
+    index.build(dict(zip(PRODUCT_FIELDS, row)) for rows in snapshot.row_groups() for row in rows)
+    return index
+
+async def _warm_from_snapshot() -> None:
+    """Fill product IDs, the leaderboard and the memory engine's index from the catalog snapshot.
+
+    The snapshot may be older than MySQL, so the regular loads still follow and
+    replace what it gave; until then this state answers requests.
+    """
+    global search_index
+    try:
+        snapshot = SnapshotReader(SNAPSHOT_CONFIG['path'])
+    except (OSError, ValueError, SnapshotError) as e:
+        print(f"Catalog snapshot not used, warming from MySQL only: {e}")
+        return
+    try:
+        await product_ids.preload(snapshot.product_ids())
+        leaderboard.preload(await run_in_threadpool(_snapshot_top, snapshot, leaderboard.depth))
+        if SEARCH_ENGINE == 'memory':
+            index = await run_in_threadpool(_snapshot_search_index, snapshot)
+            for operation, args in search_index_backlog:
+                getattr(index, operation)(*args)
+            search_index = index
+    except Exception as e:
+        print(f"Error reading catalog snapshot, warming from MySQL only: {e}")
+        return
+    finally:
+        snapshot.close()
+    for component in ('product_ids', 'leaderboard', 'search_index'):
+        warmup[component] = True
+    startup_seconds['snapshot'] = time.perf_counter() - warmup_started
+    print(f"Catalog snapshot loaded - {snapshot.rows} products from {SNAPSHOT_CONFIG['path']}")
+
+# Startup work that runs after the server starts accepting requests; /ready reports on it
+warmup: Dict[str, bool] = {
+    'database': False,
+    'object_store': False,
+    'leaderboard': False,
+    'product_ids': False,
+    'search_index': SEARCH_ENGINE != 'memory',
+    'replicas': not REPLICA_CONFIG['hosts'],
+    'image_cache': False,
+}
+startup_seconds: Dict[str, float] = {}
+warmup_started = 0.0
+warmup_task: Optional[asyncio.Task] = None
+
+async def _warm(component: str, warm) -> None:
+    """Run warm() until it succeeds, recording how long after startup it became ready"""
+    delay = 0.5
+    while True:
+        try:
+            await warm()
+            break
+        except Exception as e:
+            print(f"Error warming {component}, retrying in {delay}s: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 10)
+    startup_seconds[component] = time.perf_counter() - warmup_started
+    warmup[component] = True
+
+async def _warm_up() -> None:
+    async def data():
+        if SNAPSHOT_CONFIG['path']:
+            await _warm_from_snapshot()
+        await _warm('database', db.warm)
+        await asyncio.gather(
+            _warm('leaderboard', leaderboard.reconcile),
+            _warm('product_ids', product_ids.resync),
+            _warm('search_index', _warm_search_index) if SEARCH_ENGINE == 'memory' else asyncio.sleep(0),
+        )
+
+    await asyncio.gather(
+        data(),
+        _warm('object_store', lambda: run_in_threadpool(object_store.warm)),
+        _warm('image_cache', lambda: run_in_threadpool(image_cache.load)),
+        # Replicas that fail their first check stay out of rotation, but do not hold up readiness
+        _warm('replicas', reads.warm) if REPLICA_CONFIG['hosts'] else asyncio.sleep(0),
+    )
+    print(f"Ready - {startup_seconds}")
+
+@app.on_event("startup")
+async def startup():
+    global warmup_task, warmup_started
+    # Only cheap, local setup here: uvicorn does not accept connections until this returns
+    warmup_started = time.perf_counter()
+    db.start()
+    reads.start()
+    catalog_version.start()
+    view_counter.start()
+    view_rollups.start()
+    product_ids.start()
+    purchase_log.start()
+    leaderboard.start()
+    warmup_task = asyncio.ensure_future(_warm_up())
+
+@app.on_event("shutdown")
+async def shutdown():
+    if warmup_task is not None:
+        warmup_task.cancel()
+    await leaderboard.stop()
+    await product_ids.stop()
+    await view_rollups.stop()
+    await view_counter.stop()
+    await catalog_version.stop()
+    await purchase_log.stop()
+    await reads.stop()
+    reads.close()
+    db.close()
+
 @app.get("/health")
 async def health_check():
     return {"status": "ok"}
 
+@app.get("/ready")
+async def readiness_check():
+    """200 once connections, clients and in-memory state are warm, 503 until then"""
+    ready = all(warmup.values())
+    return JSONResponse(
+        {
+            "ready": ready, "components": warmup, "replicas": reads.stats(),
+            "import_seconds": IMPORT_SECONDS, "warmup_seconds": startup_seconds,
+            "worker": WORKER_CONFIG['index'], "workers": WORKER_CONFIG['workers'],
+        },
+        status_code=200 if ready else 503,
+    )
+
 @app.get("/analytics/view/{product_id}")
 async def view_product(product_id: int):
-    connection = get_db_connection()
-    cursor = connection.cursor(dictionary=True)
-    
     try:
-        # Check if product exists
-        cursor.execute("SELECT * FROM product WHERE product_id = %s", (product_id,))
-        product = cursor.fetchone()
-        
-        if not product:
+        # Answered from memory once the product IDs are loaded, from MySQL until then; a
+        # snapshot preload answers hits before that. Another worker may have added the
+        # product since the last reload, so with several workers a miss is confirmed in MySQL.
+        if product_id in product_ids:
+            exists = True
+        elif product_ids.loaded and WORKER_CONFIG['workers'] == 1:
+            exists = False
+        else:
+            exists = await db.fetchone(
+                "SELECT 1 FROM product WHERE product_id = %s", (product_id,), name="product_exists"
+            ) is not None
+        if not exists:
             raise HTTPException(status_code=404, detail="Product not found")
         
-        # Update or insert view count
-        try:
-            cursor.execute("""
-                INSERT INTO view (product_id, view_count) 
-                VALUES (%s, 1) 
-                ON DUPLICATE KEY UPDATE view_count = view_count + 1
-            """, (product_id,))
-            
-            connection.commit()
-            print(f"view incremented - Product ID: {product_id}")
-            return {"message": "View count updated successfully"}
-        except Exception as e:
-            handle_database_error(e)
-    
+        # Coalesced in memory and written behind by the view counter
+        view_counter.record(product_id)
+        leaderboard.record_view(product_id)
+        update_search_index('record_view', product_id)
+        return {"message": "View count updated successfully"}
     except Exception as e:
         handle_database_error(e)
+
+def _window_seconds(window: str) -> int:
+    try:
+        return parse_window(window)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/analytics/trending")
+async def trending_products(window: str = "1h", limit: int = Query(20, ge=1, le=100)):
+    """Most viewed products over the last window (e.g. 15m, 1h, 7d), from pre-aggregated buckets"""
+    seconds = _window_seconds(window)
+    try:
+        granularity, since, products = await view_rollups.trending(seconds, limit)
+        return {"window": window, "granularity": granularity, "since": since, "products": products}
+    except Exception as e:
+        handle_database_error(e)
+
+@app.get("/analytics/views/{product_id}")
+async def product_view_series(product_id: int, window: str = "24h", granularity: Optional[str] = None):
+    """Views of one product per minute, hour or day bucket over the last window"""
+    seconds = _window_seconds(window)
+    try:
+        granularity, since, buckets = await view_rollups.series(product_id, seconds, granularity)
+        return {"product_id": product_id, "window": window, "granularity": granularity, "since": since, "buckets": buckets}
+    except Exception as e:
+        handle_database_error(e)
+
+async def _image_src(product_id: int, pinned: bool) -> Optional[str]:
+    """The product's image_src, None if there is no such product"""
+    image_src = image_srcs.get(product_id)
+    if image_src is MISSING:
+        rows = await reads.fetchall(
+            "SELECT image_src FROM product WHERE product_id = %s", (product_id,), dictionary=False,
+            name="image_src", pinned=pinned,
+        )
+        if not rows:
+            return None
+        image_src = rows[0][0]
+        image_srcs.set(product_id, image_src, IMAGE_SERVE_CONFIG['src_ttl'])
+    return image_src
+
+async def _file_chunks(file) -> AsyncIterator[bytes]:
+    try:
+        while True:
+            chunk = await run_in_threadpool(file.read, 256 * 1024)
+            if not chunk:
+                break
+            yield chunk
     finally:
-        cursor.close()
-        connection.close()
+        file.close()
+
+@app.get("/images/{product_id}")
+async def product_image(request: Request, product_id: int, w: Optional[int] = None):
+    """The product's image, or a copy resized to width w, from the local image cache"""
+    width = w or 0
+    if width and width not in image_cache.widths:
+        raise HTTPException(status_code=400, detail=f"w must be one of {', '.join(map(str, image_cache.widths))}")
+    try:
+        image_src = await _image_src(product_id, pinned_to_primary(request))
+    except Exception as e:
+        handle_database_error(e)
+    if image_src is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+    ref = parse_gcs_path(image_src)
+    if ref is None:
+        raise HTTPException(status_code=404, detail="Product has no stored image")
+    caching = f"public, max-age={IMAGE_SERVE_CONFIG['max_age']}"
+    # A second pass only if the file was evicted between lookup and open
+    for _ in range(2):
+        try:
+            image = await image_cache.get(image_src, ref, width)
+        except ImageError as e:
+            print(f"Error resizing image of product {product_id}: {e}")
+            raise HTTPException(status_code=415, detail="Product image is not a format that can be resized")
+        if image is None:
+            raise HTTPException(status_code=404, detail="Product image not found in object storage")
+        if matches(request, image.etag):
+            return not_modified(image.etag, caching)
+        headers = {'ETag': image.etag, 'Cache-Control': caching}
+        if IMAGE_SERVE_CONFIG['accel_redirect']:
+            # nginx sends the file with sendfile, sparing this process the copy through userspace
+            location = IMAGE_SERVE_CONFIG['accel_redirect'] + os.path.relpath(image.path, IMAGE_SERVE_CONFIG['root'])
+            return Response(media_type=image.media_type, headers={**headers, 'X-Accel-Redirect': location})
+        try:
+            # Opened before returning, so eviction from here on no longer matters
+            file = open(image.path, 'rb')
+        except FileNotFoundError:
+            image_cache.forget(image)
+            continue
+        headers['Content-Length'] = str(image.size)
+        return StreamingResponse(_file_chunks(file), media_type=image.media_type, headers=headers)
+    raise HTTPException(status_code=503, detail="Image cache is evicting faster than it fills, retry later")
+
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/analytics/pending")
+async def pending_views():
+    return view_counter.backlog()
+
+@app.get("/admission/stats")
+async def admission_stats():
+    return {name: lane.stats() for name, lane in admission_lanes.items()}
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return {
+        "gcs_exists": gcs_exists_cache.stats(),
+        "search": search_cache.stats(),
+        "product_ids": product_ids.stats(),
+        "images": image_cache.stats(),
+    }
 
 @app.post("/add")
-async def add_product(product: ProductAdd):
-    connection = get_db_connection()
-    cursor = connection.cursor()
-    
+async def add_product(product: ProductAdd, response: Response):
     try:
         # Validate price
         if not validate_price(product.price):
-            raise HTTPException(
-                status_code=400,
-                detail="Invalid price. Price must be positive, have at most 2 decimal places, and be less than 100 million"
-            )
+            raise HTTPException(status_code=400, detail=INVALID_PRICE_DETAIL)
         
         # Validate GCS path
-        if not validate_gcs_path(product.image_src):
+        if not await validate_gcs_path(product.image_src):
             raise HTTPException(status_code=400, detail="Invalid GCS image path")
         
         # Insert product
-        try:
-            cursor.execute("""
-                INSERT INTO product (product_id, name, description, image_src, price)
-                VALUES (%s, %s, %s, %s, %s)
-            """, (product.product_id, product.name, product.description, product.image_src, product.price))
-            
-            connection.commit()
-            return {"message": "Product added successfully"}
-        except Exception as e:
-            handle_database_error(e)
-    
+        catalog_version.advance(await db.transaction(_insert_product, product))
+        
+        product_ids.add(product.product_id)
+        invalidate_search(soundex(product.name))
+        leaderboard.add(product.dict())
+        update_search_index('add', {**product.dict(), 'view_count': None})
+        image_srcs.pop(product.product_id)
+        pin_to_primary(response)
+        return {"message": "Product added successfully"}
     except Exception as e:
         handle_database_error(e)
-    finally:
-        cursor.close()
-        connection.close()
 
-@app.delete("/remove/{product_id}")
-async def remove_product(product_id: int):
-    connection = get_db_connection()
-    cursor = connection.cursor()
-    
+def database_error_detail(e: Exception) -> str:
+    """The detail handle_database_error would report for e, for per-item results"""
+    try:
+        handle_database_error(e)
+    except HTTPException as http_error:
+        return http_error.detail
+
+def _parse_ndjson_line(line: bytes) -> Any:
     try:
-        # Delete from view table first (due to foreign key constraint)
+        return json.loads(line)
+    except ValueError as e:
+        return e
+
+async def _ndjson_lines(request: Request) -> AsyncIterator[bytes]:
+    """The non-blank lines of a streamed request body"""
+    buffer = b''
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            if line.strip():
+                yield line
+    if buffer.strip():
+        yield buffer
+
+async def _read_batch(request: Request) -> AsyncIterator[Any]:
+    """Yield raw product records from a JSON array body or a streamed NDJSON body"""
+    content_type = request.headers.get('content-type', '')
+    if 'ndjson' in content_type or 'jsonlines' in content_type:
+        count = 0
+        async for line in _ndjson_lines(request):
+            count += 1
+            if count > BATCH_CONFIG['max_items']:
+                # Read no further; streamed, so the chunks before this item have already been added
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"Batch exceeds {BATCH_CONFIG['max_items']} products; the products before it were processed",
+                )
+            yield _parse_ndjson_line(line)
+        return
+
+    try:
+        records = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Request body must be a JSON array or NDJSON")
+    if not isinstance(records, list):
+        raise HTTPException(status_code=400, detail="Request body must be a JSON array or NDJSON")
+    if len(records) > BATCH_CONFIG['max_items']:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {BATCH_CONFIG['max_items']} products")
+    for record in records:
+        yield record
+
+def _insert_product(cursor, product: ProductAdd) -> int:
+    """Insert one product and return the catalog version it was committed at"""
+    cursor.execute("""
+        INSERT INTO product (product_id, name, description, image_src, price)
+        VALUES (%s, %s, %s, %s, %s)
+    """, (product.product_id, product.name, product.description, product.image_src, product.price))
+    return bump_catalog_version(cursor)
+
+def _insert_products(cursor, products: List[ProductAdd]) -> Tuple[Set[int], Optional[int]]:
+    """Insert the products that do not exist yet in one multi-row INSERT.
+
+    Returns the ids that already existed, and the catalog version the rest were committed at.
+    """
+    placeholders = ', '.join(['%s'] * len(products))
+    cursor.execute(
+        f"SELECT product_id FROM product WHERE product_id IN ({placeholders})",
+        [product.product_id for product in products],
+    )
+    existing = {row[0] for row in cursor.fetchall()}
+    rows = [
+        (product.product_id, product.name, product.description, product.image_src, product.price)
+        for product in products if product.product_id not in existing
+    ]
+    if rows:
+        # mysql-connector rewrites an INSERT executemany into a single multi-row INSERT
+        cursor.executemany("""
+            INSERT INTO product (product_id, name, description, image_src, price)
+            VALUES (%s, %s, %s, %s, %s)
+        """, rows)
+        return existing, bump_catalog_version(cursor)
+    return existing, None
+
+async def _add_chunk(records: List[Any], start: int, seen: Set[int]) -> List[Dict[str, Any]]:
+    results: List[Dict[str, Any]] = []
+    pending: Dict[int, ProductAdd] = {}
+    for index, record in enumerate(records, start):
         try:
-            cursor.execute("DELETE FROM view WHERE product_id = %s", (product_id,))
-            
-            # Delete from product table
-            cursor.execute("DELETE FROM product WHERE product_id = %s", (product_id,))
-            
-            if cursor.rowcount == 0:
-                raise HTTPException(status_code=404, detail="Product not found")
-            
-            connection.commit()
-            return {"message": "Product removed successfully"}
-        except Exception as e:
-            handle_database_error(e)
+            if isinstance(record, Exception):
+                raise record
+            product = ProductAdd.parse_obj(record)
+        except (ValidationError, ValueError, TypeError) as e:
+            results.append({"index": index, "status": "error", "detail": f"Invalid product: {e}"})
+            continue
+        result = {"index": index, "product_id": product.product_id, "status": "error"}
+        results.append(result)
+        if not validate_price(product.price):
+            result["detail"] = INVALID_PRICE_DETAIL
+        elif product.product_id in seen:
+            result["detail"] = "Duplicate product_id in batch"
+        else:
+            seen.add(product.product_id)
+            pending[len(results) - 1] = product
+
+    # Each distinct image is validated once, all uncached ones in one batched lookup
+    valid = await validate_gcs_paths([product.image_src for product in pending.values()])
+    for position, product in list(pending.items()):
+        if not valid[product.image_src]:
+            results[position]["detail"] = "Invalid GCS image path"
+            del pending[position]
+    if not pending:
+        return results
+
+    try:
+        existing, version = await db.transaction(_insert_products, list(pending.values()))
+        if version is not None:
+            catalog_version.advance(version)
+        failures = {product_id: "Duplicate entry found" for product_id in existing}
+    except Exception:
+        # Lost a race with another writer or hit a bad row: insert one by one to attribute the error
+        failures = {}
+        for product in pending.values():
+            try:
+                catalog_version.advance(await db.transaction(_insert_product, product))
+            except Exception as e:
+                failures[product.product_id] = database_error_detail(e)
+
+    for position, product in pending.items():
+        if product.product_id in failures:
+            results[position]["detail"] = failures[product.product_id]
+            continue
+        results[position]["status"] = "ok"
+        product_ids.add(product.product_id)
+        invalidate_search(soundex(product.name))
+        leaderboard.add(product.dict())
+        update_search_index('add', {**product.dict(), 'view_count': None})
+        image_srcs.pop(product.product_id)
+    return results
+
+@app.post("/add/batch")
+async def add_products_batch(request: Request, response: Response):
+    """Add many products from a JSON array or an NDJSON stream, reporting success or error per item"""
+    results: List[Dict[str, Any]] = []
+    seen: Set[int] = set()
+    chunk: List[Any] = []
+    async for record in _read_batch(request):
+        chunk.append(record)
+        if len(chunk) == BATCH_CONFIG['chunk_size']:
+            results.extend(await _add_chunk(chunk, len(results), seen))
+            chunk = []
+    if chunk:
+        results.extend(await _add_chunk(chunk, len(results), seen))
+
+    added = sum(1 for result in results if result["status"] == "ok")
+    if added:
+        pin_to_primary(response)
+    return {"added": added, "failed": len(results) - added, "results": results}
+
+def _remove_product(cursor, product_id: int) -> Tuple[Optional[str], int]:
+    """Delete the product and its views, returning its phonetic key and the catalog version it was removed at"""
+    cursor.execute("SELECT name_soundex FROM product WHERE product_id = %s FOR UPDATE", (product_id,))
+    row = cursor.fetchone()
+    
+    # Delete from view table first (due to foreign key constraint)
+    cursor.execute("DELETE FROM view WHERE product_id = %s", (product_id,))
     
+    # Delete from product table
+    cursor.execute("DELETE FROM product WHERE product_id = %s", (product_id,))
+    
+    if cursor.rowcount == 0:
+        raise HTTPException(status_code=404, detail="Product not found")
+    return row[0], bump_catalog_version(cursor)
+
+@app.delete("/remove/{product_id}")
+async def remove_product(product_id: int, response: Response):
+    try:
+        view_counter.discard(product_id)
+        phonetic_key, version = await db.transaction(_remove_product, product_id)
+        catalog_version.advance(version)
+        product_ids.discard(product_id)
+        invalidate_search(phonetic_key)
+        leaderboard.remove(product_id)
+        update_search_index('remove', product_id)
+        image_srcs.pop(product_id)
+        pin_to_primary(response)
+        return {"message": "Product removed successfully"}
     except Exception as e:
         handle_database_error(e)
-    finally:
-        cursor.close()
-        connection.close()
+
+def _cursor_int(key: Dict[str, Any], field: str) -> int:
+    value = key.get(field)
+    if not isinstance(value, int):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return value
+
+async def _search_sql(phonetic_key: str, after: Optional[int], limit: int, pinned: bool) -> bytes:
+    """The encoded /search response for one page of a phonetic key"""
+    generation = search_cache_generation
+    # Equality on the indexed name_soundex column, read in product_id DESC
+    # index order, so neither a per-row SOUNDEX() nor a filesort is needed;
+    # later pages seek past the last product_id on the same index
+    rows = await reads.fetchall(f"""
+        SELECT p.product_id, p.name, p.description, p.image_src, p.price, v.view_count 
+        FROM product p
+        LEFT JOIN view v ON p.product_id = v.product_id
+        WHERE p.name_soundex = %s {"AND p.product_id < %s" if after is not None else ""}
+        ORDER BY p.product_id DESC
+        LIMIT %s
+    """, (phonetic_key, after, limit) if after is not None else (phonetic_key, limit), dictionary=False, name="search",
+        pinned=pinned)
+    next_cursor = None
+    if len(rows) == limit:
+        next_cursor = encode_cursor("search", s=phonetic_key, id=rows[-1][0])
+    body = products_page(product_dicts(rows), next_cursor)
+    # Cached encoded, so a hit is sent without touching the rows again
+    cacheable = not pinned and recent_search_writes.get(phonetic_key) is MISSING
+    if after is None and limit == 20 and cacheable and generation == search_cache_generation:
+        search_cache.set(phonetic_key, body, SEARCH_CACHE_CONFIG['ttl'])
+    return body
 
 @app.get("/search")
-async def search_products(name: str):
-    connection = get_db_connection()
-    cursor = connection.cursor(dictionary=True)
-    
+async def search_products(
+    request: Request, name: str, cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=PAGE_CONFIG['max_limit']),
+):
+    pinned = pinned_to_primary(request)
+    # The memory engine ranks differently from SQL, which answers until its index is loaded
+    tag = catalog_etag(request, pinned, 'memory' if search_index is not None else 'sql')
+    if tag is not None and matches(request, tag):
+        return not_modified(tag, cache_control(pinned))
+    if search_index is not None:
+        # Ranked by similarity rather than a key, so only the best matches are returned, in one page;
+        # a cursor from the SQL engine, which answers until the index is loaded, cannot be continued
+        if cursor is not None:
+            raise HTTPException(status_code=400, detail="Cursors are not supported by the memory search engine")
+        return tagged_json(products_page(search_index.search(name, limit), None), tag, pinned)
     try:
-        try:
-            cursor.execute("""
-                SELECT p.*, v.view_count 
+        # The result set depends only on SOUNDEX(name), so that is the cache key;
+        # view counts in a cached result may lag by up to the cache TTL
+        phonetic_key = soundex(name)
+        key = decode_cursor(cursor, "search")
+        after = None
+        if key is not None:
+            if key.get("s") != phonetic_key:
+                raise HTTPException(status_code=400, detail="Cursor belongs to a different search")
+            after = _cursor_int(key, "id")
+        # A client that just wrote skips the cache, which may predate its write, and reads the primary
+        body = search_cache.get(phonetic_key) if after is None and limit == 20 and not pinned else MISSING
+        if body is MISSING:
+            body = await search_lookups.do(
+                (phonetic_key, after, limit, pinned), lambda: _search_sql(phonetic_key, after, limit, pinned)
+            )
+        return tagged_json(body, tag, pinned)
+    except Exception as e:
+        handle_database_error(e)
+
+@app.post("/purchase")
+async def purchase_product(purchase: PurchaseRequest):
+    # Acknowledged once the purchase is durable in the local log; it reaches MySQL in the background
+    purchase_uid = await purchase_log.append(purchase.user_id, purchase.product_id)
+    return {"message": "Purchase request received", "purchase_id": purchase_uid}
+
+@app.get("/purchase/pending")
+async def pending_purchases():
+    return purchase_log.stats()
+
+def _views_page(cnx, after: Optional[Dict[str, int]], limit: int) -> List[Tuple]:
+    """A page of product rows in view_count DESC, product_id DESC order, starting after the given key"""
+    cursor = cnx.cursor()
+    try:
+        products: List[Tuple] = []
+        # Viewed products, seeking on the view ranking index
+        if after is None or after['v'] > 0:
+            seek = "AND (v.view_count < %s OR (v.view_count = %s AND v.product_id < %s))" if after else ""
+            params = (after['v'], after['v'], after['id']) if after else ()
+            cursor.execute(f"""
+                SELECT p.product_id, p.name, p.description, p.image_src, p.price, v.view_count
+                FROM view v
+                JOIN product p ON p.product_id = v.product_id
+                WHERE v.view_count > 0 {seek}
+                ORDER BY v.view_count DESC, v.product_id DESC
+                LIMIT %s
+            """, params + (limit,))
+            products = cursor.fetchall()
+            after = None
+        # Then products nobody has viewed, seeking on the primary key
+        if len(products) < limit:
+            seek = "AND p.product_id < %s" if after else ""
+            params = (after['id'],) if after else ()
+            cursor.execute(f"""
+                SELECT p.product_id, p.name, p.description, p.image_src, p.price, 0 AS view_count
                 FROM product p
                 LEFT JOIN view v ON p.product_id = v.product_id
-                WHERE SOUNDEX(p.name) = SOUNDEX(%s)
+                WHERE COALESCE(v.view_count, 0) = 0 {seek}
                 ORDER BY p.product_id DESC
-                LIMIT 20
-            """, (name,))
-            
-            products = cursor.fetchall()
-            return {"products": products}
-        except Exception as e:
-            handle_database_error(e)
-    
-    except Exception as e:
-        handle_database_error(e)
+                LIMIT %s
+            """, params + (limit - len(products),))
+            products.extend(cursor.fetchall())
+        return products
     finally:
         cursor.close()
-        connection.close()
 
-@app.post("/purchase")
-async def purchase_product(purchase: PurchaseRequest):
-    # Simply print the purchase details as requested
-    print(f"Purchase request - User ID: {purchase.user_id}, Product ID: {purchase.product_id}")
-    return {"message": "Purchase request received"}
+def _getall_page(products: List[Dict[str, Any]], limit: int) -> bytes:
+    next_cursor = None
+    if len(products) == limit:
+        last = products[-1]
+        next_cursor = encode_cursor("getall", v=last['view_count'], id=last['product_id'])
+    return products_page(products, next_cursor)
+
+# Encoded leaderboard pages of /getall by limit, valid while the board is at leaderboard_bodies_version
+leaderboard_bodies: Dict[int, bytes] = {}
+leaderboard_bodies_version = -1
+
+async def _leaderboard_page(limit: int) -> bytes:
+    global leaderboard_bodies_version
+    if leaderboard_bodies_version == leaderboard.version and limit in leaderboard_bodies:
+        return leaderboard_bodies[limit]
+    products = (await leaderboard.top())[:limit]
+    # top() may have reloaded the board, so take the version it returned
+    if leaderboard.version != leaderboard_bodies_version:
+        leaderboard_bodies.clear()
+        leaderboard_bodies_version = leaderboard.version
+    body = leaderboard_bodies[limit] = _getall_page(products, limit)
+    return body
 
 @app.get("/getall")
-async def get_all_products():
-    connection = None
-    cursor = None
+async def get_all_products(
+    request: Request, cursor: Optional[str] = None, limit: int = Query(20, ge=1, le=PAGE_CONFIG['max_limit']),
+):
     try:
-        connection = get_db_connection()
-        cursor = connection.cursor(dictionary=True)
-        
-        cursor.execute("""
-            SELECT p.*, COALESCE(v.view_count, 0) as view_count 
-            FROM product p
-            LEFT JOIN view v ON p.product_id = v.product_id
-            ORDER BY v.view_count DESC, p.product_id DESC
-            LIMIT 20
-        """)
-        
-        products = cursor.fetchall()
-        return {"products": products}
+        pinned = pinned_to_primary(request)
+        tag = catalog_etag(request, pinned)
+        if tag is not None and matches(request, tag):
+            return not_modified(tag, cache_control(pinned))
+        key = decode_cursor(cursor, "getall")
+        if key is None and limit <= leaderboard.size:
+            # Served from the in-memory leaderboard; MySQL is only read to reconcile it
+            return tagged_json(await _leaderboard_page(limit), tag, pinned)
+        after = None if key is None else {'v': _cursor_int(key, 'v'), 'id': _cursor_int(key, 'id')}
+        rows = await reads.run(_views_page, after, limit, pinned=pinned)
+        return tagged_json(_getall_page(product_dicts(rows), limit), tag, pinned)
     except Exception as e:
         handle_database_error(e)
+
+async def _ndjson(first: List[Tuple], rest: AsyncIterator[List[Tuple]]) -> AsyncIterator[bytes]:
+    batch = first
+    try:
+        while batch:
+            yield ndjson(product_dicts(batch))
+            try:
+                batch = await rest.__anext__()
+            except StopAsyncIteration:
+                break
     finally:
-        if cursor:
-            cursor.close()
-        if connection:
-            connection.close()
+        # Hands the connection back (or drops it) even if the client went away mid-stream
+        await rest.aclose()
+
+@app.get("/products/stream")
+async def stream_products(request: Request):
+    """The whole catalog as NDJSON in product_id order, read through an unbuffered cursor"""
+    batches = reads.stream("""
+        SELECT p.product_id, p.name, p.description, p.image_src, p.price,
+            COALESCE(v.view_count, 0) AS view_count
+        FROM product p
+        LEFT JOIN view v ON p.product_id = v.product_id
+        ORDER BY p.product_id
+    """, batch_size=PAGE_CONFIG['stream_batch_size'], dictionary=False, name="stream_products",
+        pinned=pinned_to_primary(request))
+    try:
+        # Read the first batch up front so connection and query errors still get a status code
+        first = await batches.__anext__()
+    except StopAsyncIteration:
+        first = []
+    except Exception as e:
+        handle_database_error(e)
+    return StreamingResponse(_ndjson(first, batches), media_type="application/x-ndjson")
+
+IMPORT_SECONDS = time.perf_counter() - IMPORT_STARTED
 
 if __name__ == "__main__":
     import uvicorn
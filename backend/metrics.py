@@ -0,0 +1,221 @@
+"""Process-wide metrics rendered in the Prometheus text format for /metrics.
+
+Counters, gauges and histograms keep one small list per label combination and
+update it under a lock, since database timings are observed from worker
+threads; an observation is a dict lookup, a bisect and a few additions.
+"""
+import abc
+import bisect
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# Seconds; spans sub-millisecond cache hits to requests that hit the query timeout
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry: List["_Metric"] = []
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_number(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric(abc.ABC):
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _label_text(self, values: Tuple[str, ...], extra: str = '') -> str:
+        pairs = [f'{label}="{_escape(str(value))}"' for label, value in zip(self.labels, values)]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    @abc.abstractmethod
+    def samples(self) -> List[str]:
+        """The exposition lines of every series of this metric"""
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{self._label_text(labels)} {_format_number(value)}" for labels, value in values]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value: float, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(
+        self, name: str, documentation: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+        # Per label combination: per-bucket counts (last one is +Inf), then the sum
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def time(self, *labels: str) -> "_Timer":
+        """Context manager observing the seconds its block takes"""
+        return _Timer(self, labels)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = [(labels, list(counts)) for labels, counts in self._values.items()]
+        lines = []
+        for labels, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = f'le="{_format_number(bound)}"'
+                lines.append(f"{self.name}_bucket{self._label_text(labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{self._label_text(labels)} {_format_number(counts[-1])}")
+            lines.append(f"{self.name}_count{self._label_text(labels)} {cumulative}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: Tuple[str, ...]):
+        self.histogram = histogram
+        self.labels = labels
+        self.start = 0.0
+
+    def __enter__(self) -> None:
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+def render() -> str:
+    """Every registered metric in the Prometheus text exposition format"""
+    return '\n'.join(metric.render() for metric in _registry) + '\n'
+
+
+REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds', "Time to serve a request, including streamed bodies",
+    ('method', 'route', 'status'),
+)
+REQUESTS_IN_FLIGHT = Gauge('http_requests_in_flight', "Requests currently being served", ('method', 'route'))
+QUERY_SECONDS = Histogram('db_query_duration_seconds', "Time a database call holds its connection", ('query',))
+ACQUIRE_SECONDS = Histogram(
+    'db_connection_acquire_seconds', "Time waiting for a pool slot and checking out a connection",
+)
+OBJECT_STORE_SECONDS = Histogram(
+    'object_store_request_duration_seconds', "Time of object store calls made to validate image paths and fetch images",
+    ('operation',),
+)
+DATABASE_READS = Counter(
+    'db_reads_total', "Replica-eligible reads by the server they were routed to", ('target',),
+)
+REPLICA_UP = Gauge('db_replica_up', "1 while a read replica passes its health checks", ('replica',))
+ADMITTED = Gauge('admission_active_requests', "Requests holding an admission slot", ('lane',))
+ADMISSION_QUEUED = Gauge('admission_queued_requests', "Requests waiting for an admission slot", ('lane',))
+ADMISSION_WAIT_SECONDS = Histogram('admission_wait_seconds', "Time admitted requests waited for a slot", ('lane',))
+ADMISSION_SHED = Counter(
+    'admission_shed_total', "Requests rejected with 503 by admission control", ('lane', 'reason'),
+)
+DATABASE_ERRORS = Counter(
+    'database_errors_total', "Errors turned into HTTP responses by handle_database_error", ('status_class',),
+)
+
+
+class RouteTemplates:
+    """Resolves a request's path to the template of the route serving it, e.g. /remove/{product_id}"""
+
+    def __init__(self):
+        self._static: Optional[Dict[str, str]] = None
+        self._dynamic: List[Any] = []
+
+    def __call__(self, scope: Dict[str, Any]) -> str:
+        if self._static is None:
+            # Routes without path parameters resolve with one dict lookup, the few others by regex
+            self._static = {}
+            for route in scope['app'].routes:
+                if getattr(route, 'param_convertors', None):
+                    self._dynamic.append(route)
+                elif hasattr(route, 'path'):
+                    self._static[route.path] = route.path
+        path = scope['path']
+        route = self._static.get(path)
+        if route is not None:
+            return route
+        for candidate in self._dynamic:
+            if candidate.path_regex.match(path):
+                return candidate.path
+        return 'unmatched'
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording latency and in-flight requests per route template"""
+
+    def __init__(self, app):
+        self.app = app
+        self._route = RouteTemplates()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        method = scope['method']
+        route = self._route(scope)
+        status = '500'
+
+        async def send_with_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = str(message['status'])
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc(method, route)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUEST_SECONDS.observe(time.perf_counter() - start, method, route, status)
+            REQUESTS_IN_FLIGHT.dec(method, route)
@@ -0,0 +1,180 @@
+"""Object storage behind product image paths (gs://bucket/key).
+
+OBJECT_STORE selects the backend: 'gcs' talks to Google Cloud Storage (or an
+emulator named by STORAGE_EMULATOR_HOST), 'local' maps gs://bucket/key onto
+OBJECT_STORE_DIR/bucket/key so the server runs and benchmarks offline. All
+methods block and are meant to be run on a worker thread.
+
+The server reads images through it and the initializer uploads the sample
+image; for the local backend both must see the same directory, e.g. through a
+shared volume. Their images are built from separate directories, so this file
+is kept byte for byte the same in backend/ and initializer/;
+backend/tests/test_shared_modules.py fails when the copies differ.
+"""
+import abc
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# (bucket, key) of one object
+ObjectRef = Tuple[str, str]
+
+
+def parse_gcs_path(path: str) -> Optional[ObjectRef]:
+    """Split gs://bucket/key into (bucket, key), or None if path is not of that form"""
+    if not path.startswith('gs://'):
+        return None
+    bucket, _, key = path[5:].partition('/')
+    if not bucket or not key:
+        return None
+    return bucket, key
+
+
+class ObjectStore(abc.ABC):
+    """The operations the server and the initializer need from object storage"""
+
+    name = 'base'
+
+    def warm(self) -> None:
+        """Do any slow client setup now rather than on the first request"""
+
+    @abc.abstractmethod
+    def exists(self, bucket: str, key: str) -> bool:
+        pass
+
+    def exists_many(self, refs: Iterable[ObjectRef]) -> Dict[ObjectRef, bool]:
+        return {ref: self.exists(*ref) for ref in set(refs)}
+
+    @abc.abstractmethod
+    def upload(self, bucket: str, key: str, filename: str) -> None:
+        pass
+
+    @abc.abstractmethod
+    def download(self, bucket: str, key: str, filename: str) -> bool:
+        """Copy the object to filename; False, writing nothing, if there is no such object"""
+
+
+class LocalObjectStore(ObjectStore):
+    """Objects are plain files under root/bucket/key"""
+
+    name = 'local'
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+
+    def _path(self, bucket: str, key: str) -> Optional[str]:
+        path = os.path.abspath(os.path.join(self.root, bucket, key))
+        # Keys such as ../../etc/passwd must not escape the store
+        if not path.startswith(self.root + os.sep):
+            return None
+        return path
+
+    def exists(self, bucket: str, key: str) -> bool:
+        path = self._path(bucket, key)
+        return path is not None and os.path.isfile(path)
+
+    def upload(self, bucket: str, key: str, filename: str) -> None:
+        path = self._path(bucket, key)
+        if path is None:
+            raise ValueError(f"Invalid object key {key}")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copyfile(filename, path)
+
+    def download(self, bucket: str, key: str, filename: str) -> bool:
+        path = self._path(bucket, key)
+        if path is None or not os.path.isfile(path):
+            return False
+        shutil.copyfile(path, filename)
+        return True
+
+
+class GCSObjectStore(ObjectStore):
+    """Google Cloud Storage, with the client created on first use rather than at import"""
+
+    name = 'gcs'
+
+    def __init__(self, fanout: int = 16, list_threshold: int = 8, max_list_results: int = 5000):
+        self.fanout = fanout
+        self.list_threshold = list_threshold
+        self.max_list_results = max_list_results
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            from google.cloud import storage
+            self._client = storage.Client()
+        return self._client
+
+    def warm(self) -> None:
+        # Importing the library and discovering credentials take most of a cold start
+        self.client
+
+    def exists(self, bucket: str, key: str) -> bool:
+        return self.client.bucket(bucket).blob(key).exists()
+
+    def exists_many(self, refs: Iterable[ObjectRef]) -> Dict[ObjectRef, bool]:
+        """Resolve many objects with one prefix listing per bucket where that is cheap, the rest concurrently"""
+        by_bucket: Dict[str, List[str]] = {}
+        for bucket, key in set(refs):
+            by_bucket.setdefault(bucket, []).append(key)
+        found: Dict[ObjectRef, bool] = {}
+        unresolved: List[ObjectRef] = []
+        for bucket, keys in by_bucket.items():
+            listed = self._list_existing(bucket, keys) if len(keys) >= self.list_threshold else None
+            if listed is None:
+                unresolved.extend((bucket, key) for key in keys)
+            else:
+                found.update(((bucket, key), key in listed) for key in keys)
+        if unresolved:
+            with ThreadPoolExecutor(max_workers=min(self.fanout, len(unresolved))) as pool:
+                found.update(zip(unresolved, pool.map(lambda ref: self.exists(*ref), unresolved)))
+        return found
+
+    def _list_existing(self, bucket: str, keys: List[str]) -> Optional[set]:
+        """Keys found by listing their common prefix, or None if that listing would be too large"""
+        prefix = os.path.commonprefix(keys)
+        if not prefix:
+            return None
+        wanted = set(keys)
+        listed = set()
+        for count, blob in enumerate(self.client.list_blobs(bucket, prefix=prefix, fields='items(name),nextPageToken')):
+            if count >= self.max_list_results:
+                return None
+            if blob.name in wanted:
+                listed.add(blob.name)
+                if len(listed) == len(wanted):
+                    break
+        return listed
+
+    def upload(self, bucket: str, key: str, filename: str) -> None:
+        target = self.client.bucket(bucket)
+        emulated = bool(os.getenv('STORAGE_EMULATOR_HOST'))
+        # A local GCS emulator starts empty, so create the bucket there on first use
+        if emulated and not target.exists():
+            target = self.client.create_bucket(bucket)
+        blob = target.blob(key)
+        blob.upload_from_filename(filename)
+        # Make the blob publicly accessible
+        if not emulated:
+            blob.make_public()
+
+    def download(self, bucket: str, key: str, filename: str) -> bool:
+        from google.api_core.exceptions import NotFound
+        try:
+            # Removes the partly written file itself if the download fails
+            self.client.bucket(bucket).blob(key).download_to_filename(filename)
+        except NotFound:
+            return False
+        return True
+
+
+def object_store_from_env() -> ObjectStore:
+    """The backend named by OBJECT_STORE ('gcs' or 'local', rooted at OBJECT_STORE_DIR)"""
+    kind = os.getenv('OBJECT_STORE', 'gcs')
+    if kind == 'gcs':
+        return GCSObjectStore(fanout=int(os.getenv('OBJECT_STORE_FANOUT', '16')))
+    if kind == 'local':
+        return LocalObjectStore(os.getenv('OBJECT_STORE_DIR', 'data/objects'))
+    raise ValueError(f"OBJECT_STORE must be 'gcs' or 'local', got {kind}")
@@ -0,0 +1,30 @@
+"""Opaque keyset cursors for paginated listings.
+
+A cursor is the sort key of the last row of a page, tagged with the listing
+it belongs to and base64url-encoded so clients treat it as a token. The next
+page seeks past that key through an index instead of skipping rows with
+OFFSET, so every page costs the same however deep it is.
+"""
+import base64
+import json
+from typing import Any, Dict, Optional
+
+from fastapi import HTTPException
+
+
+def encode_cursor(listing: str, **key: Any) -> str:
+    payload = json.dumps({"l": listing, **key}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: Optional[str], listing: str) -> Optional[Dict[str, Any]]:
+    """The key encoded in cursor, or None for the first page; 400 if it is not a cursor for listing"""
+    if cursor is None:
+        return None
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except ValueError:
+        key = None
+    if not isinstance(key, dict) or key.pop("l", None) != listing:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return key
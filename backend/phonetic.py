@@ -0,0 +1,34 @@
+"""Python port of MySQL's SOUNDEX(), for computing phonetic keys without a round trip.
+
+MySQL differs from textbook Soundex in ways that matter for matching its
+output exactly: the result is not truncated to four characters, and vowels
+are discarded before duplicates, so a code repeated across a vowel, H or W
+is kept once (banana is B500, not B550). Letters outside A-Z count as vowels.
+Non-letters are skipped and a string without letters gives ''.
+"""
+
+# Codes for A..Z, as in MySQL's soundex_map
+_CODES = "01230120022455012623010202"
+
+
+def _code(ch: str) -> str:
+    upper = ch.upper()
+    if 'A' <= upper <= 'Z':
+        return _CODES[ord(upper) - ord('A')]
+    return '0'
+
+
+def soundex(text: str) -> str:
+    """SOUNDEX(text) as MySQL computes it"""
+    letters = [ch for ch in text if ch.isalpha()]
+    if not letters:
+        return ''
+    key = [letters[0].upper()]
+    last = _code(letters[0])
+    for ch in letters[1:]:
+        code = _code(ch)
+        # As in MySQL, only an appended code is remembered, so '0' letters do not reset it
+        if code != '0' and code != last:
+            key.append(code)
+            last = code
+    return ''.join(key).ljust(4, '0')
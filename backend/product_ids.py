@@ -0,0 +1,176 @@
+"""In-memory set of live product IDs for /analytics/view.
+
+A view only needs to know that its product exists, so the IDs are kept as a
+bitmap in 8 KiB chunks, one bit per ID in each 65536-ID range that holds any
+product. Dense ranges of IDs cost one bit each, and a membership test is a
+dict lookup and a bit test. /add and /remove keep the set current. A
+periodic reload from MySQL corrects drift from writes made around the server,
+such as the initializer seeding the table directly.
+"""
+import asyncio
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from database import Database
+
+CHUNK_BITS = 16
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+CHUNK_BYTES = (1 << CHUNK_BITS) // 8
+
+
+class _Bitmap:
+    def __init__(self):
+        self.chunks: Dict[int, bytearray] = {}
+        self.count = 0
+
+    def __contains__(self, product_id: int) -> bool:
+        chunk = self.chunks.get(product_id >> CHUNK_BITS)
+        if chunk is None:
+            return False
+        offset = product_id & CHUNK_MASK
+        return bool(chunk[offset >> 3] & (1 << (offset & 7)))
+
+    def add(self, product_id: int) -> None:
+        chunk = self.chunks.get(product_id >> CHUNK_BITS)
+        if chunk is None:
+            chunk = self.chunks[product_id >> CHUNK_BITS] = bytearray(CHUNK_BYTES)
+        offset = product_id & CHUNK_MASK
+        bit = 1 << (offset & 7)
+        if not chunk[offset >> 3] & bit:
+            chunk[offset >> 3] |= bit
+            self.count += 1
+
+    def discard(self, product_id: int) -> None:
+        chunk = self.chunks.get(product_id >> CHUNK_BITS)
+        if chunk is None:
+            return
+        offset = product_id & CHUNK_MASK
+        bit = 1 << (offset & 7)
+        if chunk[offset >> 3] & bit:
+            chunk[offset >> 3] &= ~bit
+            self.count -= 1
+            # Emptied chunks are left in place; the next reload drops them
+
+    def update(self, other: "_Bitmap") -> None:
+        """Add every ID of other"""
+        for key, theirs in other.chunks.items():
+            ours = self.chunks.get(key)
+            if ours is None:
+                self.chunks[key] = bytearray(theirs)
+                self.count += _popcount(theirs)
+                continue
+            merged = (int.from_bytes(ours, 'little') | int.from_bytes(theirs, 'little')).to_bytes(CHUNK_BYTES, 'little')
+            self.count += _popcount(merged) - _popcount(ours)
+            ours[:] = merged
+
+
+def _popcount(chunk: bytes) -> int:
+    return bin(int.from_bytes(chunk, 'little')).count('1')
+
+
+def _bitmap_of(id_arrays: Iterable[Iterable[int]]) -> _Bitmap:
+    bitmap = _Bitmap()
+    for product_ids in id_arrays:
+        for product_id in product_ids:
+            bitmap.add(product_id)
+    return bitmap
+
+
+class ProductIds:
+    """Membership of product IDs in the product table, without a query per lookup"""
+
+    def __init__(self, db: Database, resync_interval: float = 60.0, batch_size: int = 10000):
+        self.db = db
+        self.resync_interval = resync_interval
+        self.batch_size = batch_size
+        self._bitmap = _Bitmap()
+        self._loaded = False
+        # Adds and removes made while a reload is reading the table, replayed over its result
+        self._changes: Optional[List[Tuple[bool, int]]] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def loaded(self) -> bool:
+        """False until the first load completes; callers must not trust misses before then"""
+        return self._loaded
+
+    def __contains__(self, product_id: int) -> bool:
+        return product_id in self._bitmap
+
+    def __len__(self) -> int:
+        return self._bitmap.count
+
+    def start(self) -> None:
+        """Start the periodic reload; must be called from the running event loop"""
+        self._lock = asyncio.Lock()
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def add(self, product_id: int) -> None:
+        self._bitmap.add(product_id)
+        if self._changes is not None:
+            self._changes.append((True, product_id))
+
+    def discard(self, product_id: int) -> None:
+        self._bitmap.discard(product_id)
+        if self._changes is not None:
+            self._changes.append((False, product_id))
+
+    async def preload(self, id_arrays: Iterable[Iterable[int]]) -> None:
+        """Add IDs from a catalog snapshot ahead of the first load from MySQL.
+
+        The snapshot may be stale, so until that load misses are not to be trusted
+        (loaded stays False); a hit on a since-removed product only lets a view
+        through that the view counter's flush then drops.
+        """
+        bitmap = await asyncio.get_event_loop().run_in_executor(None, _bitmap_of, id_arrays)
+        if not self._loaded:
+            self._bitmap.update(bitmap)
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": self._bitmap.count, "bytes": len(self._bitmap.chunks) * CHUNK_BYTES}
+
+    async def resync(self) -> None:
+        """Rebuild the set from the product table, keeping changes made while it was read"""
+        async with self._lock:
+            self._changes = []
+            try:
+                bitmap = _Bitmap()
+                async for rows in self.db.stream(
+                    "SELECT product_id FROM product", batch_size=self.batch_size, dictionary=False,
+                    name="load_product_ids",
+                ):
+                    for (product_id,) in rows:
+                        bitmap.add(product_id)
+                # A change may or may not be in what was read; replaying it is right either way
+                for added, product_id in self._changes:
+                    if added:
+                        bitmap.add(product_id)
+                    else:
+                        bitmap.discard(product_id)
+                drift = bitmap.count - self._bitmap.count
+                first = not self._loaded
+                self._bitmap = bitmap
+                self._loaded = True
+            finally:
+                self._changes = None
+            if first:
+                print(f"Product IDs loaded - {bitmap.count} products")
+            elif drift:
+                print(f"Product IDs resynced - {bitmap.count} products, {drift:+d} from drift")
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.resync_interval)
+            try:
+                await self.resync()
+            except Exception as e:
+                print(f"Error resyncing product IDs: {e}")
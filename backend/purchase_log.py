@@ -0,0 +1,347 @@
+"""Durable purchase intake for /purchase.
+
+Purchases are appended to local segment files and acknowledged once they are
+on disk; a background loader moves them into the purchase table in bulk. The
+request path never waits on MySQL, and a purchase that was acknowledged
+survives a crash of either the process or the database.
+
+Records are length-prefixed (4-byte length, 4-byte CRC32, JSON payload) and
+written by one writer that drains everything queued since its last write and
+makes it durable with a single fsync (group commit). A write that fails is
+cut back off the segment before the next one is written, so the records of
+later batches never follow a torn one. The loader remembers how far it got
+in a checkpoint file; on startup a torn record at the end of the last
+segment is cut off and everything after the checkpoint is loaded again.
+Replays are harmless because each purchase carries a unique purchase_uid.
+"""
+import asyncio
+import json
+import os
+import struct
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from database import Database
+
+_HEADER = struct.Struct('>II')
+
+# (segment number, byte offset) of a record boundary in the log
+Position = Tuple[int, int]
+
+
+def _segment_name(number: int) -> str:
+    return f"purchases-{number:012d}.log"
+
+
+def _read_records(path: str, offset: int, end: Optional[int], limit: int) -> Tuple[List[Dict[str, Any]], int]:
+    """Up to limit intact records of one segment from offset, stopping at end or the first torn record"""
+    records = []
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        while len(records) < limit and (end is None or offset < end):
+            header = f.read(_HEADER.size)
+            if len(header) < _HEADER.size:
+                break
+            length, crc = _HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            records.append(json.loads(payload))
+            offset += _HEADER.size + length
+    return records, offset
+
+
+class PurchaseLog:
+    """Append-only, group-committed purchase log drained into MySQL in the background"""
+
+    def __init__(
+        self,
+        directory: str,
+        db: Database,
+        segment_bytes: int = 16 * 1024 * 1024,
+        max_queue: int = 10000,
+        max_backlog: int = 1000000,
+        load_batch: int = 1000,
+        load_interval: float = 1.0,
+    ):
+        self.directory = directory
+        self.db = db
+        self.segment_bytes = segment_bytes
+        self.max_queue = max_queue
+        self.max_backlog = max_backlog
+        self.load_batch = load_batch
+        self.load_interval = load_interval
+        self._queue: List[Tuple[bytes, asyncio.Future]] = []
+        # Durable records not yet loaded into MySQL
+        self._backlog = 0
+        self._segment = 0
+        self._file = None
+        self._durable: Position = (0, 0)
+        # Where segments left behind after a failed write stop holding acknowledged records
+        self._ends: Dict[int, int] = {}
+        self._checkpoint: Position = (0, 0)
+        self._io: Optional[ThreadPoolExecutor] = None
+        self._queued: Optional[asyncio.Event] = None
+        self._appended: Optional[asyncio.Event] = None
+        self._writer: Optional[asyncio.Task] = None
+        self._inflight: Optional[asyncio.Future] = None
+        self._loading: Optional[asyncio.Future] = None
+        self._loader: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """Recover the log and start the writer and loader; must be called from the running event loop"""
+        os.makedirs(self.directory, exist_ok=True)
+        self._recover()
+        self._io = ThreadPoolExecutor(max_workers=1, thread_name_prefix="purchase-log")
+        self._queued = asyncio.Event()
+        self._appended = asyncio.Event()
+        if self._backlog:
+            self._appended.set()
+        self._writer = asyncio.ensure_future(self._write_loop())
+        self._loader = asyncio.ensure_future(self._load_loop())
+
+    async def stop(self) -> None:
+        """Write out queued purchases, load what MySQL will take and close the log"""
+        for task in (self._writer, self._loader):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._writer = self._loader = None
+        for pending in (self._inflight, self._loading):
+            if pending is not None:
+                try:
+                    await pending
+                except Exception:
+                    pass
+        if self._queue:
+            await self._commit()
+        try:
+            while self._backlog and await self._load():
+                pass
+        except Exception as e:
+            print(f"Error loading purchases on shutdown, they will be replayed on startup: {e}")
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._io is not None:
+            self._io.shutdown(wait=True)
+            self._io = None
+
+    async def append(self, user_id: int, product_id: int) -> str:
+        """Queue a purchase and return its purchase_uid once it is durable on disk"""
+        if self._writer is None:
+            raise HTTPException(status_code=503, detail="Purchase log is not ready")
+        if len(self._queue) >= self.max_queue or self._backlog + len(self._queue) >= self.max_backlog:
+            raise HTTPException(status_code=503, detail="Too many purchases pending, try again later")
+        purchase_uid = uuid.uuid4().hex
+        payload = json.dumps({
+            'purchase_uid': purchase_uid,
+            'user_id': user_id,
+            'product_id': product_id,
+            'purchased_at': time.time(),
+        }, separators=(',', ':')).encode()
+        done = asyncio.get_running_loop().create_future()
+        self._queue.append((_HEADER.pack(len(payload), zlib.crc32(payload)) + payload, done))
+        self._queued.set()
+        await done
+        return purchase_uid
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": len(self._queue),
+            "backlog": self._backlog,
+            "segment": self._segment,
+            "checkpoint": list(self._checkpoint),
+        }
+
+    def _path(self, number: int) -> str:
+        return os.path.join(self.directory, _segment_name(number))
+
+    def _segments(self) -> List[int]:
+        return sorted(
+            int(name[len("purchases-"):-len(".log")])
+            for name in os.listdir(self.directory)
+            if name.startswith("purchases-") and name.endswith(".log")
+        )
+
+    def _recover(self) -> None:
+        try:
+            with open(os.path.join(self.directory, "checkpoint")) as f:
+                self._checkpoint = tuple(json.load(f))
+        except FileNotFoundError:
+            self._checkpoint = (0, 0)
+        segments = [number for number in self._segments() if number >= self._checkpoint[0]]
+        for number in segments:
+            offset = self._checkpoint[1] if number == self._checkpoint[0] else 0
+            while True:
+                records, offset = _read_records(self._path(number), offset, None, self.load_batch)
+                if not records:
+                    break
+                self._backlog += len(records)
+            if number == segments[-1] and offset < os.path.getsize(self._path(number)):
+                # Only the segment being written when the process died can end in a torn record
+                print(f"Truncating torn purchase log record in {_segment_name(number)} at byte {offset}")
+                os.truncate(self._path(number), offset)
+        # Never append after a recovered tail: every run starts a fresh segment
+        self._open_segment(segments[-1] + 1 if segments else self._checkpoint[0])
+        self._durable = (self._segment, 0)
+        if self._backlog:
+            print(f"Purchase log recovered - {self._backlog} purchases to load")
+
+    def _open_segment(self, number: int) -> None:
+        if self._file is not None:
+            self._file.close()
+        self._file = open(self._path(number), 'ab')
+        self._fsync_directory()
+        self._segment = number
+
+    def _fsync_directory(self) -> None:
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _write(self, data: bytes) -> Position:
+        if self._file is None:
+            # The last failed write could not be undone, nor a new segment opened
+            self._open_segment(self._segment + 1)
+        try:
+            self._file.write(data)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        except BaseException:
+            self._discard_tail()
+            raise
+        if self._file.tell() >= self.segment_bytes:
+            # The loader moves on to the new segment once it reaches the end of this one
+            self._open_segment(self._segment + 1)
+        return self._segment, self._file.tell()
+
+    def _discard_tail(self) -> None:
+        """Cut whatever a failed write left in the segment back to the last acknowledged record"""
+        durable = self._durable[1]
+        try:
+            self._file.close()
+        except OSError:
+            # Closing retries the flush of whatever is still buffered, which may fail the same way
+            pass
+        self._file = None
+        try:
+            os.truncate(self._path(self._segment), durable)
+            self._file = open(self._path(self._segment), 'ab')
+            os.fsync(self._file.fileno())
+            return
+        except OSError as e:
+            print(f"Could not truncate {_segment_name(self._segment)} to byte {durable}, starting a new segment: {e}")
+        # The loader stops at the acknowledged end of the abandoned segment and moves on
+        self._ends[self._segment] = durable
+        self._open_segment(self._segment + 1)
+        self._durable = (self._segment, 0)
+
+    async def _commit(self) -> None:
+        batch, self._queue = self._queue, []
+        try:
+            self._durable = await asyncio.get_running_loop().run_in_executor(
+                self._io, self._write, b''.join(data for data, _ in batch)
+            )
+        except Exception as e:
+            for _, done in batch:
+                if not done.done():
+                    done.set_exception(HTTPException(status_code=503, detail=f"Could not record purchase: {e}"))
+            raise
+        self._backlog += len(batch)
+        for _, done in batch:
+            if not done.done():
+                done.set_result(None)
+        self._appended.set()
+
+    async def _write_loop(self) -> None:
+        while True:
+            await self._queued.wait()
+            self._queued.clear()
+            # Everything queued while the previous fsync ran goes out in this one;
+            # shielded so stopping the writer never strands a batch mid-write
+            self._inflight = asyncio.ensure_future(self._commit())
+            try:
+                await asyncio.shield(self._inflight)
+            except Exception as e:
+                print(f"Error writing purchase log: {e}")
+
+    async def _load(self) -> bool:
+        """Load the next batch of durable purchases into MySQL; False once there is nothing left"""
+        segment, offset = self._checkpoint
+        end = self._durable[1] if segment == self._durable[0] else self._ends.get(segment)
+        loop = asyncio.get_running_loop()
+        records, new_offset = await loop.run_in_executor(
+            None, _read_records, self._path(segment), offset, end, self.load_batch
+        )
+        if records:
+            await self.db.run(_insert_purchases, records)
+            position = (segment, new_offset)
+        elif segment < self._durable[0]:
+            # Finished a segment the writer has moved past
+            position = (segment + 1, 0)
+        else:
+            return False
+        await loop.run_in_executor(None, self._save_checkpoint, position)
+        self._checkpoint = position
+        self._backlog -= len(records)
+        return True
+
+    def _save_checkpoint(self, position: Position) -> None:
+        path = os.path.join(self.directory, "checkpoint")
+        with open(path + ".tmp", 'w') as f:
+            json.dump(list(position), f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        self._fsync_directory()
+        for number in self._segments():
+            if number < position[0]:
+                os.remove(self._path(number))
+                self._ends.pop(number, None)
+
+    async def _load_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._appended.wait(), timeout=self.load_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._appended.clear()
+            backlog = self._backlog
+            # Shielded so stopping the loader never leaves the checkpoint behind segments it removed
+            self._loading = asyncio.ensure_future(self._load_all())
+            try:
+                await asyncio.shield(self._loading)
+            except Exception as e:
+                print(f"Error loading purchases: {e}")
+            if self._backlog < backlog:
+                print(f"purchases loaded - {backlog - self._backlog}, {self._backlog} pending")
+
+    async def _load_all(self) -> None:
+        while await self._load():
+            pass
+
+
+def _insert_purchases(cnx, records: List[Dict[str, Any]]) -> None:
+    cursor = cnx.cursor()
+    try:
+        # IGNORE skips purchases a replay after a crash already loaded
+        cursor.executemany("""
+            INSERT IGNORE INTO purchase (purchase_uid, user_id, product_id, purchased_at)
+            VALUES (%s, %s, %s, FROM_UNIXTIME(%s))
+        """, [
+            (record['purchase_uid'], record['user_id'], record['product_id'], record['purchased_at'])
+            for record in records
+        ])
+    finally:
+        cursor.close()
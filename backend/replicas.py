@@ -0,0 +1,211 @@
+"""Routing of read-only queries across MySQL read replicas.
+
+Each replica has its own Database pool. A read goes to the healthy replica
+with the fewest queries in flight, rotating among ties. It goes to the
+primary when no replica is healthy, or when the caller is pinned there to
+read its own recent writes. A replica is dropped from rotation as soon as a
+connection to it fails, and the failed read is retried on the primary.
+Background health checks bring it back, and with max_lag set they also drop
+replicas lagging further behind than that.
+"""
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Sequence
+
+from fastapi import HTTPException
+from mysql.connector import Error, InterfaceError, OperationalError
+
+from database import Database
+from metrics import DATABASE_READS, REPLICA_UP
+
+
+def _is_connection_failure(e: BaseException) -> bool:
+    # Database reports failing to connect as a 500; a saturated pool (503) is not a failure
+    if isinstance(e, HTTPException):
+        return e.status_code == 500
+    return isinstance(e, (InterfaceError, OperationalError))
+
+
+class _Replica:
+    def __init__(self, name: str, db: Database):
+        self.name = name
+        self.db = db
+        self.healthy = False
+        self.outstanding = 0
+
+
+class ReplicaSet:
+    """The primary plus zero or more read replicas, chosen per read by least outstanding queries"""
+
+    def __init__(
+        self,
+        primary: Database,
+        replicas: Dict[str, Database],
+        check_interval: float = 5.0,
+        max_lag: float = 0.0,
+    ):
+        self.primary = primary
+        self.check_interval = check_interval
+        self.max_lag = max_lag
+        self._replicas = [_Replica(name, db) for name, db in replicas.items()]
+        self._turn = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._replicas)
+
+    def start(self) -> None:
+        """Start every replica pool and the health checker; must be called from the running event loop"""
+        for replica in self._replicas:
+            replica.db.start()
+        if self._replicas:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def close(self) -> None:
+        for replica in self._replicas:
+            replica.db.close()
+
+    async def warm(self) -> None:
+        """Check every replica once and pre-open the pools of the healthy ones"""
+        await self.check()
+        await asyncio.gather(*(replica.db.warm() for replica in self._replicas if replica.healthy))
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            replica.name: {"healthy": replica.healthy, "outstanding": replica.outstanding}
+            for replica in self._replicas
+        }
+
+    def _pick(self, pinned: bool) -> Optional[_Replica]:
+        if pinned:
+            return None
+        healthy = [replica for replica in self._replicas if replica.healthy]
+        if not healthy:
+            return None
+        # Rotate the starting point so equally loaded replicas take turns
+        self._turn = (self._turn + 1) % len(healthy)
+        return min(healthy[self._turn:] + healthy[:self._turn], key=lambda replica: replica.outstanding)
+
+    async def _read(self, call: Callable[[Database], Awaitable[Any]], pinned: bool) -> Any:
+        replica = self._pick(pinned)
+        if replica is not None:
+            DATABASE_READS.inc(replica.name)
+            replica.outstanding += 1
+            try:
+                return await call(replica.db)
+            except Exception as e:
+                if not _is_connection_failure(e):
+                    raise
+                self._mark_down(replica, e)
+            finally:
+                replica.outstanding -= 1
+        DATABASE_READS.inc('primary')
+        return await call(self.primary)
+
+    async def run(self, fn: Callable, *args: Any, pinned: bool = False, name: Optional[str] = None) -> Any:
+        """Database.run for a read-only fn, on a replica unless pinned to the primary"""
+        return await self._read(lambda db: db.run(fn, *args, name=name or fn.__name__.lstrip('_')), pinned)
+
+    async def fetchall(
+        self, sql: str, params: Sequence[Any] = (), dictionary: bool = True, name: str = "fetchall",
+        pinned: bool = False,
+    ) -> List[Any]:
+        return await self._read(lambda db: db.fetchall(sql, params, dictionary, name=name), pinned)
+
+    async def stream(
+        self, sql: str, params: Sequence[Any] = (), batch_size: int = 1000, dictionary: bool = True,
+        name: str = "stream", pinned: bool = False,
+    ) -> AsyncIterator[List[Any]]:
+        """Database.stream on a replica unless pinned; only a failure before the first batch falls back"""
+        replica = self._pick(pinned)
+        if replica is not None:
+            DATABASE_READS.inc(replica.name)
+            replica.outstanding += 1
+            batches = replica.db.stream(sql, params, batch_size, dictionary, name=name)
+            started = False
+            try:
+                async for rows in batches:
+                    started = True
+                    yield rows
+                return
+            except Exception as e:
+                if not _is_connection_failure(e):
+                    raise
+                self._mark_down(replica, e)
+                if started:
+                    raise
+            finally:
+                replica.outstanding -= 1
+                # Not left to garbage collection, so the connection goes back at once
+                await batches.aclose()
+        DATABASE_READS.inc('primary')
+        batches = self.primary.stream(sql, params, batch_size, dictionary, name=name)
+        try:
+            async for rows in batches:
+                yield rows
+        finally:
+            await batches.aclose()
+
+    def _mark_down(self, replica: _Replica, reason: Any) -> None:
+        if replica.healthy:
+            print(f"Replica {replica.name} removed from rotation: {getattr(reason, 'detail', reason)}")
+        replica.healthy = False
+        REPLICA_UP.set(0, replica.name)
+        # Whatever is pooled for it is most likely dead too
+        replica.db.discard_idle()
+
+    async def check(self) -> None:
+        """Health check every replica, returning recovered ones to rotation and dropping failing ones"""
+        await asyncio.gather(*(self._check(replica) for replica in self._replicas))
+
+    async def _check(self, replica: _Replica) -> None:
+        try:
+            lag = await replica.db.run(_replica_lag, self.max_lag > 0, name="replica_check")
+        except HTTPException as e:
+            if e.status_code == 503:
+                # Busy rather than broken; leave it as it is
+                return
+            self._mark_down(replica, e)
+            return
+        except Error as e:
+            self._mark_down(replica, e)
+            return
+        if self.max_lag > 0 and (lag is None or lag > self.max_lag):
+            self._mark_down(replica, f"replication lag {lag} exceeds {self.max_lag}s")
+            return
+        if not replica.healthy:
+            print(f"Replica {replica.name} in rotation")
+        replica.healthy = True
+        REPLICA_UP.set(1, replica.name)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                await self.check()
+            except Exception as e:
+                print(f"Error checking replicas: {e}")
+
+
+def _replica_lag(cnx, with_lag: bool) -> Optional[float]:
+    """Seconds the replica is behind its source, None if replication is not running or with_lag is off"""
+    cursor = cnx.cursor(dictionary=True)
+    try:
+        if not with_lag:
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            return None
+        cursor.execute("SHOW REPLICA STATUS")
+        row = cursor.fetchone()
+        cursor.fetchall()
+        return None if row is None else row.get('Seconds_Behind_Source')
+    finally:
+        cursor.close()
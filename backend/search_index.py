@@ -0,0 +1,240 @@
+"""In-memory fuzzy product search for /search.
+
+Product names are broken into trigrams ("  beer " -> "  b", " be", "bee",
+"eer", "er ") and indexed in a compressed postings layout: one int32 array of
+slots sorted by trigram plus an offsets array, so a million names cost a few
+tens of MB and no per-posting Python objects. Products added after the last
+compaction live in a small per-trigram delta until the next one.
+
+Each slot also keeps its own trigram ids (a forward index), so a query only
+has to draw candidates from the postings of its rarer trigrams: shared-trigram
+counts for those candidates come from one gather of their forward entries and
+a binary search against the query's few trigram ids. Jaccard similarity picks
+a short list, of at least the number of results asked for, that is re-ranked
+by edit distance, all as array operations.
+"""
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+import numpy as np
+
+
+def trigrams(text: str) -> Set[str]:
+    padded = f"  {text.lower()} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distances(query: str, names: List[str]) -> np.ndarray:
+    """Edit distance from query to every name, computed for all names at once
+
+    Counts insertions, deletions, substitutions and adjacent transpositions
+    ("bere" -> "beer" is one edit). The DP advances one query character at a
+    time with each row held as a (names x width) array; the left-to-right
+    insertion dependency within a row is resolved with a running minimum
+    instead of a Python loop.
+    """
+    width = max(map(len, names))
+    chars = np.full((len(names), width), -1, dtype=np.int64)
+    for i, name in enumerate(names):
+        chars[i, :len(name)] = np.frombuffer(name.encode('utf-32-le'), dtype='<u4')
+    steps = np.arange(width + 1)
+    before, row = None, np.tile(steps, (len(names), 1))
+    for i, ch in enumerate(query, 1):
+        best = np.empty_like(row)
+        best[:, 0] = i
+        np.minimum(row[:, :-1] + (chars != ord(ch)), row[:, 1:] + 1, out=best[:, 1:])
+        if before is not None and width > 1:
+            swapped = (chars[:, :-1] == ord(ch)) & (chars[:, 1:] == ord(query[i - 2]))
+            best[:, 2:] = np.where(swapped, np.minimum(best[:, 2:], before[:, :-2] + 1), best[:, 2:])
+        before, row = row, np.minimum.accumulate(best - steps, axis=1) + steps
+    return row[np.arange(len(names)), [len(name) for name in names]]
+
+
+class TrigramIndex:
+    """Trigram postings over product names with vectorized candidate scoring"""
+
+    def __init__(
+        self,
+        rerank: int = 40,
+        min_similarity: float = 0.1,
+        max_candidates: int = 2000,
+        compact_threshold: int = 100000,
+    ):
+        self.rerank = rerank
+        self.max_candidates = max_candidates
+        self.min_similarity = min_similarity
+        self.compact_threshold = compact_threshold
+        self._reset()
+
+    def _reset(self) -> None:
+        self._gram_ids: Dict[str, int] = {}
+        self._slot_of: Dict[int, int] = {}
+        self._rows: List[Optional[Dict[str, Any]]] = []
+        self._names: List[str] = []
+        self._size = 0
+        self._gram_counts = np.zeros(1024, dtype=np.int32)
+        self._alive = np.zeros(1024, dtype=bool)
+        # Forward index: trigram ids of slot s are _forward[_forward_start[s]:][:_gram_counts[s]]
+        self._forward_start = np.zeros(1024, dtype=np.int64)
+        self._forward = np.zeros(8192, dtype=np.int32)
+        self._forward_size = 0
+        self._query_mask = np.zeros(0, dtype=np.uint8)
+        # Compacted postings: slots of gram g are _postings[_offsets[g]:_offsets[g + 1]]
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._postings = np.zeros(0, dtype=np.int32)
+        self._delta: Dict[int, List[int]] = {}
+        self._delta_size = 0
+
+    def __len__(self) -> int:
+        return len(self._slot_of)
+
+    def build(self, rows: Iterable[Dict[str, Any]]) -> None:
+        """Replace the index contents with rows, each a product dict including name"""
+        self._reset()
+        for row in rows:
+            self._append(row)
+        self.compact()
+
+    def load(self, cnx) -> None:
+        """Build the index from the product and view tables over a database connection"""
+        cursor = cnx.cursor(dictionary=True)
+        try:
+            cursor.execute("""
+                SELECT p.product_id, p.name, p.description, p.image_src, p.price, v.view_count
+                FROM product p
+                LEFT JOIN view v ON p.product_id = v.product_id
+            """)
+            self.build(cursor)
+        finally:
+            cursor.close()
+
+    def add(self, row: Dict[str, Any]) -> None:
+        self.remove(row['product_id'])
+        self._append(row)
+        if self._delta_size >= self.compact_threshold:
+            self.compact()
+
+    def remove(self, product_id: int) -> None:
+        slot = self._slot_of.pop(product_id, None)
+        if slot is not None:
+            # The slot's postings are skipped from now on and dropped at the next compaction
+            self._alive[slot] = False
+            self._rows[slot] = None
+
+    def record_view(self, product_id: int, views: int = 1) -> None:
+        slot = self._slot_of.get(product_id)
+        if slot is not None:
+            row = self._rows[slot]
+            row['view_count'] = (row['view_count'] or 0) + views
+
+    def _append(self, row: Dict[str, Any]) -> None:
+        slot = self._size
+        if slot == len(self._alive):
+            self._gram_counts = np.concatenate([self._gram_counts, np.zeros(slot, dtype=np.int32)])
+            self._alive = np.concatenate([self._alive, np.zeros(slot, dtype=bool)])
+            self._forward_start = np.concatenate([self._forward_start, np.zeros(slot, dtype=np.int64)])
+        grams = trigrams(row['name'])
+        if self._forward_size + len(grams) > len(self._forward):
+            self._forward = np.concatenate([self._forward, np.zeros(len(self._forward) + len(grams), dtype=np.int32)])
+        self._forward_start[slot] = self._forward_size
+        for gram in grams:
+            gram_id = self._gram_ids.setdefault(gram, len(self._gram_ids))
+            self._delta.setdefault(gram_id, []).append(slot)
+            self._forward[self._forward_size] = gram_id
+            self._forward_size += 1
+        self._delta_size += len(grams)
+        self._gram_counts[slot] = len(grams)
+        self._alive[slot] = True
+        self._rows.append(row)
+        self._names.append(row['name'].lower())
+        self._slot_of[row['product_id']] = slot
+        self._size += 1
+
+    def compact(self) -> None:
+        """Merge the delta into the compacted postings, dropping removed slots"""
+        base_grams = np.repeat(np.arange(len(self._offsets) - 1, dtype=np.int32), np.diff(self._offsets))
+        delta_grams = np.fromiter(
+            (gram for gram, slots in self._delta.items() for _ in slots), dtype=np.int32, count=self._delta_size
+        )
+        delta_slots = np.fromiter(
+            (slot for slots in self._delta.values() for slot in slots), dtype=np.int32, count=self._delta_size
+        )
+        grams = np.concatenate([base_grams, delta_grams])
+        slots = np.concatenate([self._postings, delta_slots])
+        live = self._alive[slots]
+        grams, slots = grams[live], slots[live]
+        order = np.lexsort((slots, grams))
+        self._postings = slots[order]
+        self._offsets = np.concatenate(
+            [[0], np.cumsum(np.bincount(grams, minlength=len(self._gram_ids)))]
+        ).astype(np.int64)
+        self._delta = {}
+        self._delta_size = 0
+
+    def search(self, text: str, limit: int = 20) -> List[Dict[str, Any]]:
+        """Return up to limit products whose names best match text"""
+        query_grams = trigrams(text)
+        compacted = len(self._offsets) - 1
+        postings = []
+        for gram in query_grams:
+            gram_id = self._gram_ids.get(gram)
+            if gram_id is None:
+                continue
+            # Delta slots are always newer than compacted ones, so this stays sorted
+            parts = []
+            if gram_id < compacted:
+                parts.append(self._postings[self._offsets[gram_id]:self._offsets[gram_id + 1]])
+            if gram_id in self._delta:
+                parts.append(np.asarray(self._delta[gram_id], dtype=np.int32))
+            merged = parts[0] if len(parts) == 1 else np.concatenate(parts)
+            if len(merged):
+                postings.append(merged)
+        if not postings:
+            return []
+
+        # Draw candidates from the rarest trigrams, always at least half of them so
+        # a typo in the rare part of the query cannot hide the right products;
+        # very common trigrams ("  b") are only counted, never expanded
+        postings.sort(key=len)
+        generate, total = [], 0
+        for posting in postings:
+            if generate and total + len(posting) > self.max_candidates:
+                break
+            generate.append(posting)
+            total += len(posting)
+        slots = generate[0] if len(generate) == 1 else np.unique(np.concatenate(generate))
+
+        # Shared trigrams per candidate: gather each candidate's forward entries
+        # and test them against a per-trigram mask of the query
+        query_ids = [self._gram_ids[gram] for gram in query_grams if gram in self._gram_ids]
+        if len(self._query_mask) < len(self._gram_ids):
+            self._query_mask = np.zeros(len(self._gram_ids) * 2, dtype=np.uint8)
+        self._query_mask[query_ids] = 1
+        counts = self._gram_counts[slots]
+        ends = np.cumsum(counts)
+        gathered = self._forward[np.repeat(self._forward_start[slots] - ends + counts, counts) + np.arange(ends[-1])]
+        shared = np.add.reduceat(self._query_mask[gathered], ends - counts, dtype=np.int32)
+        self._query_mask[query_ids] = 0
+
+        live = self._alive[slots]
+        slots, shared = slots[live], shared[live]
+        similarity = shared / (len(query_grams) + self._gram_counts[slots] - shared)
+        keep = similarity >= self.min_similarity
+        slots, similarity = slots[keep], similarity[keep]
+        if not len(slots):
+            return []
+        window = max(self.rerank, limit)
+        if len(slots) > window:
+            best = np.argpartition(-similarity, window - 1)[:window]
+            slots, similarity = slots[best], similarity[best]
+
+        # Re-rank the short list by edit distance; ties go to the newest product like the SQL path
+        query = text.lower()
+        names = [self._names[slot] for slot in slots.tolist()]
+        lengths = np.array([max(len(query), len(name), 1) for name in names])
+        score = similarity + 1 - edit_distances(query, names) / lengths
+        ranked = sorted(
+            zip(score.tolist(), slots.tolist()),
+            key=lambda pair: (pair[0], self._rows[pair[1]]['product_id']),
+            reverse=True,
+        )
+        return [self._rows[slot] for _, slot in ranked[:limit]]
@@ -0,0 +1,59 @@
+"""Fast JSON encoding for product responses.
+
+Product lists are the bulk of what /search, /getall and /products/stream
+send. They are encoded here with orjson straight to bytes and returned as a
+JSONBytes response, which FastAPI passes through untouched, so neither
+jsonable_encoder nor the stdlib json module runs over them. The bytes can be
+cached and sent again as they are.
+"""
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import orjson
+from starlette.responses import Response
+
+# Column order the product queries select, and so the shape of their tuple rows
+PRODUCT_FIELDS = ('product_id', 'name', 'description', 'image_src', 'price', 'view_count')
+ProductRow = Tuple[int, str, Optional[str], Optional[str], Decimal, Optional[int]]
+
+
+class JSONBytes(Response):
+    """A response whose body is already encoded JSON"""
+
+    media_type = "application/json"
+
+
+def _default(value: Any) -> Any:
+    # DECIMAL(10,2) prices, sent as numbers like jsonable_encoder does
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(value: Any) -> bytes:
+    return orjson.dumps(value, default=_default)
+
+
+def product_dicts(rows: Iterable[ProductRow]) -> List[Dict[str, Any]]:
+    """Map tuple rows in PRODUCT_FIELDS order to response objects"""
+    return [
+        {
+            'product_id': product_id,
+            'name': name,
+            'description': description,
+            'image_src': image_src,
+            'price': float(price),
+            'view_count': view_count,
+        }
+        for product_id, name, description, image_src, price, view_count in rows
+    ]
+
+
+def products_page(products: List[Dict[str, Any]], next_cursor: Optional[str]) -> bytes:
+    """The {"products": ..., "next_cursor": ...} body shared by the product list endpoints"""
+    return dumps({"products": products, "next_cursor": next_cursor})
+
+
+def ndjson(products: List[Dict[str, Any]]) -> bytes:
+    """One JSON object per line"""
+    return b''.join(dumps(product) + b'\n' for product in products)
@@ -0,0 +1,188 @@
+"""Pre-forking production entry point for main_server.
+
+The parent binds the listening socket and forks WEB_WORKERS workers that all
+accept on it. Each worker imports main_server itself, after the fork, so it
+has its own event loop, connection pools and in-memory state. Pool sizes are
+divided so that all workers together open at most MYSQL_CONNECTION_BUDGET
+connections to each MySQL server. A worker that exits unexpectedly is
+replaced, with a growing delay while it keeps failing soon after starting.
+On SIGTERM or SIGINT the workers stop accepting, finish their in-flight
+requests and flush their write-behind state; any still running after
+WORKER_DRAIN_SECONDS are killed.
+
+    WEB_WORKERS=4 python serve.py
+"""
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+from typing import Dict
+
+# A worker exiting sooner than this after it started counts as failing to start
+MIN_UPTIME = 5.0
+MAX_RESTART_DELAY = 30.0
+
+SERVE_CONFIG = {
+    'workers': int(os.getenv('WEB_WORKERS', '1')),
+    'host': os.getenv('HOST', '0.0.0.0'),
+    'port': int(os.getenv('PORT', '8080')),
+    'backlog': int(os.getenv('LISTEN_BACKLOG', '2048')),
+    'connection_budget': int(os.getenv('MYSQL_CONNECTION_BUDGET', '100')),
+    'drain_seconds': float(os.getenv('WORKER_DRAIN_SECONDS', '25')),
+}
+
+stopping = False
+
+
+def worker_environment(workers: int, budget: int) -> Dict[str, str]:
+    """Pool sizes for each worker, capped so workers * pool size stays within the budget"""
+    per_worker = budget // workers
+    if per_worker < 1:
+        print(f"Error: MYSQL_CONNECTION_BUDGET {budget} is less than one connection per worker", file=sys.stderr)
+        sys.exit(1)
+    pool_size = min(int(os.getenv('MYSQL_POOL_SIZE', '10')), per_worker)
+    replica_pool_size = min(int(os.getenv('MYSQL_REPLICA_POOL_SIZE', str(pool_size))), per_worker)
+    return {
+        'WEB_WORKERS': str(workers),
+        'MYSQL_POOL_SIZE': str(pool_size),
+        'MYSQL_REPLICA_POOL_SIZE': str(replica_pool_size),
+    }
+
+
+def bind() -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((SERVE_CONFIG['host'], SERVE_CONFIG['port']))
+    sock.listen(SERVE_CONFIG['backlog'])
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(index: int, sock: socket.socket, environment: Dict[str, str]) -> None:
+    """Body of a forked worker; never returns"""
+    code = 1
+    try:
+        # Terminal Ctrl-C reaches only the parent, which passes it on once; a second
+        # signal would make uvicorn skip draining
+        os.setpgid(0, 0)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        os.environ.update(environment, WEB_WORKER_INDEX=str(index))
+        import uvicorn
+        import main_server
+        server = uvicorn.Server(uvicorn.Config(main_server.app))
+        # On SIGTERM uvicorn stops accepting, waits for in-flight requests and runs the shutdown handlers
+        server.run(sockets=[sock])
+        code = 0 if server.started else 3
+    except SystemExit as e:
+        # main_server exits this way on bad configuration, having printed why
+        code = e.code if isinstance(e.code, int) else 1
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(code)
+
+
+def spawn(index: int, sock: socket.socket, environment: Dict[str, str]) -> int:
+    # Otherwise the worker inherits, and prints again, whatever the parent has buffered
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        run_worker(index, sock, environment)
+    return pid
+
+
+def describe(status: int) -> str:
+    if os.WIFSIGNALED(status):
+        return f"signal {signal.Signals(os.WTERMSIG(status)).name}"
+    return f"code {os.WEXITSTATUS(status)}"
+
+
+def warn_orphaned_purchases(workers: int) -> None:
+    """Purchase logs are per worker; those of worker indexes no longer started are loaded by nobody"""
+    directory = os.getenv('PURCHASE_LOG_DIR', 'data/purchases')
+    if not os.path.isdir(directory):
+        return
+    for name in sorted(os.listdir(directory)):
+        if name.startswith('worker-') and name[7:].isdigit() and int(name[7:]) >= workers:
+            path = os.path.join(directory, name)
+            if any(entry.endswith('.log') for entry in os.listdir(path)):
+                print(f"Warning: {path} may hold unloaded purchases; they load once {int(name[7:]) + 1} workers run")
+
+
+def stop(signum, frame) -> None:
+    global stopping
+    stopping = True
+
+
+def main() -> None:
+    workers = SERVE_CONFIG['workers']
+    if workers < 1:
+        print("Error: WEB_WORKERS must be at least 1", file=sys.stderr)
+        sys.exit(1)
+    environment = worker_environment(workers, SERVE_CONFIG['connection_budget'])
+    print("Serve Configuration:", SERVE_CONFIG)
+    print("Worker Environment:", environment)
+    warn_orphaned_purchases(workers)
+    sock = bind()
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    running: Dict[int, int] = {}  # pid -> worker index
+    started: Dict[int, float] = {}  # worker index -> time it was last started
+    failures: Dict[int, int] = {}  # worker index -> consecutive quick exits
+    restart_at: Dict[int, float] = {}  # worker index -> when to start it again
+    for index in range(workers):
+        restart_at[index] = 0.0
+    drain_deadline = None
+
+    while running or (restart_at and not stopping):
+        now = time.monotonic()
+        if stopping and drain_deadline is None:
+            print(f"Draining {len(running)} workers")
+            restart_at.clear()
+            drain_deadline = now + SERVE_CONFIG['drain_seconds']
+            for pid in running:
+                os.kill(pid, signal.SIGTERM)
+        if drain_deadline is not None and now > drain_deadline:
+            for pid, index in running.items():
+                print(f"Worker {index} (pid {pid}) still busy after {SERVE_CONFIG['drain_seconds']}s, killing it")
+                os.kill(pid, signal.SIGKILL)
+            drain_deadline = float('inf')
+        for index, when in list(restart_at.items()):
+            if when <= now:
+                del restart_at[index]
+                pid = spawn(index, sock, environment)
+                running[pid] = index
+                started[index] = now
+                print(f"Worker {index} started (pid {pid})")
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            pid = 0
+        if pid == 0:
+            time.sleep(0.1)
+            continue
+        index = running.pop(pid, None)
+        if index is None:
+            continue
+        if stopping:
+            print(f"Worker {index} (pid {pid}) stopped with {describe(status)}")
+            continue
+        if time.monotonic() - started[index] < MIN_UPTIME:
+            failures[index] = failures.get(index, 0) + 1
+        else:
+            failures[index] = 0
+        delay = min(MAX_RESTART_DELAY, 0.5 * 2 ** failures[index]) if failures[index] else 0.0
+        print(f"Worker {index} (pid {pid}) exited with {describe(status)}, restarting in {delay:.1f}s")
+        restart_at[index] = time.monotonic() + delay
+    sock.close()
+
+
+if __name__ == "__main__":
+    main()
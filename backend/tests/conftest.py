@@ -0,0 +1,8 @@
+import os
+
+# main_server reads its configuration at import; no test connects to any of it
+for name, value in {
+    'MYSQL_HOST': '127.0.0.1', 'MYSQL_PORT': '3306', 'MYSQL_USER': 'root', 'MYSQL_PASSWORD': 'password',
+    'MYSQL_DATABASE': 'retail', 'OBJECT_STORE': 'local', 'SEARCH_ENGINE': 'sql',
+}.items():
+    os.environ.setdefault(name, value)
@@ -0,0 +1,60 @@
+import json
+
+import pytest
+from starlette.testclient import TestClient
+
+import main_server
+
+
+@pytest.fixture
+def client(monkeypatch):
+    inserted = []
+
+    async def validate_gcs_paths(image_srcs):
+        return {image_src: True for image_src in image_srcs}
+
+    async def transaction(fn, products, **kwargs):
+        inserted.extend(product.product_id for product in products)
+        return set(), 1
+
+    monkeypatch.setitem(main_server.BATCH_CONFIG, 'max_items', 3)
+    monkeypatch.setitem(main_server.BATCH_CONFIG, 'chunk_size', 2)
+    monkeypatch.setattr(main_server, 'validate_gcs_paths', validate_gcs_paths)
+    monkeypatch.setattr(main_server.db, 'transaction', transaction)
+    client = TestClient(main_server.app)
+    client.inserted = inserted
+    return client
+
+
+def _product(product_id):
+    return {
+        'product_id': product_id, 'name': f"Product {product_id}", 'description': '',
+        'image_src': f"gs://bucket/{product_id}.png", 'price': 1.5,
+    }
+
+
+def _ndjson(count):
+    return ''.join(json.dumps(_product(product_id)) + '\n' for product_id in range(1, count + 1))
+
+
+def test_ndjson_within_limit(client):
+    response = client.post(
+        "/add/batch", data=_ndjson(3), headers={'Content-Type': 'application/x-ndjson'}
+    )
+    assert response.status_code == 200
+    assert response.json()['added'] == 3
+
+
+@pytest.mark.parametrize("trailing_newline", [True, False])
+def test_ndjson_over_limit(client, trailing_newline):
+    body = _ndjson(5) if trailing_newline else _ndjson(4).rstrip('\n')
+    response = client.post("/add/batch", data=body, headers={'Content-Type': 'application/x-ndjson'})
+    assert response.status_code == 413
+    # Reading stopped at the fourth product, after only the first chunk was added
+    assert client.inserted == [1, 2]
+
+
+def test_json_array_over_limit(client):
+    response = client.post("/add/batch", json=[_product(product_id) for product_id in range(1, 5)])
+    assert response.status_code == 413
+    assert client.inserted == []
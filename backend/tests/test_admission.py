@@ -0,0 +1,135 @@
+import asyncio
+
+import pytest
+
+from admission import Lane, Overloaded
+
+
+def _run(coroutine):
+    return asyncio.new_event_loop().run_until_complete(coroutine)
+
+
+async def _queue(lane):
+    """Start an acquire and let it join the queue"""
+    task = asyncio.ensure_future(lane.acquire())
+    await asyncio.sleep(0)
+    return task
+
+
+def test_admits_up_to_limit_without_queueing():
+    async def scenario():
+        lane = Lane('test', limit=2, max_queue=1, deadline=1)
+        await lane.acquire()
+        await lane.acquire()
+        assert lane.stats()['active'] == 2
+        assert lane.stats()['queued'] == 0
+
+    _run(scenario())
+
+
+def test_sheds_when_queue_full():
+    async def scenario():
+        lane = Lane('test', limit=1, max_queue=1, deadline=1)
+        await lane.acquire()
+        waiting = await _queue(lane)
+        with pytest.raises(Overloaded) as shed:
+            await lane.acquire()
+        assert shed.value.reason == 'queue_full'
+        assert lane.shed == {'queue_full': 1}
+        lane.release(0.01)
+        await waiting
+        assert lane.stats()['active'] == 1
+
+    _run(scenario())
+
+
+def test_sheds_when_queue_would_outlast_deadline():
+    async def scenario():
+        lane = Lane('test', limit=1, max_queue=10, deadline=0.5)
+        lane.service_seconds = 0.4
+        await lane.acquire()
+        # One request ahead at 0.4s each: 0.4s to wait is within the deadline, 0.8s is not
+        waiting = await _queue(lane)
+        with pytest.raises(Overloaded) as shed:
+            await lane.acquire()
+        assert shed.value.reason == 'deadline'
+        assert shed.value.retry_after == pytest.approx(0.8)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+
+    _run(scenario())
+
+
+def test_sheds_after_waiting_past_deadline():
+    async def scenario():
+        lane = Lane('test', limit=1, max_queue=10, deadline=0.05)
+        await lane.acquire()
+        with pytest.raises(Overloaded) as shed:
+            await lane.acquire()
+        assert shed.value.reason == 'timeout'
+        assert lane.stats()['queued'] == 0
+        assert lane.stats()['active'] == 1
+        # The slot is not handed to the waiter that gave up
+        lane.release(0.01)
+        assert lane.stats()['active'] == 0
+
+    _run(scenario())
+
+
+def test_release_skips_a_waiter_that_timed_out():
+    async def scenario():
+        lane = Lane('test', limit=1, max_queue=10, deadline=0.05)
+        await lane.acquire()
+        first = await _queue(lane)
+        await asyncio.sleep(0.03)
+        second = await _queue(lane)
+        with pytest.raises(Overloaded):
+            await first
+        lane.release(0.01)
+        await second
+        assert lane.stats()['active'] == 1
+        assert lane.stats()['queued'] == 0
+
+    _run(scenario())
+
+
+def test_release_skips_a_cancelled_waiter():
+    async def scenario():
+        lane = Lane('test', limit=1, max_queue=10, deadline=1)
+        await lane.acquire()
+        first = await _queue(lane)
+        second = await _queue(lane)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        assert lane.stats()['queued'] == 1
+        lane.release(0.01)
+        await second
+        assert lane.stats()['active'] == 1
+        assert lane.stats()['queued'] == 0
+
+    _run(scenario())
+
+
+def test_slot_handed_to_a_cancelled_waiter_is_not_lost():
+    async def scenario():
+        lane = Lane('test', limit=1, max_queue=10, deadline=1)
+        await lane.acquire()
+        first = await _queue(lane)
+        second = await _queue(lane)
+        # The slot goes to first, which is cancelled before it gets to run
+        lane.release(0.01)
+        first.cancel()
+        (outcome,) = await asyncio.gather(first, return_exceptions=True)
+        if not isinstance(outcome, asyncio.CancelledError):
+            # Some Python versions let the acquire finish anyway; first then holds the slot
+            assert lane.stats()['active'] == 1
+            lane.release(0.01)
+        await second
+        assert lane.stats()['active'] == 1
+        assert lane.stats()['queued'] == 0
+        lane.release(0.01)
+        assert lane.stats()['active'] == 0
+
+    _run(scenario())
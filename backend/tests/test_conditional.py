@@ -0,0 +1,39 @@
+import os
+import subprocess
+import sys
+
+from starlette.requests import Request
+
+from conditional import etag, matches
+
+VARIANT = ('/getall', [('limit', '20')])
+
+
+def _request(if_none_match=None):
+    headers = [] if if_none_match is None else [(b'if-none-match', if_none_match.encode())]
+    return Request({'type': 'http', 'method': 'GET', 'path': '/getall', 'query_string': b'', 'headers': headers})
+
+
+def test_same_tag_in_another_process():
+    # As between pre-forked workers, which share nothing but the catalog version
+    other = subprocess.run(
+        [sys.executable, '-c', f"from conditional import etag; print(etag(3, *{VARIANT!r}))"],
+        capture_output=True, text=True, check=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    assert other.stdout.strip() == etag(3, *VARIANT)
+
+
+def test_tag_follows_version_and_variant():
+    assert etag(3, *VARIANT) == etag(3, '/getall', [('limit', '20')])
+    assert etag(3, *VARIANT) != etag(4, *VARIANT)
+    assert etag(3, *VARIANT) != etag(3, '/getall', [('limit', '21')])
+
+
+def test_matches():
+    tag = etag(3, *VARIANT)
+    assert matches(_request(tag), tag)
+    assert matches(_request(f'"other", W/{tag}'), tag)
+    assert matches(_request('*'), tag)
+    assert not matches(_request('"other"'), tag)
+    assert not matches(_request(), tag)
@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+from starlette.testclient import TestClient
+
+import main_server
+from view_counter import ViewCounter
+
+ROW = (1, 'banana', 'yellow', 'gs://bucket/banana.png', 1.5, 3)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    queries = []
+
+    async def run(fn, *args, **kwargs):
+        queries.append(fn.__name__)
+        return [ROW]
+
+    async def fetchall(sql, *args, **kwargs):
+        queries.append('search')
+        return [ROW]
+
+    async def transaction(fn, *args, **kwargs):
+        # As committed by another request: the catalog moves on one version
+        return 'B500', main_server.catalog_version.value + 1
+
+    monkeypatch.setattr(main_server.reads, 'run', run)
+    monkeypatch.setattr(main_server.reads, 'fetchall', fetchall)
+    monkeypatch.setattr(main_server.db, 'transaction', transaction)
+    monkeypatch.setattr(main_server.catalog_version, 'value', 7)
+    main_server.search_cache.pop('B500')
+    # Not entered as a context manager, so startup never runs and nothing connects to MySQL
+    client = TestClient(main_server.app)
+    # Pages deeper than the in-memory leaderboard are read from MySQL
+    assert 300 > main_server.leaderboard.depth
+    client.queries = queries
+    return client
+
+
+@pytest.mark.parametrize("path", ["/getall?limit=300", "/search?name=banana"])
+def test_not_modified_without_a_query(client, path):
+    response = client.get(path)
+    assert response.status_code == 200
+    tag = response.headers['etag']
+    assert response.headers['cache-control'].startswith('public')
+    assert len(client.queries) == 1
+
+    response = client.get(path, headers={'If-None-Match': tag})
+    assert response.status_code == 304
+    assert response.headers['etag'] == tag
+    assert response.content == b''
+    assert len(client.queries) == 1
+
+
+def test_tag_follows_query(client):
+    first = client.get("/getall?limit=300").headers['etag']
+    assert client.get("/getall?limit=301").headers['etag'] != first
+    assert client.get("/getall?limit=300").headers['etag'] == first
+
+
+@pytest.mark.parametrize("path", ["/getall?limit=300", "/search?name=banana"])
+def test_tag_changes_after_a_write(client, path):
+    tag = client.get(path).headers['etag']
+    assert client.delete("/remove/1").status_code == 200
+    response = client.get(path, headers={'If-None-Match': tag})
+    assert response.status_code == 200
+    assert response.headers['etag'] != tag
+    assert response.json()['products'][0]['product_id'] == 1
+
+
+def test_view_flush_advances_version(client):
+    tag = client.get("/getall?limit=300").headers['etag']
+
+    class FlushedDatabase:
+        async def run(self, fn, *args, **kwargs):
+            return main_server.catalog_version.value + 1
+
+    async def flush():
+        counter = ViewCounter(FlushedDatabase(), main_server.catalog_version, flush_interval=60)
+        counter.start()
+        counter.record(1)
+        await counter.stop()
+
+    asyncio.new_event_loop().run_until_complete(flush())
+    assert main_server.catalog_version.value == 8
+    assert client.get("/getall?limit=300", headers={'If-None-Match': tag}).status_code == 200
+
+
+def test_untagged_until_version_loaded(client, monkeypatch):
+    monkeypatch.setattr(main_server.catalog_version, 'value', None)
+    response = client.get("/getall?limit=300", headers={'If-None-Match': '*'})
+    assert response.status_code == 200
+    assert 'etag' not in response.headers
@@ -0,0 +1,37 @@
+import pytest
+
+from metrics import Counter, Histogram, _Metric
+
+
+def test_metric_kinds_must_render_samples():
+    class Unrendered(_Metric):
+        kind = 'untyped'
+
+    with pytest.raises(TypeError):
+        Unrendered('test_unrendered', "Never registered")
+
+
+def test_counter_render():
+    counter = Counter('test_requests_total', "Requests", ['route'])
+    counter.inc('/getall')
+    counter.inc('/getall', amount=2)
+    counter.inc('/search "x"')
+    assert counter.render().splitlines() == [
+        '# HELP test_requests_total Requests',
+        '# TYPE test_requests_total counter',
+        'test_requests_total{route="/getall"} 3',
+        'test_requests_total{route="/search \\"x\\""} 1',
+    ]
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram('test_seconds', "Seconds", buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.7, 5.0):
+        histogram.observe(value)
+    assert histogram.samples() == [
+        'test_seconds_bucket{le="0.1"} 1',
+        'test_seconds_bucket{le="1"} 3',
+        'test_seconds_bucket{le="+Inf"} 4',
+        'test_seconds_sum 6.25',
+        'test_seconds_count 4',
+    ]
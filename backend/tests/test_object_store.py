@@ -0,0 +1,47 @@
+import pytest
+
+from object_store import LocalObjectStore, ObjectStore, parse_gcs_path
+
+
+def test_backends_must_implement_every_operation():
+    with pytest.raises(TypeError):
+        ObjectStore()
+
+    class ReadOnly(ObjectStore):
+        def exists(self, bucket, key):
+            return False
+
+        def upload(self, bucket, key, filename):
+            pass
+
+    with pytest.raises(TypeError):
+        ReadOnly()
+
+
+def test_local_round_trip(tmp_path):
+    store = LocalObjectStore(str(tmp_path / 'objects'))
+    source = tmp_path / 'banana.png'
+    source.write_bytes(b'\x89PNG')
+    assert not store.exists('bucket', 'images/banana.png')
+    store.upload('bucket', 'images/banana.png', str(source))
+    assert store.exists_many([('bucket', 'images/banana.png'), ('bucket', 'missing.png')]) == {
+        ('bucket', 'images/banana.png'): True, ('bucket', 'missing.png'): False,
+    }
+    target = tmp_path / 'copy.png'
+    assert store.download('bucket', 'images/banana.png', str(target))
+    assert target.read_bytes() == b'\x89PNG'
+    assert not store.download('bucket', 'missing.png', str(tmp_path / 'none.png'))
+    assert not (tmp_path / 'none.png').exists()
+
+
+def test_local_keys_stay_inside_the_store(tmp_path):
+    store = LocalObjectStore(str(tmp_path / 'objects'))
+    assert not store.exists('bucket', '../../secret')
+    with pytest.raises(ValueError):
+        store.upload('bucket', '../../secret', __file__)
+
+
+def test_parse_gcs_path():
+    assert parse_gcs_path('gs://bucket/a/b.png') == ('bucket', 'a/b.png')
+    assert parse_gcs_path('gs://bucket/') is None
+    assert parse_gcs_path('https://example.com/a.png') is None
@@ -0,0 +1,24 @@
+import pytest
+
+from phonetic import soundex
+
+
+# Outputs of MySQL's SOUNDEX(), which fills the name_soundex column these keys are compared with
+@pytest.mark.parametrize("text, expected", [
+    ("banana", "B500"),
+    ("pepper", "P600"),
+    ("cocoa", "C000"),
+    ("popcorn", "P265"),
+    ("Bob", "B000"),
+    ("Tymczak", "T520"),
+    ("Ashcraft", "A2613"),
+    ("Hello", "H400"),
+    ("Quadratically", "Q36324"),
+])
+def test_matches_mysql(text, expected):
+    assert soundex(text) == expected
+
+
+def test_skips_non_letters():
+    assert soundex("  p-o-p corn 42") == soundex("popcorn")
+    assert soundex("123") == ""
@@ -0,0 +1,199 @@
+import asyncio
+import os
+
+import pytest
+from fastapi import HTTPException
+
+import purchase_log
+from purchase_log import PurchaseLog, _segment_name
+
+
+class FakeDatabase:
+    """Keeps what the loader inserts, by purchase_uid as INSERT IGNORE would"""
+
+    def __init__(self):
+        self.purchases = {}
+
+    async def run(self, fn, records):
+        for record in records:
+            self.purchases.setdefault(record['purchase_uid'], record)
+
+
+async def _append_all(log, count, start=0):
+    return await asyncio.gather(*(log.append(user_id, 1) for user_id in range(start, start + count)))
+
+
+async def _drain(log):
+    while await log._load():
+        pass
+
+
+def _run(coroutine):
+    return asyncio.new_event_loop().run_until_complete(coroutine)
+
+
+def test_loads_acknowledged_purchases(tmp_path):
+    db = FakeDatabase()
+
+    async def scenario():
+        log = PurchaseLog(str(tmp_path), db)
+        log.start()
+        uids = await _append_all(log, 5)
+        await log.stop()
+        return uids
+
+    uids = _run(scenario())
+    assert set(db.purchases) == set(uids)
+
+
+def _crash(log):
+    """Stop the log as a killed process would, without writing out or loading anything more"""
+    for task in (log._writer, log._loader):
+        if task is not None:
+            task.cancel()
+    log._file.close()
+    log._io.shutdown(wait=True)
+
+
+async def _recover_and_drain(directory, db, **options):
+    log = PurchaseLog(directory, db, **options)
+    log._recover()
+    backlog = log._backlog
+    await _drain(log)
+    log._file.close()
+    return backlog
+
+
+def test_replays_from_checkpoint(tmp_path):
+    db = FakeDatabase()
+
+    async def first_run():
+        log = PurchaseLog(str(tmp_path), db, load_batch=3)
+        log.start()
+        log._loader.cancel()
+        log._loader = None
+        uids = await _append_all(log, 7)
+        # One batch reaches MySQL before the process dies
+        assert await log._load()
+        _crash(log)
+        return uids
+
+    uids = _run(first_run())
+    loaded = set(db.purchases)
+    assert len(loaded) == 3
+    db.purchases.clear()
+    assert _run(_recover_and_drain(str(tmp_path), db, load_batch=3)) == 4
+    # Only what followed the checkpoint is loaded again
+    assert set(db.purchases) == set(uids) - loaded
+
+
+def test_truncates_torn_tail(tmp_path):
+    db = FakeDatabase()
+
+    async def first_run():
+        log = PurchaseLog(str(tmp_path), db)
+        log.start()
+        log._loader.cancel()
+        log._loader = None
+        uids = await _append_all(log, 4)
+        _crash(log)
+        return uids
+
+    uids = _run(first_run())
+    segment = os.path.join(str(tmp_path), _segment_name(0))
+    intact = os.path.getsize(segment)
+    with open(segment, 'ab') as f:
+        # Half a record, as left by a crash mid-write
+        f.write(b'\x00\x00\x01\x00\x12\x34')
+    log = PurchaseLog(str(tmp_path), db)
+    log._recover()
+    log._file.close()
+    assert os.path.getsize(segment) == intact
+    assert _run(_recover_and_drain(str(tmp_path), db)) == 4
+    assert set(db.purchases) == set(uids)
+
+
+def test_rolls_segments(tmp_path):
+    db = FakeDatabase()
+
+    async def scenario():
+        log = PurchaseLog(str(tmp_path), db, segment_bytes=256, load_batch=2)
+        log.start()
+        uids = []
+        for start in range(0, 12, 3):
+            uids += await _append_all(log, 3, start)
+        assert log._segment > 1
+        await log.stop()
+        return uids, log._checkpoint
+
+    uids, checkpoint = _run(scenario())
+    assert set(db.purchases) == set(uids)
+    # Segments wholly loaded are removed
+    assert sorted(os.listdir(str(tmp_path))) == ['checkpoint', _segment_name(checkpoint[0])]
+
+
+def test_failed_write_is_cut_off(tmp_path, monkeypatch):
+    db = FakeDatabase()
+    fsync = os.fsync
+    failures = []
+
+    def failing_fsync(fd):
+        if failures:
+            failures.pop()
+            raise OSError(5, "Input/output error")
+        fsync(fd)
+
+    monkeypatch.setattr(purchase_log.os, 'fsync', failing_fsync)
+
+    async def scenario():
+        log = PurchaseLog(str(tmp_path), db)
+        log.start()
+        log._loader.cancel()
+        log._loader = None
+        before = await _append_all(log, 2)
+        failures.append(True)
+        with pytest.raises(HTTPException):
+            await log.append(100, 1)
+        after = await _append_all(log, 2, 200)
+        await log.stop()
+        return before + after
+
+    uids = _run(scenario())
+    # The purchase that was refused is not loaded, and nothing acknowledged after it is lost
+    assert set(db.purchases) == set(uids)
+    assert all(record['user_id'] != 100 for record in db.purchases.values())
+
+
+def test_abandons_segment_that_cannot_be_truncated(tmp_path, monkeypatch):
+    db = FakeDatabase()
+    fsync = os.fsync
+    failures = []
+
+    def failing_fsync(fd):
+        if failures:
+            failures.pop()
+            raise OSError(5, "Input/output error")
+        fsync(fd)
+
+    def failing_truncate(path, length):
+        raise OSError(30, "Read-only file system")
+
+    monkeypatch.setattr(purchase_log.os, 'fsync', failing_fsync)
+    monkeypatch.setattr(purchase_log.os, 'truncate', failing_truncate)
+
+    async def scenario():
+        log = PurchaseLog(str(tmp_path), db)
+        log.start()
+        log._loader.cancel()
+        log._loader = None
+        before = await _append_all(log, 2)
+        failures.append(True)
+        with pytest.raises(HTTPException):
+            await log.append(100, 1)
+        after = await _append_all(log, 2, 200)
+        assert log._segment == 1
+        await log.stop()
+        return before + after
+
+    uids = _run(scenario())
+    assert set(db.purchases) == set(uids)
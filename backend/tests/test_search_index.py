@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+from search_index import TrigramIndex, edit_distances
+
+
+def _reference_distance(a, b):
+    """Optimal string alignment distance, one cell at a time"""
+    d = [[i + j if i == 0 or j == 0 else 0 for j in range(len(b) + 1)] for i in range(len(a) + 1)]
+    for i in range(1, len(a) + 1):
+        for j in range(1, len(b) + 1):
+            d[i][j] = min(d[i - 1][j] + 1, d[i][j - 1] + 1, d[i - 1][j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                d[i][j] = min(d[i][j], d[i - 2][j - 2] + 1)
+    return d[len(a)][len(b)]
+
+
+def _product(product_id, name, view_count=None):
+    return {
+        'product_id': product_id, 'name': name, 'description': '', 'image_src': '', 'price': 1.0,
+        'view_count': view_count,
+    }
+
+
+@pytest.mark.parametrize("query", ["beer", "bere", "b", "", "kitten", "ca"])
+def test_edit_distances_match_reference(query):
+    names = ["beer", "bear", "ebre", "b", "sitting", "kitten", "abc", "ac", "a much longer name"]
+    expected = [_reference_distance(query, name) for name in names]
+    assert edit_distances(query, names).tolist() == expected
+
+
+def test_edit_distances_count_a_transposition_once():
+    assert edit_distances("bere", ["beer"]).tolist() == [1]
+    assert edit_distances("ab", ["ba"]).tolist() == [1]
+
+
+def test_search_ranks_closest_first():
+    index = TrigramIndex()
+    index.build([
+        _product(1, "Banana Bread"),
+        _product(2, "Banana"),
+        _product(3, "Bandana"),
+        _product(4, "Cabbage"),
+    ])
+    assert [row['product_id'] for row in index.search("banana", 3)] == [2, 3, 1]
+    # One transposition away still finds it first
+    assert index.search("bnaana", 1)[0]['product_id'] == 2
+    assert index.search("zzzz") == []
+
+
+def test_search_breaks_ties_by_newest():
+    index = TrigramIndex()
+    index.build([_product(product_id, "Apple") for product_id in (5, 9, 7)])
+    assert [row['product_id'] for row in index.search("apple")] == [9, 7, 5]
+
+
+def test_search_returns_more_than_the_rerank_window():
+    index = TrigramIndex(rerank=5)
+    index.build(_product(product_id, f"Widget {product_id}") for product_id in range(100))
+    assert len(index.search("widget", 50)) == 50
+
+
+def test_compact_keeps_results_and_drops_removed():
+    index = TrigramIndex(compact_threshold=10 ** 9)
+    index.build([_product(1, "Pepper"), _product(2, "Popcorn")])
+    index.add(_product(3, "Pepperoni"))
+    index.remove(1)
+    before = [row['product_id'] for row in index.search("pepper")]
+    postings = len(index._postings) + index._delta_size
+    index.compact()
+    assert [row['product_id'] for row in index.search("pepper")] == before == [3]
+    assert index._delta_size == 0
+    # The removed product's postings are gone, the added one's merged in
+    assert len(index._postings) < postings
+    assert np.all(index._alive[index._postings])
+    assert np.all(np.diff(index._offsets) >= 0)
+
+
+def test_add_replaces_and_record_view_counts():
+    index = TrigramIndex()
+    index.build([_product(1, "Cocoa", view_count=2)])
+    index.record_view(1, 3)
+    assert index.search("cocoa")[0]['view_count'] == 5
+    index.add(_product(1, "Lemon"))
+    assert index.search("cocoa") == []
+    assert len(index) == 1
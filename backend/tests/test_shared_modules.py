@@ -0,0 +1,16 @@
+import os
+
+import pytest
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INITIALIZER = os.path.join(os.path.dirname(BACKEND), 'initializer')
+
+# Modules both images need; each is built from its own directory, so each keeps a copy
+SHARED = ['catalog_snapshot.py', 'object_store.py']
+
+
+@pytest.mark.skipif(not os.path.isdir(INITIALIZER), reason="the initializer is not alongside the backend")
+@pytest.mark.parametrize("name", SHARED)
+def test_copies_are_identical(name):
+    with open(os.path.join(BACKEND, name), 'rb') as ours, open(os.path.join(INITIALIZER, name), 'rb') as theirs:
+        assert ours.read() == theirs.read(), f"backend/{name} and initializer/{name} differ; change both"
@@ -0,0 +1,102 @@
+import importlib.util
+import os
+import sys
+from decimal import Decimal
+
+import pytest
+
+from catalog_snapshot import SnapshotError, SnapshotReader
+
+INITIALIZER = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'initializer')
+
+ROWS = [
+    (1, 'Banana', 'Ripe, yellow', 'gs://bucket/banana.png', Decimal('1.15'), 7),
+    (2, 'Crème brûlée', None, None, Decimal('0.29'), None),
+    (3, '', '', '', Decimal('99999999.99'), 0),
+    (5, 'Pepper', 'Line\none\ttab', 'gs://bucket/pepper.png', 0.57, 2 ** 31 - 1),
+]
+
+
+@pytest.fixture(scope="module")
+def exporter():
+    if not os.path.isdir(INITIALIZER):
+        pytest.skip("the initializer is not alongside the backend")
+    # Its seed module is found on the initializer's path, after the backend's own modules
+    sys.path.append(INITIALIZER)
+    try:
+        spec = importlib.util.spec_from_file_location('initializer_snapshot', os.path.join(INITIALIZER, 'snapshot.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        yield module
+    finally:
+        sys.path.remove(INITIALIZER)
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = list(rows)
+        self.statements = []
+
+    def execute(self, sql, params=()):
+        self.statements.append((sql, params))
+
+    def executemany(self, sql, rows):
+        self.statements.append((sql, list(rows)))
+
+    def fetchmany(self, size):
+        batch, self.rows = self.rows[:size], self.rows[size:]
+        return batch
+
+    def fetchall(self):
+        # SELECT EXISTS(...) over empty tables
+        return [(0,)]
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, rows=()):
+        self._cursor = FakeCursor(rows)
+
+    def cursor(self):
+        return self._cursor
+
+    def start_transaction(self, **options):
+        pass
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+def _expected(row):
+    return row[:4] + (Decimal(str(row[4])).quantize(Decimal('0.01')),) + row[5:]
+
+
+def test_export_import_round_trip(exporter, tmp_path):
+    path = str(tmp_path / 'catalog.snap')
+    assert exporter.export_snapshot(FakeConnection(ROWS), path, group_rows=3) == len(ROWS)
+
+    with SnapshotReader(path) as snapshot:
+        assert snapshot.rows == len(ROWS)
+        assert len(snapshot.groups) == 2
+        rows = [row for group in snapshot.row_groups() for row in group]
+        assert rows == [_expected(row) for row in ROWS]
+        assert [list(ids) for ids in snapshot.product_ids()] == [[1, 2, 3], [5]]
+
+    connection = FakeConnection()
+    assert exporter.import_snapshot(connection, path) == len(ROWS)
+    written = {sql.split()[3]: rows for sql, rows in connection._cursor.statements if sql.startswith('INSERT')}
+    assert written['product'] == [_expected(row)[:5] for row in ROWS]
+    # Products without a view row get none back
+    assert written['view'] == [(1, 7), (3, 0), (5, 2 ** 31 - 1)]
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / 'not.snap'
+    path.write_bytes(b'CATSNAP1' + b'\0' * 32)
+    with pytest.raises(SnapshotError):
+        SnapshotReader(str(path))
@@ -0,0 +1,151 @@
+"""Write-behind view counting for /analytics/view.
+
+Views are coalesced per product_id in memory and written with one multi-row
+upsert per flush, so N views of a product cost one row write per flush
+interval instead of N commits. The same flush adds them to the per-minute
+view_minute buckets that view_rollups aggregates for trending, and advances
+the catalog version the /getall and /search ETags are derived from.
+"""
+import asyncio
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from catalog_version import CatalogVersion, bump_catalog_version
+from database import Database
+
+
+class ViewCounter:
+    """Aggregates view increments and flushes them on a time or size threshold"""
+
+    def __init__(
+        self, db: Database, catalog_version: Optional[CatalogVersion] = None, flush_interval: float = 1.0,
+        max_pending: int = 1000,
+    ):
+        self.db = db
+        self.catalog_version = catalog_version
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending: Dict[int, int] = {}
+        self._pending_views = 0
+        # Views per (minute start as a Unix time, product_id)
+        self._minutes: Dict[Tuple[int, int], int] = {}
+        self._wake: Optional[asyncio.Event] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """Start the background flusher; must be called from the running event loop"""
+        self._wake = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        """Stop the flusher and write out everything still pending"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def record(self, product_id: int, views: int = 1) -> None:
+        self._pending[product_id] = self._pending.get(product_id, 0) + views
+        self._pending_views += views
+        minute = (int(time.time()) // 60 * 60, product_id)
+        self._minutes[minute] = self._minutes.get(minute, 0) + views
+        if len(self._pending) >= self.max_pending and self._wake is not None:
+            self._wake.set()
+
+    def discard(self, product_id: int) -> None:
+        """Drop pending views for a product that is being removed"""
+        self._pending_views -= self._pending.pop(product_id, 0)
+        for minute in [minute for minute in self._minutes if minute[1] == product_id]:
+            del self._minutes[minute]
+
+    def pending(self) -> Dict[int, int]:
+        """A copy of the views recorded but not yet flushed, per product_id"""
+        return dict(self._pending)
+
+    def backlog(self) -> Dict[str, int]:
+        return {"products": len(self._pending), "views": self._pending_views}
+
+    async def flush(self) -> int:
+        """Write all pending views in one statement and return how many were written"""
+        async with self._lock:
+            if not self._pending:
+                return 0
+            batch = list(self._pending.items())
+            minutes = list(self._minutes.items())
+            views = self._pending_views
+            self._pending = {}
+            self._pending_views = 0
+            self._minutes = {}
+            try:
+                version = await self.db.run(_upsert_views, batch, minutes)
+            except Exception:
+                # Put the batch back so the next flush retries it
+                for product_id, count in batch:
+                    self._pending[product_id] = self._pending.get(product_id, 0) + count
+                    self._pending_views += count
+                for minute, count in minutes:
+                    self._minutes[minute] = self._minutes.get(minute, 0) + count
+                raise
+            if self.catalog_version is not None:
+                self.catalog_version.advance(version)
+            print(f"views flushed - {len(batch)} products, {views} views")
+            return views
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Error flushing views: {e}")
+
+
+def _upsert_views(cnx, batch: List[Tuple[int, int]], minutes: List[Tuple[Tuple[int, int], int]]) -> int:
+    # Joining against product drops views for products removed since they were
+    # recorded instead of failing the whole batch on the foreign key
+    rows = " UNION ALL ".join(["SELECT %s AS product_id, %s AS views"] * len(batch))
+    params = [value for row in batch for value in row]
+    buckets = " UNION ALL ".join(["SELECT %s AS bucket, %s AS product_id, %s AS views"] * len(minutes))
+    bucket_params = [
+        value
+        for (minute, product_id), views in minutes
+        for value in (datetime.utcfromtimestamp(minute), product_id, views)
+    ]
+    # One transaction, so a failed flush can be retried without counting anything twice
+    cnx.start_transaction()
+    cursor = cnx.cursor()
+    try:
+        cursor.execute(f"""
+            INSERT INTO view (product_id, view_count)
+            SELECT p.product_id, batch.views
+            FROM ({rows}) AS batch
+            JOIN product p ON p.product_id = batch.product_id
+            ON DUPLICATE KEY UPDATE view_count = view_count + batch.views
+        """, params)
+        # Buckets hold UTC minute starts
+        cursor.execute(f"""
+            INSERT INTO view_minute (bucket, product_id, views)
+            SELECT batch.bucket, p.product_id, batch.views
+            FROM ({buckets}) AS batch
+            JOIN product p ON p.product_id = batch.product_id
+            ON DUPLICATE KEY UPDATE views = view_minute.views + batch.views
+        """, bucket_params)
+        version = bump_catalog_version(cursor)
+        cnx.commit()
+        return version
+    except BaseException:
+        cnx.rollback()
+        raise
+    finally:
+        cursor.close()
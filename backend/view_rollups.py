@@ -0,0 +1,175 @@
+"""Hourly and daily view rollups, and the trending and time-series reads over them.
+
+ViewCounter adds views to per-minute buckets (view_minute). In the
+background, the current and previous hour are recomputed into view_hour
+from their minutes, and the current and previous day into view_day from
+their hours. Each table is pruned to its own retention. Reads pick the
+coarsest table that still resolves the window. Their cost depends on the
+window and the products viewed in it, not on how many views were ever
+recorded.
+"""
+import asyncio
+import re
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from database import Database
+
+# Bucket width in seconds of each table, finest first
+GRANULARITIES = {'minute': 60, 'hour': 3600, 'day': 86400}
+UNITS = {'m': 60, 'h': 3600, 'd': 86400}
+
+# Reads use the finest table with at most this many buckets in the window
+MAX_BUCKETS = 360
+
+# Rows deleted per statement when pruning, so no delete holds locks for long
+PRUNE_BATCH = 10000
+
+
+def parse_window(text: str) -> int:
+    """Seconds in a window such as 15m, 1h or 7d"""
+    match = re.fullmatch(r'(\d+)([mhd])', text.strip())
+    if match is None or int(match.group(1)) == 0:
+        raise ValueError(f"Invalid window {text}, expected a number followed by m, h or d")
+    return int(match.group(1)) * UNITS[match.group(2)]
+
+
+def _bucket_start(timestamp: float, width: int) -> datetime:
+    return datetime.utcfromtimestamp(int(timestamp) // width * width)
+
+
+class ViewRollups:
+    """Maintains view_hour and view_day from view_minute and answers windowed view queries"""
+
+    def __init__(self, db: Database, reader: Any, retention: Dict[str, int], interval: float = 60.0):
+        self.db = db
+        # Anything with fetchall(), e.g. a ReplicaSet; rollups themselves always write to db
+        self.reader = reader
+        # The previous hour and day are recomputed from the finer table, which must still hold them
+        self.retention = {
+            'minute': max(retention['minute'], 2 * GRANULARITIES['hour']),
+            'hour': max(retention['hour'], 2 * GRANULARITIES['day']),
+            'day': retention['day'],
+        }
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """Start the background rollup; must be called from the running event loop"""
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def roll_up(self) -> None:
+        """Recompute the current and previous hour and day, then prune expired buckets"""
+        now = time.time()
+        for target, source in (('hour', 'minute'), ('day', 'hour')):
+            width = GRANULARITIES[target]
+            for start in (now - width, now):
+                bucket = _bucket_start(start, width)
+                await self.db.run(_roll_up, source, target, bucket, width, name=f"roll_up_{target}")
+        for granularity, retention in self.retention.items():
+            cutoff = _bucket_start(now - retention, GRANULARITIES[granularity])
+            while await self.db.run(_prune, granularity, cutoff, name=f"prune_{granularity}") == PRUNE_BATCH:
+                pass
+
+    def granularity_for(self, window: int) -> str:
+        """The finest table resolving window in at most MAX_BUCKETS buckets, within its retention"""
+        for granularity, width in GRANULARITIES.items():
+            if window // width <= MAX_BUCKETS and window <= self.retention[granularity]:
+                return granularity
+        if window <= self.retention['day']:
+            return 'day'
+        raise HTTPException(status_code=400, detail=f"Window exceeds the {self.retention['day'] // 86400}d retention")
+
+    def _since(self, window: int, granularity: str) -> datetime:
+        # Whole buckets, so the oldest one may reach up to one bucket further back than the window
+        return _bucket_start(time.time() - window, GRANULARITIES[granularity])
+
+    async def trending(self, window: int, limit: int) -> Tuple[str, datetime, List[Dict[str, Any]]]:
+        """The most viewed products over the last window seconds"""
+        granularity = self.granularity_for(window)
+        since = self._since(window, granularity)
+        rows = await self.reader.fetchall(f"""
+            SELECT p.product_id, p.name, p.image_src, p.price, t.views
+            FROM (
+                SELECT product_id, SUM(views) AS views
+                FROM view_{granularity}
+                WHERE bucket >= %s
+                GROUP BY product_id
+                ORDER BY views DESC, product_id DESC
+                LIMIT %s
+            ) AS t
+            JOIN product p ON p.product_id = t.product_id
+            ORDER BY t.views DESC, p.product_id DESC
+        """, (since, limit), name=f"trending_{granularity}")
+        for row in rows:
+            row['views'] = int(row['views'])
+        return granularity, since, rows
+
+    async def series(
+        self, product_id: int, window: int, granularity: Optional[str] = None
+    ) -> Tuple[str, datetime, List[Dict[str, Any]]]:
+        """One product's views per bucket over the last window seconds, empty buckets omitted"""
+        if granularity is None:
+            granularity = self.granularity_for(window)
+        elif granularity not in GRANULARITIES:
+            raise HTTPException(status_code=400, detail=f"granularity must be one of {', '.join(GRANULARITIES)}")
+        elif window > self.retention[granularity]:
+            raise HTTPException(status_code=400, detail=f"Window exceeds the {granularity} bucket retention")
+        elif window // GRANULARITIES[granularity] > 4 * MAX_BUCKETS:
+            raise HTTPException(status_code=400, detail=f"Window has too many {granularity} buckets")
+        since = self._since(window, granularity)
+        rows = await self.reader.fetchall(f"""
+            SELECT bucket, views
+            FROM view_{granularity}
+            WHERE product_id = %s AND bucket >= %s
+            ORDER BY bucket
+        """, (product_id, since), name=f"view_series_{granularity}")
+        return granularity, since, rows
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.roll_up()
+            except Exception as e:
+                print(f"Error rolling up views: {e}")
+
+
+def _roll_up(cnx, source: str, target: str, bucket: datetime, width: int) -> None:
+    # Recomputed in full from the finer buckets, so running it again is harmless
+    cursor = cnx.cursor()
+    try:
+        cursor.execute(f"""
+            INSERT INTO view_{target} (bucket, product_id, views)
+            SELECT %s, rolled.product_id, rolled.views
+            FROM (
+                SELECT product_id, SUM(views) AS views
+                FROM view_{source}
+                WHERE bucket >= %s AND bucket < %s + INTERVAL %s SECOND
+                GROUP BY product_id
+            ) AS rolled
+            ON DUPLICATE KEY UPDATE views = rolled.views
+        """, (bucket, bucket, bucket, width))
+    finally:
+        cursor.close()
+
+
+def _prune(cnx, granularity: str, cutoff: datetime) -> int:
+    cursor = cnx.cursor()
+    try:
+        cursor.execute(f"DELETE FROM view_{granularity} WHERE bucket < %s LIMIT {PRUNE_BATCH}", (cutoff,))
+        return cursor.rowcount
+    finally:
+        cursor.close()
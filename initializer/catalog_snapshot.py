@@ -0,0 +1,136 @@
+"""Columnar catalog snapshots: the format, and reading it.
+
+A snapshot holds the product and view tables joined into one file, written
+in row groups. Each group stores every column as a contiguous little-endian
+array aligned to 8 bytes, so a reader can mmap the file and take the columns
+it needs without parsing the rest:
+
+    b'CATSNAP1'
+    row group 0: one block per column, then one per nullable column's null flags
+    row group 1: ...
+    footer: JSON with the row count and each group's block offsets and lengths
+    footer length (8 bytes, little-endian) and b'CATSNAP1' again
+
+product_id is int32 and price int64 cents. view_count is int64, with a null
+flag for products that have no view row. Strings are int64 end offsets into
+UTF-8 bytes. Reading product IDs touches only that column's pages, and any
+row group can be decoded on its own.
+
+The initializer writes snapshots (SNAPSHOT_EXPORT) and the backend warms from
+them at startup. Their images are built from separate directories, so this
+file is kept byte for byte the same in backend/ and initializer/;
+backend/tests/test_shared_modules.py fails when the copies differ.
+"""
+import json
+import mmap
+import sys
+from array import array
+from decimal import Decimal
+from typing import Any, Dict, Iterator, List, Tuple
+
+MAGIC = b'CATSNAP1'
+VERSION = 1
+_LENGTH_BYTES = 8
+
+# (name, kind, nullable), in the order of the export query's columns and the backend's PRODUCT_FIELDS
+COLUMNS = (
+    ('product_id', 'int32', False),
+    ('name', 'str', False),
+    ('description', 'str', True),
+    ('image_src', 'str', True),
+    ('price', 'cents', False),
+    ('view_count', 'int64', True),
+)
+_TYPECODES = {'int32': 'i', 'int64': 'q', 'cents': 'q'}
+
+
+class SnapshotError(Exception):
+    pass
+
+
+class SnapshotReader:
+    """A memory-mapped snapshot, read column by column or row group by row group"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._footer = self._read_footer()
+        except Exception:
+            self._map.close()
+            raise
+        self.rows: int = self._footer['rows']
+        self.groups: List[Dict[str, Any]] = self._footer['groups']
+
+    def _read_footer(self) -> Dict[str, Any]:
+        size = len(self._map)
+        tail = len(MAGIC) + _LENGTH_BYTES
+        if size < len(MAGIC) + tail or self._map[:len(MAGIC)] != MAGIC or self._map[size - len(MAGIC):] != MAGIC:
+            raise SnapshotError(f"{self.path} is not a catalog snapshot")
+        length = int.from_bytes(self._map[size - tail:size - len(MAGIC)], 'little')
+        footer = json.loads(self._map[size - tail - length:size - tail])
+        if footer.get('version') != VERSION:
+            raise SnapshotError(f"{self.path} has snapshot version {footer.get('version')}, expected {VERSION}")
+        if [tuple(column) for column in footer['columns']] != list(COLUMNS):
+            raise SnapshotError(f"{self.path} has columns {footer['columns']}, expected {list(COLUMNS)}")
+        return footer
+
+    def __enter__(self) -> "SnapshotReader":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._map.close()
+
+    def _array(self, typecode: str, offset: int, length: int) -> array:
+        values = array(typecode)
+        values.frombytes(self._map[offset:offset + length])
+        if sys.byteorder == 'big':
+            values.byteswap()
+        return values
+
+    def _numbers(self, group: Dict[str, Any], name: str, typecode: str) -> array:
+        offset, length = group['blocks'][name]
+        return self._array(typecode, offset, length)
+
+    def _nulls(self, group: Dict[str, Any], name: str) -> bytes:
+        offset, length = group['nulls'][name]
+        return self._map[offset:offset + length]
+
+    def column(self, group: Dict[str, Any], name: str) -> List[Any]:
+        """One column of a row group as Python values, None where null"""
+        kind, nullable = next((kind, nullable) for column, kind, nullable in COLUMNS if column == name)
+        count = group['rows']
+        if kind == 'str':
+            offset, length = group['blocks'][name]
+            ends = self._array('q', offset, 8 * count)
+            data = self._map[offset + 8 * count:offset + length]
+            values: List[Any] = []
+            start = 0
+            for end in ends:
+                values.append(data[start:end].decode('utf-8'))
+                start = end
+        else:
+            values = list(self._numbers(group, name, _TYPECODES[kind]))
+            if kind == 'cents':
+                values = [Decimal(value) / 100 for value in values]
+        if nullable:
+            values = [None if null else value for value, null in zip(values, self._nulls(group, name))]
+        return values
+
+    def product_ids(self) -> Iterator[array]:
+        """The product_id column, one array per row group"""
+        for group in self.groups:
+            yield self._numbers(group, 'product_id', 'i')
+
+    def group_rows(self, group: Dict[str, Any]) -> List[Tuple]:
+        """The rows of one row group, as tuples in COLUMNS order"""
+        return list(zip(*(self.column(group, name) for name, _, _ in COLUMNS)))
+
+    def row_groups(self) -> Iterator[List[Tuple]]:
+        """Every row, one list per row group"""
+        for group in self.groups:
+            yield self.group_rows(group)
@@ -1,6 +1,10 @@
 import mysql.connector
 from mysql.connector import Error
-from google.cloud import storage
+from object_store import object_store_from_env, parse_gcs_path
+from migrations import migrate
+from seed import seed_catalog
+from catalog_snapshot import SnapshotError
+from snapshot import export_snapshot, import_snapshot
 import requests
 import random
 import uuid
@@ -24,14 +28,45 @@ def requireenv(name: str) -> str:
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Object storage the sample image is uploaded to: 'gcs' or 'local' (files under OBJECT_STORE_DIR)
+try:
+    object_store = object_store_from_env()
+except ValueError as e:
+    logger.error(f"Error: {e}")
+    sys.exit(1)
+
 # Configuration from environment variables
 GCS_CONFIG = {
-    'project': requireenv('GOOGLE_CLOUD_PROJECT'),
+    'project': requireenv('GOOGLE_CLOUD_PROJECT') if object_store.name == 'gcs' else None,
 }
 
 MAIN_SERVER_URL = requireenv('BACKEND_URL')
 IMAGE_SRC = requireenv('IMAGE_SRC')
 
+# 'single' posts each product to /add, 'bulk' sends them all in one /add/batch request
+ADD_MODE = os.getenv('ADD_MODE', 'single')
+
+# Synthetic catalog written straight to MySQL after migrating; SEED_PRODUCTS=0 skips it.
+# 'insert' uses multi-row INSERTs, 'infile' LOAD DATA LOCAL INFILE (needs local_infile on the server)
+SEED_CONFIG = {
+    'products': int(os.getenv('SEED_PRODUCTS', '0')),
+    'seed': int(os.getenv('SEED', '42')),
+    'start_id': int(os.getenv('SEED_START_ID', '1000000')),
+    'method': os.getenv('SEED_METHOD', 'insert'),
+    'batch_size': int(os.getenv('SEED_BATCH_SIZE', '10000')),
+}
+if SEED_CONFIG['method'] not in ('insert', 'infile'):
+    logger.error(f"Error: SEED_METHOD must be 'insert' or 'infile', got {SEED_CONFIG['method']}")
+    sys.exit(1)
+
+# Catalog snapshots: a file to bulk-import after migrating and seeding, and one to export the
+# product + view catalog to afterwards (before the sample products are added); unset skips either
+SNAPSHOT_CONFIG = {
+    'import': os.getenv('SNAPSHOT_IMPORT'),
+    'export': os.getenv('SNAPSHOT_EXPORT'),
+    'group_rows': int(os.getenv('SNAPSHOT_GROUP_ROWS', '65536')),
+}
+
 # Database configuration from environment variables
 DB_CONFIG = {
     'host': requireenv('DB_HOST'),
@@ -41,15 +76,12 @@ DB_CONFIG = {
     'database': requireenv('DB_NAME')
 }
 
-# Initialize GCS client
-storage_client = storage.Client()
-
 @retry(stop=stop_after_attempt(10), wait=wait_exponential(multiplier=1, min=4, max=10))
-def get_db_connection():
+def get_db_connection(**options):
     """Get a database connection with retry mechanism"""
     try:
         logger.info(f"Attempting to connect to MySQL at {DB_CONFIG['host']}:{DB_CONFIG['port']}")
-        connection = mysql.connector.connect(**DB_CONFIG)
+        connection = mysql.connector.connect(**DB_CONFIG, **options)
         if connection.is_connected():
             logger.info("Successfully connected to MySQL")
             return connection
@@ -59,78 +91,83 @@ def get_db_connection():
 
 def initialize_database():
     connection = None
-    cursor = None
     try:
         # Connect to MySQL server using environment variables
         connection = get_db_connection()
-        cursor = connection.cursor()
 
         if connection.is_connected():
-            # Create user table
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS user (
-                    user_id INT AUTO_INCREMENT PRIMARY KEY,
-                    name VARCHAR(255) NOT NULL,
-                    email VARCHAR(255) NOT NULL UNIQUE,
-                    password VARCHAR(255) NOT NULL,
-                    last_login TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
-                )
-            """)
-
-            # Create product table
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS product (
-                    product_id INT AUTO_INCREMENT PRIMARY KEY,
-                    name VARCHAR(255) NOT NULL,
-                    description TEXT,
-                    image_src VARCHAR(255),
-                    price DECIMAL(10,2) NOT NULL
-                )
-            """)
-
-            # Create view table
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS view (
-                    view_id INT AUTO_INCREMENT PRIMARY KEY,
-                    product_id INT,
-                    view_count INT DEFAULT 0,
-                    FOREIGN KEY (product_id) REFERENCES product(product_id)
-                )
-            """)
-
-            connection.commit()
+            # Creates the tables on a fresh database and brings older ones up to date
+            migrate(connection)
             logger.info("Database tables created successfully!")
 
     except Error as e:
         logger.error(f"Error while connecting to MySQL: {e}")
     finally:
         if connection and connection.is_connected():
-            cursor.close()
             connection.close()
             logger.info("MySQL connection is closed")
 
+def seed_database():
+    """Write the synthetic catalog configured by SEED_CONFIG, if any"""
+    if SEED_CONFIG['products'] <= 0:
+        return
+    connection = None
+    try:
+        connection = get_db_connection(allow_local_infile=SEED_CONFIG['method'] == 'infile')
+        seed_catalog(
+            connection, SEED_CONFIG['products'], SEED_CONFIG['seed'], SEED_CONFIG['start_id'], IMAGE_SRC,
+            method=SEED_CONFIG['method'], batch_size=SEED_CONFIG['batch_size'],
+        )
+    except Error as e:
+        logger.error(f"Error while seeding the catalog: {e}")
+    finally:
+        if connection and connection.is_connected():
+            connection.close()
+
+def restore_snapshot():
+    """Bulk-import the snapshot named by SNAPSHOT_IMPORT, if any"""
+    if not SNAPSHOT_CONFIG['import']:
+        return
+    connection = None
+    try:
+        connection = get_db_connection(allow_local_infile=SEED_CONFIG['method'] == 'infile')
+        import_snapshot(
+            connection, SNAPSHOT_CONFIG['import'], method=SEED_CONFIG['method'], batch_size=SEED_CONFIG['batch_size']
+        )
+    except (Error, OSError, SnapshotError) as e:
+        logger.error(f"Error while importing the catalog snapshot: {e}")
+    finally:
+        if connection and connection.is_connected():
+            connection.close()
+
+def save_snapshot():
+    """Export the catalog to the snapshot named by SNAPSHOT_EXPORT, if any"""
+    if not SNAPSHOT_CONFIG['export']:
+        return
+    connection = None
+    try:
+        connection = get_db_connection()
+        export_snapshot(connection, SNAPSHOT_CONFIG['export'], SNAPSHOT_CONFIG['group_rows'])
+    except (Error, OSError) as e:
+        logger.error(f"Error while exporting the catalog snapshot: {e}")
+    finally:
+        if connection and connection.is_connected():
+            connection.close()
+
 @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
 def upload_to_gcs():
-    """Upload sample.png to Google Cloud Storage"""
+    """Upload sample.png to the configured object store"""
     try:
-        # Extract the blob name from the full GCS path
-        if not IMAGE_SRC.startswith('gs://'):
-            raise ValueError("IMAGE_SRC must start with 'gs://'")
-        
-        path_parts = IMAGE_SRC[5:].split('/', 1)  # Remove 'gs://' and split into bucket and blob
-        if len(path_parts) != 2:
-            raise ValueError(f"Invalid GCS path format {path_parts}")
+        # Extract the bucket and blob name from the full GCS path
+        ref = parse_gcs_path(IMAGE_SRC)
+        if ref is None:
+            raise ValueError(f"IMAGE_SRC must be of the form gs://bucket/key, got {IMAGE_SRC}")
         
-        bucket_name, blob_name = path_parts
-        bucket = storage_client.bucket(bucket_name)
+        bucket_name, blob_name = ref
 
         # Upload the file
-        logger.info(f"Uploading to {IMAGE_SRC}")
-        blob = bucket.blob(blob_name)
-        blob.upload_from_filename('sample.png')  # Use the local file name
-        
-        # Make the blob publicly accessible
-        blob.make_public()
+        logger.info(f"Uploading to {IMAGE_SRC} ({object_store.name})")
+        object_store.upload(bucket_name, blob_name, 'sample.png')  # Use the local file name
         
         logger.info(f"Successfully uploaded to {IMAGE_SRC}")
     except Exception as e:
@@ -198,28 +235,54 @@ def add_products():
         }
     ]
     
-    added_ids = []
-    for product in products:
-        product_id = random.randint(1000, 9999)
-        payload = {
+    # Distinct IDs, so no product overwrites another from the same run
+    product_ids = random.sample(range(1000, 10000), len(products))
+    payloads = [
+        {
             "product_id": product_id,
             "name": product["name"],
             "description": product["description"],
             "image_src": IMAGE_SRC,
             "price": product["price"]
         }
-        
+        for product, product_id in zip(products, product_ids)
+    ]
+    if ADD_MODE == 'bulk':
+        return add_products_bulk(payloads)
+    
+    added_ids = []
+    for payload in payloads:
         try:
             response = requests.post(f"{MAIN_SERVER_URL}/add", json=payload)
             response.raise_for_status()
-            logger.info(f"Added product: {product['name']} with ID {product_id}")
-            added_ids.append(product_id)
+            logger.info(f"Added product: {payload['name']} with ID {payload['product_id']}")
+            added_ids.append(payload["product_id"])
         except requests.exceptions.RequestException as e:
-            logger.error(f"Failed to add product {product['name']}: {e}")
+            logger.error(f"Failed to add product {payload['name']}: {e}")
             raise
     
     return added_ids
 
+def add_products_bulk(payloads: List[Dict]) -> List[int]:
+    """Add all products in a single /add/batch request and log per-item failures"""
+    try:
+        response = requests.post(f"{MAIN_SERVER_URL}/add/batch", json=payloads)
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Failed to add products in bulk: {e}")
+        raise
+    
+    summary = response.json()
+    added_ids = []
+    for result, payload in zip(summary["results"], payloads):
+        if result["status"] == "ok":
+            logger.info(f"Added product: {payload['name']} with ID {payload['product_id']}")
+            added_ids.append(payload["product_id"])
+        else:
+            logger.error(f"Failed to add product {payload['name']}: {result['detail']}")
+    logger.info(f"Bulk add finished: {summary['added']} added, {summary['failed']} failed")
+    return added_ids
+
 def remove_products(product_ids: List[int], count: int = 2):
     """Remove specified number of products"""
     removed_ids = random.sample(product_ids, min(count, len(product_ids)))
@@ -282,5 +345,8 @@ def main():
 if __name__ == "__main__":
     logger.info("Starting Initialize Database")
     initialize_database()
+    restore_snapshot()
+    seed_database()
+    save_snapshot()
     main()
     logger.info("Initialize Database Done")
@@ -0,0 +1,215 @@
+"""Versioned schema migrations for the retail database.
+
+Each migration has a version, a name and a function applying it over a
+cursor. Applied versions are recorded in schema_migrations, and every
+migration checks the live schema before changing it. A migration that died
+half way (MySQL DDL commits implicitly), or a database created before
+versions were tracked, is therefore brought up to date by re-running it.
+"""
+import logging
+from typing import Callable, List, NamedTuple, Set
+
+logger = logging.getLogger(__name__)
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    apply: Callable
+
+
+def index_exists(cursor, table: str, index: str) -> bool:
+    """Check whether an index exists on a table in the current database"""
+    cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+    """, (table, index))
+    return cursor.fetchone()[0] > 0
+
+
+def column_exists(cursor, table: str, column: str) -> bool:
+    """Check whether a column exists on a table in the current database"""
+    cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+    """, (table, column))
+    return cursor.fetchone()[0] > 0
+
+
+def constraint_exists(cursor, table: str, constraint: str) -> bool:
+    """Check whether a named constraint exists on a table in the current database"""
+    cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.table_constraints
+        WHERE table_schema = DATABASE() AND table_name = %s AND constraint_name = %s
+    """, (table, constraint))
+    return cursor.fetchone()[0] > 0
+
+
+def create_base_tables(cursor):
+    """The user, product and view tables as the first release created them"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user (
+            user_id INT AUTO_INCREMENT PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            email VARCHAR(255) NOT NULL UNIQUE,
+            password VARCHAR(255) NOT NULL,
+            last_login TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS product (
+            product_id INT AUTO_INCREMENT PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            description TEXT,
+            image_src VARCHAR(255),
+            price DECIMAL(10,2) NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS view (
+            view_id INT AUTO_INCREMENT PRIMARY KEY,
+            product_id INT,
+            view_count INT DEFAULT 0,
+            FOREIGN KEY (product_id) REFERENCES product(product_id)
+        )
+    """)
+
+
+def add_product_soundex(cursor):
+    """Add the persisted SOUNDEX key /search filters on, computing it for every existing row"""
+    if column_exists(cursor, 'product', 'name_soundex'):
+        return
+    # A STORED generated column is materialized for all existing rows by the
+    # table rebuild and kept in sync by MySQL on every insert and update
+    cursor.execute("""
+        ALTER TABLE product
+            ADD COLUMN name_soundex VARCHAR(255) AS (SOUNDEX(name)) STORED,
+            ADD INDEX idx_product_name_soundex (name_soundex, product_id DESC)
+    """)
+
+
+def add_view_unique_key(cursor):
+    """Merge duplicate view rows per product, then add the unique key the view upsert relies on"""
+    if index_exists(cursor, 'view', 'uq_view_product_id'):
+        return
+    cursor.execute("""
+        UPDATE view v
+        JOIN (
+            SELECT MIN(view_id) AS keep_id, SUM(view_count) AS total
+            FROM view
+            GROUP BY product_id
+            HAVING COUNT(*) > 1
+        ) d ON v.view_id = d.keep_id
+        SET v.view_count = d.total
+    """)
+    cursor.execute("""
+        DELETE v FROM view v
+        JOIN (
+            SELECT product_id, MIN(view_id) AS keep_id
+            FROM view
+            GROUP BY product_id
+            HAVING COUNT(*) > 1
+        ) d ON v.product_id = d.product_id AND v.view_id <> d.keep_id
+    """)
+    cursor.execute("ALTER TABLE view ADD UNIQUE KEY uq_view_product_id (product_id)")
+
+
+def add_view_ranking_index(cursor):
+    """Keyset pages of /getall seek on (view_count, product_id)"""
+    if not index_exists(cursor, 'view', 'idx_view_count_product'):
+        cursor.execute("ALTER TABLE view ADD INDEX idx_view_count_product (view_count DESC, product_id DESC)")
+
+
+def create_purchase_table(cursor):
+    """Purchases, loaded in bulk from the backend's purchase log"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS purchase (
+            purchase_id INT AUTO_INCREMENT PRIMARY KEY,
+            purchase_uid CHAR(32) NOT NULL,
+            user_id INT NOT NULL,
+            product_id INT NOT NULL,
+            purchased_at DATETIME(6) NOT NULL,
+            UNIQUE KEY uq_purchase_uid (purchase_uid),
+            INDEX idx_purchase_product (product_id),
+            INDEX idx_purchase_user (user_id)
+        )
+    """)
+
+
+def add_product_price_check(cursor):
+    """Enforce in the schema the positive price the backend already validates"""
+    if not constraint_exists(cursor, 'product', 'chk_product_price_positive'):
+        cursor.execute("ALTER TABLE product ADD CONSTRAINT chk_product_price_positive CHECK (price > 0)")
+
+
+def create_view_buckets(cursor):
+    """Per-minute view counts written by the backend, and the hourly and daily rollups built from them"""
+    for granularity in ('minute', 'hour', 'day'):
+        # Trending scans a bucket range, a product's time series its own buckets
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS view_{granularity} (
+                bucket DATETIME NOT NULL,
+                product_id INT NOT NULL,
+                views INT NOT NULL,
+                PRIMARY KEY (bucket, product_id),
+                INDEX idx_view_{granularity}_product (product_id, bucket)
+            )
+        """)
+
+
+def create_catalog_version(cursor):
+    """The counter catalog writes advance and the backend derives /getall and /search ETags from"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS catalog_version (
+            id TINYINT PRIMARY KEY,
+            version BIGINT UNSIGNED NOT NULL
+        )
+    """)
+    cursor.execute("INSERT IGNORE INTO catalog_version (id, version) VALUES (1, 0)")
+
+
+# Append new migrations at the end with the next version; never renumber or edit applied ones
+MIGRATIONS: List[Migration] = [
+    Migration(1, "create base tables", create_base_tables),
+    Migration(2, "product name soundex", add_product_soundex),
+    Migration(3, "view unique product", add_view_unique_key),
+    Migration(4, "view ranking index", add_view_ranking_index),
+    Migration(5, "purchase table", create_purchase_table),
+    Migration(6, "product price check", add_product_price_check),
+    Migration(7, "view buckets", create_view_buckets),
+    Migration(8, "catalog version", create_catalog_version),
+]
+
+
+def applied_versions(cursor) -> Set[int]:
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("SELECT version FROM schema_migrations")
+    return {version for (version,) in cursor.fetchall()}
+
+
+def migrate(connection) -> List[int]:
+    """Apply every migration not yet recorded, in version order; returns the versions applied"""
+    cursor = connection.cursor()
+    try:
+        done = applied_versions(cursor)
+        applied = []
+        for migration in sorted(MIGRATIONS, key=lambda m: m.version):
+            if migration.version in done:
+                continue
+            logger.info(f"Applying migration {migration.version}: {migration.name}")
+            migration.apply(cursor)
+            cursor.execute(
+                "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (migration.version, migration.name)
+            )
+            connection.commit()
+            applied.append(migration.version)
+        logger.info(f"Schema at version {max(m.version for m in MIGRATIONS)}, applied {len(applied)} migrations")
+        return applied
+    finally:
+        cursor.close()
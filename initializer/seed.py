@@ -0,0 +1,172 @@
+"""Deterministic synthetic catalog for reproducing production-scale query plans.
+
+generate_catalog() yields products and their view counts from a random seed,
+so the same seed always produces the same catalog. Word popularity and view
+counts are heavy-tailed, like a real catalog: a few SOUNDEX keys match many
+products and a few products hold most views. seed_catalog() writes them
+straight to MySQL in batches. It uses either multi-row INSERTs or LOAD DATA
+LOCAL INFILE from a temp file written row by row. The second needs
+local_infile enabled on the server. Rows whose keys already exist are
+skipped, so re-running with the same settings is a no-op.
+"""
+import logging
+import os
+import random
+import tempfile
+import time
+from decimal import Decimal
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+NOUNS = [
+    'beer', 'wine', 'coffee', 'tea', 'cider', 'juice', 'water', 'soda', 'chocolate', 'bread',
+    'cheese', 'apple', 'banana', 'orange', 'lemon', 'honey', 'butter', 'yogurt', 'granola', 'pasta',
+    'rice', 'olive', 'salsa', 'cracker', 'cookie', 'muffin', 'bagel', 'pretzel', 'popcorn', 'almond',
+    'walnut', 'pecan', 'cashew', 'peanut', 'raisin', 'cereal', 'oatmeal', 'pancake', 'syrup', 'jam',
+    'mustard', 'ketchup', 'vinegar', 'pepper', 'salt', 'sugar', 'flour', 'noodle', 'tortilla', 'hummus',
+]
+ADJECTIVES = [
+    'organic', 'classic', 'fresh', 'smoked', 'roasted', 'spicy', 'sweet', 'sour', 'golden', 'dark',
+    'light', 'crispy', 'creamy', 'wild', 'aged', 'local', 'premium', 'rustic', 'zesty', 'mild',
+]
+PHRASES = [
+    'Made in small batches with traditional methods.',
+    'A customer favorite for everyday meals.',
+    'Sourced from independent farms and producers.',
+    'Limited seasonal release while supplies last.',
+    'Perfect for sharing with friends and family.',
+    'Great on its own or as part of a recipe.',
+]
+
+# Words early in NOUNS are picked far more often, as a few categories dominate real catalogs
+NOUN_WEIGHTS = [1 / (rank + 1) for rank in range(len(NOUNS))]
+
+# view.view_count is a signed INT
+MAX_VIEWS = 2 ** 31 - 1
+
+PRODUCT_COLUMNS = ('product_id', 'name', 'description', 'image_src', 'price')
+VIEW_COLUMNS = ('product_id', 'view_count')
+
+Row = Tuple
+
+
+def generate_catalog(count: int, seed: int, start_id: int, image_src: str) -> Iterator[Tuple[Row, Optional[Row]]]:
+    """Yield (product row, view row or None) for product IDs start_id .. start_id + count - 1"""
+    rng = random.Random(seed)
+    for product_id in range(start_id, start_id + count):
+        noun = rng.choices(NOUNS, weights=NOUN_WEIGHTS)[0]
+        adjective = rng.choice(ADJECTIVES)
+        # Half are single words plus a variant number, which SOUNDEX ignores, so they share
+        # a key with the bare word; the rest are two words with keys of their own
+        if rng.random() < 0.5:
+            name = f"{noun}{rng.randint(1, 999)}"
+        else:
+            name = f"{adjective} {noun}"
+        description = f"{adjective.capitalize()} {noun}. {rng.choice(PHRASES)}"
+        price = Decimal(max(1, round(rng.lognormvariate(6.5, 1.0)))) / 100
+        views = min(int((rng.paretovariate(1.1) - 1) * 10), MAX_VIEWS)
+        # Products that were never viewed have no view row, as with the backend's upsert
+        yield (product_id, name, description, image_src, price), ((product_id, views) if views else None)
+
+
+class Progress:
+    """Logs rows written and the rate at most every interval seconds, and a summary at the end"""
+
+    def __init__(self, total: int, interval: float = 5.0):
+        self.total = total
+        self.interval = interval
+        self.rows = 0
+        self.started = time.perf_counter()
+        self.reported = self.started
+
+    def add(self, rows: int) -> None:
+        self.rows += rows
+        now = time.perf_counter()
+        if now - self.reported >= self.interval:
+            self.reported = now
+            rate = self.rows / (now - self.started)
+            logger.info(f"Wrote {self.rows}/{self.total} products ({self.rows / self.total:.0%}), {rate:,.0f} rows/s")
+
+    def finish(self) -> None:
+        elapsed = time.perf_counter() - self.started
+        logger.info(f"Wrote {self.rows} products in {elapsed:.1f}s, {self.rows / max(elapsed, 1e-9):,.0f} rows/s")
+
+
+def insert_rows(cursor, table: str, columns: Sequence[str], rows: List[Row]) -> None:
+    """INSERT IGNORE the rows; the connector sends an executemany INSERT as one multi-row statement"""
+    placeholders = ', '.join(['%s'] * len(columns))
+    cursor.executemany(f"INSERT IGNORE INTO {table} ({', '.join(columns)}) VALUES ({placeholders})", rows)
+
+
+def _tsv_field(value) -> str:
+    if value is None:
+        return '\\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+
+
+def load_rows(cursor, table: str, columns: Sequence[str], rows: Iterable[Row]) -> None:
+    """Write the rows to a temp file one at a time and LOAD DATA LOCAL INFILE it, skipping duplicate keys"""
+    with tempfile.NamedTemporaryFile('w', suffix='.tsv', encoding='utf-8', delete=False) as f:
+        path = f.name
+        for row in rows:
+            f.write('\t'.join(_tsv_field(value) for value in row))
+            f.write('\n')
+    try:
+        # LOAD DATA does not accept the file name as a parameter; tempfile names need no quoting
+        cursor.execute(
+            f"LOAD DATA LOCAL INFILE '{path}' IGNORE INTO TABLE {table} CHARACTER SET utf8mb4 "
+            f"FIELDS TERMINATED BY '\\t' LINES TERMINATED BY '\\n' ({', '.join(columns)})"
+        )
+    finally:
+        os.unlink(path)
+
+
+def seed_catalog(
+    connection, count: int, seed: int, start_id: int, image_src: str, method: str = 'insert', batch_size: int = 10000
+) -> None:
+    """Write count generated products and their view rows, committing every batch_size products"""
+    logger.info(f"Seeding {count} products from seed {seed} at IDs {start_id}+ using {method}")
+    write_catalog(connection, generate_catalog(count, seed, start_id, image_src), count, method, batch_size)
+
+
+def write_catalog(
+    connection, catalog: Iterable[Tuple[Row, Optional[Row]]], count: int, method: str = 'insert', batch_size: int = 10000
+) -> None:
+    """Write (product row, view row or None) pairs in batches of batch_size products, skipping existing keys"""
+    write = load_rows if method == 'infile' else insert_rows
+    cursor = connection.cursor()
+    # With unique_checks off InnoDB may skip checking secondary unique indexes, such as the
+    # view table's product_id key that IGNORE relies on, so it is only off for empty tables
+    cursor.execute("SELECT EXISTS(SELECT 1 FROM product) OR EXISTS(SELECT 1 FROM view)")
+    unique_checks = int(cursor.fetchall()[0][0])
+    # Products are written before the views referencing them, so skip foreign key checks
+    cursor.execute("SET SESSION foreign_key_checks = 0, unique_checks = %s", (unique_checks,))
+    progress = Progress(count)
+    try:
+        products: List[Row] = []
+        views: List[Row] = []
+        for product, view in catalog:
+            products.append(product)
+            if view is not None:
+                views.append(view)
+            if len(products) == batch_size:
+                _write_batch(connection, cursor, write, products, views, progress)
+                products, views = [], []
+        if products:
+            _write_batch(connection, cursor, write, products, views, progress)
+        # So the backend's ETags for /getall and /search change with the seeded rows
+        cursor.execute("UPDATE catalog_version SET version = version + 1 WHERE id = 1")
+        connection.commit()
+    finally:
+        cursor.execute("SET SESSION foreign_key_checks = 1, unique_checks = 1")
+        cursor.close()
+    progress.finish()
+
+
+def _write_batch(connection, cursor, write, products: List[Row], views: List[Row], progress: Progress) -> None:
+    write(cursor, 'product', PRODUCT_COLUMNS, products)
+    if views:
+        write(cursor, 'view', VIEW_COLUMNS, views)
+    connection.commit()
+    progress.add(len(products))
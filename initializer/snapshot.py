@@ -0,0 +1,132 @@
+"""Exporting the catalog to a snapshot and importing it back.
+
+The format and its reader live in catalog_snapshot. Export streams rows from
+MySQL one group at a time, and import reads the mmapped file one group at a
+time, so neither holds more than a group in memory.
+"""
+import json
+import logging
+import os
+import sys
+from array import array
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from catalog_snapshot import _LENGTH_BYTES, _TYPECODES, COLUMNS, MAGIC, VERSION, SnapshotReader
+from seed import Row, write_catalog
+
+logger = logging.getLogger(__name__)
+
+EXPORT_QUERY = """
+    SELECT p.product_id, p.name, p.description, p.image_src, p.price, v.view_count
+    FROM product p
+    LEFT JOIN view v ON p.product_id = v.product_id
+    ORDER BY p.product_id
+"""
+
+
+def _little_endian(values: array) -> bytes:
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _encode(kind: str, values: List[Any]) -> bytes:
+    if kind == 'str':
+        data = bytearray()
+        ends = array('q')
+        for value in values:
+            if value is not None:
+                data += value.encode('utf-8')
+            ends.append(len(data))
+        return _little_endian(ends) + bytes(data)
+    if kind == 'cents':
+        values = [int(round(value * 100)) for value in values]
+    return _little_endian(array(_TYPECODES[kind], [0 if value is None else value for value in values]))
+
+
+class SnapshotWriter:
+    """Writes row groups to path + '.tmp' and renames it into place once the footer is written"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path + '.tmp', 'wb')
+        self._file.write(MAGIC)
+        self._groups: List[Dict[str, Any]] = []
+        self.rows = 0
+
+    def _block(self, data: bytes) -> List[int]:
+        offset = self._file.tell()
+        self._file.write(data)
+        self._file.write(b'\0' * (-len(data) % 8))
+        return [offset, len(data)]
+
+    def write_group(self, rows: List[Tuple]) -> None:
+        """Append rows, tuples in COLUMNS order, as one row group"""
+        columns = list(zip(*rows))
+        group: Dict[str, Any] = {'rows': len(rows), 'blocks': {}, 'nulls': {}}
+        for (name, kind, nullable), values in zip(COLUMNS, columns):
+            group['blocks'][name] = self._block(_encode(kind, values))
+            if nullable:
+                group['nulls'][name] = self._block(bytes(value is None for value in values))
+        self._groups.append(group)
+        self.rows += len(rows)
+
+    def close(self) -> None:
+        footer = json.dumps({
+            'version': VERSION,
+            'rows': self.rows,
+            'columns': [[name, kind, nullable] for name, kind, nullable in COLUMNS],
+            'groups': self._groups,
+        }).encode('utf-8')
+        self._file.write(footer)
+        self._file.write(len(footer).to_bytes(_LENGTH_BYTES, 'little'))
+        self._file.write(MAGIC)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self.path + '.tmp', self.path)
+
+    def abort(self) -> None:
+        self._file.close()
+        os.unlink(self.path + '.tmp')
+
+
+def export_snapshot(connection, path: str, group_rows: int = 65536) -> int:
+    """Stream the joined catalog into a snapshot at path, returning the rows written"""
+    logger.info(f"Exporting catalog snapshot to {path}")
+    writer = SnapshotWriter(path)
+    # One consistent read, fetched group_rows at a time instead of buffered whole
+    connection.start_transaction(consistent_snapshot=True, readonly=True)
+    cursor = connection.cursor()
+    try:
+        cursor.execute(EXPORT_QUERY)
+        while True:
+            rows = cursor.fetchmany(group_rows)
+            if not rows:
+                break
+            writer.write_group(rows)
+        writer.close()
+    except BaseException:
+        writer.abort()
+        raise
+    finally:
+        cursor.close()
+        connection.rollback()
+    logger.info(f"Exported {writer.rows} products to {path} ({os.path.getsize(path):,} bytes)")
+    return writer.rows
+
+
+def _catalog(snapshot: SnapshotReader) -> Iterator[Tuple[Row, Optional[Row]]]:
+    for rows in snapshot.row_groups():
+        for product_id, name, description, image_src, price, view_count in rows:
+            view = (product_id, view_count) if view_count is not None else None
+            yield (product_id, name, description, image_src, price), view
+
+
+def import_snapshot(connection, path: str, method: str = 'insert', batch_size: int = 10000) -> int:
+    """Write every product and view row of the snapshot at path, skipping keys that already exist"""
+    with SnapshotReader(path) as snapshot:
+        logger.info(f"Importing {snapshot.rows} products from snapshot {path} using {method}")
+        write_catalog(connection, _catalog(snapshot), snapshot.rows, method, batch_size)
+        return snapshot.rows
@@ -0,0 +1,559 @@
+"""
+Load generator and latency benchmark for the retail backend.
+
+Drives a weighted mix of /search, /analytics/view, /getall, /add, /remove and
+/purchase requests over pooled keep-alive connections, either closed-loop (a
+fixed number of workers, each sending its next request when the previous one
+returns) or open-loop (requests arrive at a fixed average rate whether or not
+earlier ones have finished). Open-loop latency is measured from when each
+request was due, so a stalled server is not hidden by the generator waiting
+on it.
+
+Results are printed per endpoint and can be saved as JSON and compared
+against an earlier run:
+
+    python benchmark.py --mode open --rate 500 --duration 60 --output run.json
+    python benchmark.py --mode open --rate 500 --duration 60 --compare run.json
+
+The backend's /ready report (import and warm-up times, worker processes) is
+recorded with each run, and --import-profile adds a python -X importtime
+profile of main_server so startup regressions show up next to latency ones.
+Runs against different WEB_WORKERS settings can be lined up to show how
+throughput scales with worker count:
+
+    python benchmark.py --scaling workers-1.json workers-2.json workers-4.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import subprocess
+import sys
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Tuple
+
+import httpx
+
+BACKEND_URL = os.getenv('BACKEND_URL', 'http://localhost:8080')
+
+# Single-word names, so searches for a word or a misspelling of it find products
+WORDS = [
+    'beer', 'bear', 'bier', 'wine', 'whine', 'cider', 'sider', 'stout', 'porter', 'lager',
+    'ale', 'mead', 'sake', 'gin', 'rum', 'vodka', 'whisky', 'whiskey', 'brandy', 'cognac',
+    'tequila', 'mezcal', 'absinthe', 'vermouth', 'sherry', 'port', 'champagne', 'prosecco', 'cava', 'kombucha',
+    'coffee', 'coffe', 'tea', 'chai', 'cocoa', 'cola', 'soda', 'tonic', 'juice', 'water',
+    'lemonade', 'limeade', 'smoothie', 'milkshake', 'espresso', 'latte', 'mocha', 'matcha', 'seltzer', 'punch',
+]
+
+# Upper bounds (ms) of the latency histogram buckets; anything slower lands in the overflow bucket
+HISTOGRAM_BOUNDS_MS = [1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+ENDPOINTS = ['search', 'view', 'getall', 'add', 'remove', 'purchase']
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    """
+    Parses a request mix such as "search=40,view=30,getall=20,add=5,remove=5"
+    into endpoint weights
+    """
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"Unknown endpoint {name!r}, expected one of {', '.join(ENDPOINTS)}")
+        try:
+            mix[name] = float(weight)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Invalid weight for {name}: {weight!r}")
+    if not any(weight > 0 for weight in mix.values()):
+        raise argparse.ArgumentTypeError("The mix needs at least one positive weight")
+    return mix
+
+
+class Recorder:
+    """
+    Collects latencies and outcomes per endpoint for requests that started
+    after the warmup
+    """
+
+    def __init__(self, measure_from: float):
+        self.measure_from = measure_from
+        self.latencies: Dict[str, List[float]] = {}
+        self.statuses: Dict[str, Dict[str, int]] = {}
+        self.dropped = 0
+
+    def record(self, endpoint: str, started: float, latency: float, status: str) -> None:
+        if started < self.measure_from:
+            return
+        self.latencies.setdefault(endpoint, []).append(latency)
+        statuses = self.statuses.setdefault(endpoint, {})
+        statuses[status] = statuses.get(status, 0) + 1
+
+
+def percentile(ordered: List[float], fraction: float) -> float:
+    """
+    Nearest-rank percentile of an already sorted list
+    """
+    if not ordered:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(latencies: List[float], statuses: Dict[str, int], duration: float) -> Dict[str, Any]:
+    """
+    Latency percentiles (ms), histogram and throughput for one endpoint
+    """
+    ordered = sorted(latency * 1000 for latency in latencies)
+    histogram = {f"le_{bound}ms": 0 for bound in HISTOGRAM_BOUNDS_MS}
+    histogram["overflow"] = 0
+    bucket = 0
+    for latency in ordered:
+        while bucket < len(HISTOGRAM_BOUNDS_MS) and latency > HISTOGRAM_BOUNDS_MS[bucket]:
+            bucket += 1
+        key = f"le_{HISTOGRAM_BOUNDS_MS[bucket]}ms" if bucket < len(HISTOGRAM_BOUNDS_MS) else "overflow"
+        histogram[key] += 1
+    errors = sum(count for status, count in statuses.items() if not status.startswith('2'))
+    return {
+        "requests": len(ordered),
+        "errors": errors,
+        "statuses": dict(sorted(statuses.items())),
+        "throughput_rps": len(ordered) / duration if duration > 0 else 0.0,
+        "latency_ms": {
+            "mean": sum(ordered) / len(ordered) if ordered else 0.0,
+            "p50": percentile(ordered, 0.50),
+            "p95": percentile(ordered, 0.95),
+            "p99": percentile(ordered, 0.99),
+            "max": ordered[-1] if ordered else 0.0,
+        },
+        "histogram_ms": histogram,
+    }
+
+
+class Workload:
+    """
+    Issues one randomly chosen request of the mix at a time against a seeded
+    range of product ids
+    """
+
+    def __init__(self, client: httpx.AsyncClient, args: argparse.Namespace):
+        self.client = client
+        self.args = args
+        self.names = [name for name, weight in args.mix.items() if weight > 0]
+        self.weights = [args.mix[name] for name in self.names]
+        self.seeded = range(args.id_base, args.id_base + args.products)
+        self.next_id = args.id_base + args.products
+        # Products this run added and may remove again, so the catalog size stays put
+        self.added: Deque[int] = deque()
+        self.operations: Dict[str, Callable[[], Awaitable[httpx.Response]]] = {
+            'search': self.search,
+            'view': self.view,
+            'getall': self.getall,
+            'add': self.add,
+            'remove': self.remove,
+            'purchase': self.purchase,
+        }
+
+    def product(self, product_id: int) -> Dict[str, Any]:
+        return {
+            "product_id": product_id,
+            "name": random.choice(WORDS),
+            "description": "Benchmark product",
+            "image_src": self.args.image_src,
+            "price": round(random.uniform(1, 100), 2),
+        }
+
+    def choose(self) -> str:
+        endpoint = random.choices(self.names, self.weights)[0]
+        if endpoint == 'remove' and not self.added:
+            # Nothing of ours to remove yet; add one instead of removing seeded data
+            return 'add'
+        return endpoint
+
+    async def search(self) -> httpx.Response:
+        return await self.client.get('/search', params={"name": random.choice(WORDS)})
+
+    async def view(self) -> httpx.Response:
+        return await self.client.get(f'/analytics/view/{random.choice(self.seeded)}')
+
+    async def getall(self) -> httpx.Response:
+        return await self.client.get('/getall')
+
+    async def add(self) -> httpx.Response:
+        product_id = self.next_id
+        self.next_id += 1
+        response = await self.client.post('/add', json=self.product(product_id))
+        if response.status_code == 200:
+            self.added.append(product_id)
+        return response
+
+    async def remove(self) -> httpx.Response:
+        if not self.added:
+            # Another in-flight remove took the last one
+            return await self.add()
+        return await self.client.delete(f'/remove/{self.added.popleft()}')
+
+    async def purchase(self) -> httpx.Response:
+        return await self.client.post(
+            '/purchase', json={"user_id": random.randint(1, 1000), "product_id": random.choice(self.seeded)}
+        )
+
+    async def issue(self, endpoint: str, due: float, recorder: Recorder) -> None:
+        """
+        Sends one request and records its latency from the time it was due
+        """
+        try:
+            response = await self.operations[endpoint]()
+            # One client stands in for many users, so one user's read-your-writes pin
+            # to the primary must not send every other user's reads there too
+            self.client.cookies.clear()
+            status = str(response.status_code)
+        except httpx.TimeoutException:
+            status = 'timeout'
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        recorder.record(endpoint, due, time.perf_counter() - due, status)
+
+
+async def prepare_image(args: argparse.Namespace) -> None:
+    """
+    Creates the image object in a local GCS emulator or a local object store
+    directory so /add's image validation succeeds without reaching Google Cloud
+    """
+    bucket, _, name = args.image_src[len('gs://'):].partition('/')
+    if args.object_store_dir:
+        path = os.path.join(args.object_store_dir, bucket, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'benchmark image')
+        print(f"Prepared {args.image_src} in the local object store at {args.object_store_dir}")
+        return
+    if not args.gcs_emulator:
+        return
+    async with httpx.AsyncClient(base_url=args.gcs_emulator, timeout=args.timeout) as gcs:
+        response = await gcs.post('/storage/v1/b', params={"project": "bench"}, json={"name": bucket})
+        if response.status_code not in (200, 409):
+            response.raise_for_status()
+        response = await gcs.post(
+            f'/upload/storage/v1/b/{bucket}/o',
+            params={"uploadType": "media", "name": name},
+            content=b'benchmark image',
+            headers={"Content-Type": "image/png"},
+        )
+        response.raise_for_status()
+    print(f"Prepared {args.image_src} in the GCS emulator at {args.gcs_emulator}")
+
+
+async def seed_products(client: httpx.AsyncClient, workload: Workload, args: argparse.Namespace) -> None:
+    """
+    Loads the product id range views and purchases draw from through /add/batch;
+    ids that already exist from an earlier run are left as they are
+    """
+    added = 0
+    for start in range(args.id_base, args.id_base + args.products, 1000):
+        batch = [workload.product(product_id) for product_id in range(start, min(start + 1000, args.id_base + args.products))]
+        response = await client.post('/add/batch', json=batch, timeout=max(args.timeout, 120))
+        response.raise_for_status()
+        added += response.json()['added']
+    print(f"Seeded {args.products} products starting at ID {args.id_base} ({added} new)")
+
+
+async def run_closed(workload: Workload, recorder: Recorder, end: float, concurrency: int) -> None:
+    """
+    Closed loop: each worker sends its next request as soon as the last one completes
+    """
+    async def worker():
+        while time.perf_counter() < end:
+            await workload.issue(workload.choose(), time.perf_counter(), recorder)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+async def run_open(workload: Workload, recorder: Recorder, end: float, rate: float, max_inflight: int) -> None:
+    """
+    Open loop: requests arrive as a Poisson process at the given average rate,
+    independent of how fast earlier ones complete
+    """
+    inflight = set()
+    due = time.perf_counter()
+    while True:
+        due += random.expovariate(rate)
+        if due >= end:
+            break
+        delay = due - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if len(inflight) >= max_inflight:
+            # The generator would only be measuring its own queue from here on
+            if due >= recorder.measure_from:
+                recorder.dropped += 1
+            continue
+        task = asyncio.ensure_future(workload.issue(workload.choose(), due, recorder))
+        inflight.add(task)
+        task.add_done_callback(inflight.discard)
+    if inflight:
+        await asyncio.wait(inflight)
+
+
+async def wait_ready(client: httpx.AsyncClient, timeout: float) -> Dict[str, Any]:
+    """
+    Polls /ready until the backend reports itself warm and returns its report
+    """
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            response = await client.get('/ready')
+            if response.status_code == 200:
+                return response.json()
+        except httpx.TransportError:
+            pass
+        if time.perf_counter() > deadline:
+            raise SystemExit(f"Backend at {client.base_url} not ready after {timeout}s")
+        await asyncio.sleep(0.5)
+
+
+def profile_imports(backend_dir: str, python: str, top: int = 10) -> Dict[str, Any]:
+    """
+    Imports main_server under python -X importtime in a fresh interpreter and
+    returns its total import time and the slowest modules it imports directly
+    """
+    env = {
+        **os.environ,
+        'MYSQL_HOST': 'localhost', 'MYSQL_PORT': '3306', 'MYSQL_USER': 'bench', 'MYSQL_PASSWORD': 'bench', 'MYSQL_DATABASE': 'bench',
+        'GOOGLE_CLOUD_PROJECT': os.getenv('GOOGLE_CLOUD_PROJECT', 'bench'),
+    }
+    start = time.perf_counter()
+    completed = subprocess.run(
+        [python, '-X', 'importtime', '-c', 'import main_server'],
+        cwd=backend_dir, env=env, capture_output=True, text=True,
+    )
+    wall = time.perf_counter() - start
+    if completed.returncode != 0:
+        raise SystemExit(f"Importing main_server failed:\n{completed.stderr[-2000:]}")
+    # Lines look like "import time: self [us] | cumulative | name"; nested imports are indented
+    # two spaces per level and listed before the module that imported them
+    total = 0
+    modules: Dict[str, int] = {}
+    children: Dict[str, int] = {}
+    for match in re.finditer(r'^import time:\s+\d+ \|\s+(\d+) \| ( *)(\S+)$', completed.stderr, re.MULTILINE):
+        cumulative, depth, name = int(match.group(1)), len(match.group(2)) // 2, match.group(3)
+        if depth == 1:
+            children[name] = cumulative
+        elif depth == 0:
+            if name == 'main_server':
+                total, modules = cumulative, children
+            children = {}
+    slowest = sorted(modules.items(), key=lambda item: item[1], reverse=True)[:top]
+    return {
+        "wall_ms": wall * 1000,
+        "imports_ms": total / 1000,
+        "slowest_ms": {name: us / 1000 for name, us in slowest},
+    }
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    await prepare_image(args)
+    limits = httpx.Limits(max_connections=args.connections, max_keepalive_connections=args.connections)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=args.timeout) as client:
+        ready = await wait_ready(client, args.ready_timeout)
+        workload = Workload(client, args)
+        if not args.skip_seed:
+            await seed_products(client, workload, args)
+        started_at = datetime.now(timezone.utc).isoformat()
+        start = time.perf_counter()
+        recorder = Recorder(start + args.warmup)
+        end = start + args.warmup + args.duration
+        print(f"Running {args.mode}-loop for {args.duration}s after {args.warmup}s warmup...")
+        if args.mode == 'closed':
+            await run_closed(workload, recorder, end, args.concurrency)
+        else:
+            await run_open(workload, recorder, end, args.rate, args.max_inflight)
+        # Requests still completing after the window ended count toward it
+        elapsed = max(time.perf_counter(), end) - recorder.measure_from
+
+    endpoints = {
+        endpoint: summarize(recorder.latencies[endpoint], recorder.statuses[endpoint], elapsed)
+        for endpoint in ENDPOINTS if endpoint in recorder.latencies
+    }
+    overall_statuses: Dict[str, int] = {}
+    for statuses in recorder.statuses.values():
+        for status, count in statuses.items():
+            overall_statuses[status] = overall_statuses.get(status, 0) + count
+    overall = summarize(
+        [latency for latencies in recorder.latencies.values() for latency in latencies], overall_statuses, elapsed
+    )
+    overall["dropped"] = recorder.dropped
+    config = {key: value for key, value in vars(args).items() if key not in ('output', 'compare')}
+    startup = {
+        "import_ms": ready['import_seconds'] * 1000,
+        "warmup_ms": {component: seconds * 1000 for component, seconds in ready['warmup_seconds'].items()},
+    }
+    if args.import_profile:
+        startup["import_profile"] = profile_imports(args.import_profile, args.import_python)
+    return {
+        "started_at": started_at, "config": config, "duration_s": elapsed, "endpoints": endpoints, "overall": overall,
+        "startup": startup, "server": {"workers": ready.get('workers', 1)},
+    }
+
+
+def print_results(results: Dict[str, Any]) -> None:
+    """
+    Prints one line of throughput and latency per endpoint
+    """
+    print(f"\n{'endpoint':<10} {'requests':>9} {'errors':>7} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    rows = list(results['endpoints'].items()) + [('overall', results['overall'])]
+    for endpoint, stats in rows:
+        latency = stats['latency_ms']
+        print(
+            f"{endpoint:<10} {stats['requests']:>9} {stats['errors']:>7} {stats['throughput_rps']:>9.1f} "
+            f"{latency['p50']:>9.2f} {latency['p95']:>9.2f} {latency['p99']:>9.2f} {latency['max']:>9.2f}"
+        )
+    if results['overall']['dropped']:
+        print(f"Dropped {results['overall']['dropped']} arrivals at the in-flight limit")
+    startup = results['startup']
+    warmup = ', '.join(f"{component} {ms:.0f} ms" for component, ms in startup['warmup_ms'].items())
+    print(f"\nServer: {results.get('server', {}).get('workers', 1)} worker processes")
+    print(f"Startup: main_server import {startup['import_ms']:.0f} ms, warm after {warmup}")
+    profile = startup.get('import_profile')
+    if profile:
+        print(f"Import profile: {profile['imports_ms']:.0f} ms of imports, {profile['wall_ms']:.0f} ms interpreter wall time")
+        for name, ms in profile['slowest_ms'].items():
+            print(f"  {name:<30} {ms:>9.1f} ms")
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """
+    Lists endpoints whose p99 latency grew, or whose throughput or error-free
+    share fell, by more than threshold relative to the baseline run
+    """
+    regressions = []
+    print(f"\nCompared with the run started {baseline['started_at']}:")
+    load = ('mode', 'concurrency', 'rate', 'mix', 'duration')
+    if any(results['config'].get(key) != baseline['config'].get(key) for key in load):
+        print(f"  Note: the baseline used a different load ({', '.join(load)}), throughput is not comparable")
+    workers = (baseline.get('server', {}).get('workers', 1), results.get('server', {}).get('workers', 1))
+    if workers[0] != workers[1]:
+        print(f"  Note: the baseline ran {workers[0]} worker processes and this run {workers[1]}")
+    for endpoint, stats in list(results['endpoints'].items()) + [('overall', results['overall'])]:
+        before = baseline['overall'] if endpoint == 'overall' else baseline['endpoints'].get(endpoint)
+        if before is None:
+            continue
+        changes: List[Tuple[str, float, float, bool]] = [
+            ('p50 ms', before['latency_ms']['p50'], stats['latency_ms']['p50'], False),
+            ('p99 ms', before['latency_ms']['p99'], stats['latency_ms']['p99'], True),
+            ('rps', before['throughput_rps'], stats['throughput_rps'], True),
+        ]
+        parts = []
+        for label, old, new, gated in changes:
+            change = (new - old) / old if old else 0.0
+            parts.append(f"{label} {old:.2f} -> {new:.2f} ({change:+.1%})")
+            worse = change < -threshold if label == 'rps' else change > threshold
+            if gated and worse:
+                regressions.append(f"{endpoint} {label}")
+        old_errors = before['errors'] / before['requests'] if before['requests'] else 0.0
+        new_errors = stats['errors'] / stats['requests'] if stats['requests'] else 0.0
+        parts.append(f"errors {old_errors:.2%} -> {new_errors:.2%}")
+        if new_errors - old_errors > threshold / 10:
+            regressions.append(f"{endpoint} errors")
+        print(f"  {endpoint:<10} " + ", ".join(parts))
+    old_profile = baseline.get('startup', {}).get('import_profile')
+    new_profile = results['startup'].get('import_profile')
+    if old_profile and new_profile:
+        old, new = old_profile['imports_ms'], new_profile['imports_ms']
+        change = (new - old) / old if old else 0.0
+        print(f"  {'imports':<10} ms {old:.1f} -> {new:.1f} ({change:+.1%})")
+        if change > threshold:
+            regressions.append("import time")
+    return regressions
+
+
+def print_scaling(runs: List[Dict[str, Any]]) -> None:
+    """
+    Prints overall throughput and latency of runs by backend worker count,
+    with each run's speedup over the run with the fewest workers
+    """
+    runs = sorted(runs, key=lambda run: run.get('server', {}).get('workers', 1))
+    base_workers = runs[0].get('server', {}).get('workers', 1)
+    base_rps = runs[0]['overall']['throughput_rps']
+    print(f"\n{'workers':>7} {'rps':>9} {'speedup':>8} {'efficiency':>11} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for run in runs:
+        workers = run.get('server', {}).get('workers', 1)
+        overall = run['overall']
+        speedup = overall['throughput_rps'] / base_rps if base_rps else 0.0
+        print(
+            f"{workers:>7} {overall['throughput_rps']:>9.1f} {speedup:>7.2f}x "
+            f"{speedup * base_workers / workers:>11.0%} {overall['latency_ms']['p50']:>9.2f} "
+            f"{overall['latency_ms']['p99']:>9.2f} {overall['errors']:>7}"
+        )
+    if len({(run['config']['mode'], run['config']['concurrency'], run['config']['rate']) for run in runs}) > 1:
+        print("Note: the runs used different loads, so their throughput is not directly comparable")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the retail backend under a configurable request mix")
+    parser.add_argument('--url', default=BACKEND_URL, help="Backend base URL")
+    parser.add_argument('--mode', choices=['closed', 'open'], default='closed', help="Closed-loop workers or open-loop arrivals")
+    parser.add_argument('--concurrency', type=int, default=50, help="Workers in closed-loop mode")
+    parser.add_argument('--rate', type=float, default=500, help="Average requests per second in open-loop mode")
+    parser.add_argument('--max-inflight', type=int, default=10000, help="Open-loop arrivals beyond this many outstanding requests are dropped")
+    parser.add_argument('--duration', type=float, default=30, help="Measured seconds")
+    parser.add_argument('--warmup', type=float, default=5, help="Seconds of load before measuring starts")
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('search=40,view=30,getall=20,add=5,remove=5'),
+                        help="Endpoint weights, e.g. search=40,view=30,getall=20,add=5,remove=5,purchase=0")
+    parser.add_argument('--connections', type=int, default=100, help="Pooled keep-alive connections to the backend")
+    parser.add_argument('--timeout', type=float, default=10, help="Per-request timeout in seconds")
+    parser.add_argument('--products', type=int, default=1000, help="Size of the product ID range viewed and purchased")
+    parser.add_argument('--skip-seed', action='store_true', help="Reuse products seeded by an earlier run instead of adding them through /add/batch")
+    parser.add_argument('--id-base', type=int, default=10000000, help="First product ID the benchmark seeds and adds")
+    parser.add_argument('--image-src', default='gs://bench-images/sample.png', help="image_src of seeded and added products")
+    parser.add_argument('--gcs-emulator', default=os.getenv('STORAGE_EMULATOR_HOST'),
+                        help="GCS emulator URL in which to create the image (defaults to STORAGE_EMULATOR_HOST)")
+    parser.add_argument('--object-store-dir', default=os.getenv('OBJECT_STORE_DIR'),
+                        help="Directory of a backend running with OBJECT_STORE=local in which to create the image")
+    parser.add_argument('--ready-timeout', type=float, default=120, help="Seconds to wait for the backend's /ready to report it warm")
+    parser.add_argument('--import-profile', metavar='BACKEND_DIR',
+                        help="Profile importing main_server from this directory with python -X importtime")
+    parser.add_argument('--import-python', default=sys.executable,
+                        help="Interpreter with the backend's dependencies installed, for --import-profile")
+    parser.add_argument('--seed', type=int, default=None, help="Random seed for a reproducible request sequence")
+    parser.add_argument('--output', help="Write results to this JSON file")
+    parser.add_argument('--compare', help="Baseline results JSON to check for regressions")
+    parser.add_argument('--threshold', type=float, default=0.10, help="Relative change that counts as a regression")
+    parser.add_argument('--scaling', nargs='+', metavar='RESULTS',
+                        help="Only print throughput by worker count across these results files, without running")
+    args = parser.parse_args()
+    if args.scaling:
+        runs = []
+        for path in args.scaling:
+            with open(path) as f:
+                runs.append(json.load(f))
+        print_scaling(runs)
+        return
+    if args.products < 1:
+        parser.error("--products must be at least 1")
+    random.seed(args.seed)
+
+    results = asyncio.run(run(args))
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\nRegressions beyond {args.threshold:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+        print("\nNo regressions")
+
+
+if __name__ == "__main__":
+    main()
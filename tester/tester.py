@@ -1,21 +1,54 @@
 import requests
+import argparse
 import json
-from typing import List, Dict
+import os
+from typing import List, Dict, Optional
 from datetime import datetime
 
+BACKEND_URL = os.getenv('BACKEND_URL', 'http://localhost:8080')
+
 def get_all_products() -> List[Dict]:
     """
     Fetches all products from the /getall endpoint
     Returns a list of product dictionaries
     """
     try:
-        response = requests.get('http://localhost:8080/getall')
+        response = requests.get(f'{BACKEND_URL}/getall')
         response.raise_for_status()  # Raise an exception for bad status codes
         return response.json()['products']
     except requests.exceptions.RequestException as e:
         print(f"Error fetching products: {e}")
         return []
 
+def bulk_add_products(path: str) -> Optional[Dict]:
+    """
+    Streams an NDJSON file of products (one ProductAdd object per line)
+    to the /add/batch endpoint and returns its per-item summary
+    """
+    try:
+        with open(path, 'rb') as f:
+            response = requests.post(
+                f'{BACKEND_URL}/add/batch',
+                data=f,
+                headers={'Content-Type': 'application/x-ndjson'},
+            )
+        response.raise_for_status()
+        return response.json()
+    except (OSError, requests.exceptions.RequestException) as e:
+        print(f"Error adding products in bulk: {e}")
+        return None
+
+def print_bulk_summary(summary: Dict) -> None:
+    """
+    Prints the outcome of a bulk add, listing only the failed items
+    """
+    print("\n=== Bulk Add ===")
+    print(f"Added: {summary['added']}")
+    print(f"Failed: {summary['failed']}")
+    for result in summary['results']:
+        if result['status'] != 'ok':
+            print(f"  #{result['index']} (ID {result.get('product_id')}): {result['detail']}")
+
 def print_products(products: List[Dict]) -> None:
     """
     Prints products in a formatted way
@@ -38,6 +71,16 @@ def print_products(products: List[Dict]) -> None:
         print("-" * 50)
 
 def main():
+    parser = argparse.ArgumentParser(description="Exercise the retail backend")
+    parser.add_argument('--bulk', metavar='FILE', help="NDJSON file of products to load through /add/batch first")
+    args = parser.parse_args()
+
+    if args.bulk:
+        print(f"Testing /add/batch endpoint with {args.bulk}...")
+        summary = bulk_add_products(args.bulk)
+        if summary:
+            print_bulk_summary(summary)
+
     print("Testing /getall endpoint...")
     products = get_all_products()
     print_products(products)
@@ -217,13 +217,14 @@ resource "kubernetes_deployment" "retail_backend" {
             timeout_seconds      = 5
           }
 
+          # /ready turns 200 once pooled connections and in-memory state are warm
           readiness_probe {
             http_get {
-              path = "/health"
+              path = "/ready"
               port = 8080
             }
-            initial_delay_seconds = 5
-            period_seconds       = 10
+            initial_delay_seconds = 1
+            period_seconds       = 2
             timeout_seconds      = 5
           }
         }